@@ -1,23 +1,13 @@
-import os
-import subprocess
+"""Submit all bins in runs/ as one DAG; see pipeline/submit_bins.py for options.
 
-# Get current working directory
-#base_dir = os.getcwd()
-base_dir = os.path.expanduser('~/ecc_pe/gw200105/seob/workflow/runs')
+e.g. 'python run_all.py --max-jobs 10' or 'python run_all.py --scheduler local'.
+"""
+import os
+import sys
 
-# Loop through all subdirectories starting with 'e_'
-for dirname in sorted(os.listdir(base_dir)):
-    dirpath = os.path.join(base_dir, dirname)
-    submit_file = os.path.join(dirpath, 'submit.sub')
+# Shared workflow helpers live in pipeline/ at the top of the repo
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, "..", "..", "..", "pipeline"))
+import submit_bins
 
-    # Check if it's a directory and has a submit file
-    if os.path.isdir(dirpath) and os.path.isfile(submit_file):
-        print(f"[INFO] Submitting job in: {dirname}")
-        try:
-            result = subprocess.run(['condor_submit', 'submit.sub'], cwd=dirpath, check=True, capture_output=True, text=True)
-            print(result.stdout.strip())
-        except subprocess.CalledProcessError as e:
-            print(f"[ERROR] Failed to submit job in {dirname}")
-            print(e.stderr.strip())
-    else:
-        print(f"[SKIP] No submit.sub in {dirname}")
+submit_bins.main(["--runs-dir", os.path.join(here, "runs")] + sys.argv[1:])
@@ -0,0 +1,131 @@
+"""Compare the marginalized_time and relative_time likelihoods of a config.
+
+Builds both models from one config.ini (the second with the
+relative-binning settings of heterodyne.py, fiducial waveform from the
+pilot posterior) and evaluates them at the same --npoints parameter
+points drawn from the pilot, re-seeding numpy before every call so both
+models see the same random state for their marginalization draws. Prints
+the setup time and the median time per likelihood call of each model,
+the speed-up, and the distribution of loglr differences. As a yardstick
+for the latter, the full model is evaluated a second time with different
+seeds: its own Monte Carlo scatter from the vector marginalization.
+
+Needs pycbc, the waveform plugins and the event's data, like the jobs.
+
+Usage:
+    python benchmark_relbin.py --config-file ../gw170817/seob/config.ini \\
+        --pilot-file ../gw170817/seob/posteriors.hdf
+    python benchmark_relbin.py --config-file ../gw200105/seob/workflow/runs/e_0p050/config.ini \\
+        --pilot-file ../gw200105/seob/workflow/posteriors.hdf --npoints 100
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import heterodyne
+from inifile import IniFile
+
+
+def build_model(config_path):
+    from pycbc.inference import models
+    from pycbc.workflow import WorkflowConfigParser
+
+    start = time.perf_counter()
+    model = models.read_from_config(WorkflowConfigParser([config_path]))
+    return model, time.perf_counter() - start
+
+
+def draw_points(model, pilot, npoints, rng):
+    """npoints dicts of the model's variable parameters, from the pilot where it has them."""
+    n = len(next(iter(pilot.values())))
+    rows = rng.choice(n, npoints, replace=npoints > n)
+    missing = [p for p in model.variable_params if p not in pilot]
+    prior = model.prior_distribution.rvs(size=npoints) if missing else None
+    points = []
+    for k, row in enumerate(rows):
+        point = {p: float(pilot[p][row]) for p in model.variable_params if p in pilot}
+        point.update({p: float(prior[p][k]) for p in missing})
+        points.append(point)
+    return points
+
+
+def time_loglr(model, points, seed):
+    """(loglr values, seconds per call) at each point."""
+    values, times = np.empty(len(points)), np.empty(len(points))
+    for k, point in enumerate(points):
+        np.random.seed(seed + k)
+        model.update(**point)
+        start = time.perf_counter()
+        values[k] = model.loglr
+        times[k] = time.perf_counter() - start
+    return values, times
+
+
+def benchmark(config_path, pilot_file, npoints=50, epsilon=heterodyne.EPSILON,
+              lo=None, hi=None, seed=0):
+    config = IniFile.read(config_path)
+    pilot = heterodyne.read_pilot(pilot_file)
+    prior = config.get("prior-eccentricity", "name") \
+        if config.has("prior-eccentricity", "name") else "uniform"
+    lo = float(config.get("prior-eccentricity", "min-eccentricity")) if lo is None else lo
+    hi = float(config.get("prior-eccentricity", "max-eccentricity")) if hi is None else hi
+    trigger_time = config.get("data", "trigger-time") if config.has("data", "trigger-time") else None
+    fid = heterodyne.fiducial_params(pilot, lo, hi, prior=prior, trigger_time=trigger_time)
+
+    heterodyne.register_sequences(config_path)
+    # the relative_time config sits next to the original so relative paths still work
+    fd, relbin_path = tempfile.mkstemp(suffix=".ini", prefix=".relbin-",
+                                       dir=os.path.dirname(os.path.abspath(config_path)))
+    with os.fdopen(fd, "w") as f:
+        f.write(config.render(heterodyne.relbin_overrides(fid, epsilon)))
+    try:
+        print(f"[INFO] Setting up marginalized_time model for {config_path}")
+        full, full_setup = build_model(config_path)
+        print(f"[INFO] Setting up relative_time model (epsilon = {epsilon:g})")
+        relbin, relbin_setup = build_model(relbin_path)
+    finally:
+        os.remove(relbin_path)
+
+    points = draw_points(full, pilot, npoints, np.random.default_rng(seed))
+    full_ll, full_t = time_loglr(full, points, seed)
+    repeat_ll, _ = time_loglr(full, points, seed + npoints)
+    relbin_ll, relbin_t = time_loglr(relbin, points, seed)
+
+    diff = np.abs(relbin_ll - full_ll)
+    noise = np.abs(repeat_ll - full_ll)
+    print(f"Config: {config_path}")
+    print("Fiducial: " + ", ".join(f"{p}={v:.6g}" for p, v in fid.items()))
+    print(f"{'':<20s}{'setup [s]':>12s}{'loglr [ms]':>14s}")
+    print(f"{'marginalized_time':<20s}{full_setup:>12.1f}{1e3 * np.median(full_t):>14.2f}")
+    print(f"{'relative_time':<20s}{relbin_setup:>12.1f}{1e3 * np.median(relbin_t):>14.2f}")
+    print(f"Speed-up per call: {np.median(full_t) / np.median(relbin_t):.1f}x")
+    print(f"|delta loglr| relative_time vs full:  median {np.median(diff):.3f}, "
+          f"90% {np.percentile(diff, 90):.3f}, max {np.max(diff):.3f}")
+    print(f"|delta loglr| full vs full (reseeded): median {np.median(noise):.3f}, "
+          f"90% {np.percentile(noise, 90):.3f}, max {np.max(noise):.3f}")
+    return {"full_time": full_t, "relbin_time": relbin_t, "full_loglr": full_ll,
+            "relbin_loglr": relbin_ll, "repeat_loglr": repeat_ll}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config-file", required=True,
+                        help="marginalized_time config.ini (a base or bin config)")
+    parser.add_argument("--pilot-file", required=True,
+                        help="Posterior file for the fiducial waveform and test points")
+    parser.add_argument("--npoints", type=int, default=50)
+    parser.add_argument("--epsilon", type=float, default=heterodyne.EPSILON)
+    parser.add_argument("--ecc-min", type=float, default=None,
+                        help="Bin the fiducial is taken from (default: the config's prior)")
+    parser.add_argument("--ecc-max", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    opts = parser.parse_args(args)
+    benchmark(opts.config_file, opts.pilot_file, npoints=opts.npoints, epsilon=opts.epsilon,
+              lo=opts.ecc_min, hi=opts.ecc_max, seed=opts.seed)
+
+
+if __name__ == "__main__":
+    main()
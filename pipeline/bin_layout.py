@@ -0,0 +1,291 @@
+"""Eccentricity bin edges for the binned workflows.
+
+Layouts:
+  linear    equal-width bins stepping from ecc_min to ecc_max (the default)
+  log10     bins equally spaced in log10(e), for ``uniform_log10`` priors
+  adaptive  bins of equal posterior mass from pilot evidences or samples
+  [edges]   an explicit, increasing list of edges
+
+The adaptive layout uses either the evidences of a previous set of bins or
+the samples of one cheap pilot run over the whole prior, so bins are narrow
+where the posterior is peaked and wide where it is flat. A fraction of
+prior mass is mixed in so that regions the pilot found unlikely are still
+covered by (wide) bins. It works in the coordinate the parent prior is
+uniform in, i.e. log10(e) for ``uniform_log10``.
+
+Every bin keeps the prior type of the parent prior; restricting a uniform
+or uniform_log10 prior to a sub-interval gives the same prior type over
+that interval, which is what merge_bins.py assumes when it recombines them.
+
+Usage:
+    python bin_layout.py --pilot-runs-dir pilot --nbins 20
+    python bin_layout.py --pilot-file pilot/result.hdf --mass-error 0.01 --bin-dlogz 0.1
+"""
+import argparse
+import glob
+import math
+import os
+
+import h5py
+import numpy as np
+
+from merge_bins import read_bin_prior
+from resample import WEIGHT_COLUMN
+
+
+def linear_edges(lo, hi, step):
+    """Edges of equal-width bins, as laid out by the original master.py."""
+    # whole steps only, as master.py truncated; the epsilon absorbs float error
+    num_bins = math.floor((hi - lo) / step + 1e-9)
+    return [round(lo + i * step, 5) for i in range(num_bins + 1)]
+
+
+def log10_edges(lo, hi, nbins, sig=4):
+    """Edges of nbins bins equally spaced in log10(e)."""
+    if lo <= 0:
+        raise ValueError(f"log10 bins need a positive lower edge, got {lo}")
+    edges = np.logspace(np.log10(lo), np.log10(hi), nbins + 1)
+    edges = [float(f"{e:.{sig}g}") for e in edges]
+    edges[0], edges[-1] = lo, hi
+    return edges
+
+
+def check_edges(edges):
+    """Validate an explicit list of edges and return it as floats."""
+    edges = [float(e) for e in edges]
+    if len(edges) < 2:
+        raise ValueError("Need at least two bin edges")
+    if any(b <= a for a, b in zip(edges[:-1], edges[1:])):
+        raise ValueError(f"Bin edges must be strictly increasing: {edges}")
+    return edges
+
+
+def parse_edges(text):
+    """Parse a comma or whitespace separated list of edges."""
+    return check_edges(text.replace(",", " ").split())
+
+
+def prior_space(prior_name):
+    """Coordinate a bin prior is uniform in ("linear" or "log10")."""
+    if prior_name == "uniform_log10":
+        return "log10"
+    if prior_name == "uniform":
+        return "linear"
+    raise ValueError(f"Unsupported bin prior '{prior_name}'")
+
+
+def format_edge(e):
+    """Format an edge for config.ini, keeping full precision for log edges."""
+    if round(e, 5) == e:
+        return f"{e:.5f}"
+    return f"{e:.6g}"
+
+
+def bin_dir_names(edges, decimals=3):
+    """Run directory names (e_0p005, ...) for the lower edge of each bin.
+
+    Extra decimals are used only when needed to keep the names unique.
+    """
+    lows = edges[:-1]
+    while True:
+        names = [f"e_{lo:.{decimals}f}".replace(".", "p") for lo in lows]
+        if len(set(names)) == len(names) or decimals >= 10:
+            return names
+        decimals += 1
+
+
+def read_pilot_evidence(runs_dir, param="eccentricity"):
+    """Return (edges, log evidence, dlog evidence) of finished pilot bins."""
+    bins = []
+    for bin_dir in glob.glob(os.path.join(runs_dir, "e_*")):
+        result = os.path.join(bin_dir, "result.hdf")
+        config = os.path.join(bin_dir, "config.ini")
+        if not (os.path.isfile(result) and os.path.isfile(config)):
+            continue
+        with h5py.File(result, "r") as f:
+            if "log_evidence" not in f.attrs:
+                continue
+            logz = float(f.attrs["log_evidence"])
+            dlogz = float(f.attrs.get("dlog_evidence", 0.0))
+        _, lo, hi = read_bin_prior(config, param)
+        bins.append((lo, hi, logz, dlogz))
+    if not bins:
+        raise RuntimeError(f"No finished pilot bins under {runs_dir}")
+
+    bins.sort()
+    for (_, hi, _, _), (lo, _, _, _) in zip(bins[:-1], bins[1:]):
+        if not np.isclose(hi, lo):
+            raise ValueError(f"Pilot bins in {runs_dir} do not tile the prior "
+                             f"({hi} != {lo})")
+    edges = np.array([b[0] for b in bins] + [bins[-1][1]])
+    return edges, np.array([b[2] for b in bins]), np.array([b[3] for b in bins])
+
+
+def read_pilot_samples(path, param="eccentricity"):
+    """Return (samples, weights) of a single pilot run over the full prior."""
+    with h5py.File(path, "r") as f:
+        samples = f["samples"][param][:]
+        if WEIGHT_COLUMN in f["samples"]:
+            logwt = f["samples"][WEIGHT_COLUMN][:]
+            weights = np.exp(logwt - logwt.max())
+        else:
+            weights = np.ones_like(samples)
+        dlogz = float(f.attrs.get("dlog_evidence", 0.0))
+    return samples, weights, dlogz
+
+
+def bins_for_mass_error(bin_dlogz, mass_error):
+    """Number of equal-mass bins that keeps each bin's mass error below target.
+
+    A bin of posterior mass m run to an evidence error dlogz carries an
+    absolute mass error of about m * dlogz. With n equal-mass bins that is
+    dlogz / n, so n = ceil(dlogz / mass_error).
+    """
+    return max(int(math.ceil(bin_dlogz / mass_error)), 1)
+
+
+def equal_mass_edges(cell_edges, cell_mass, nbins, prior_floor=0.05,
+                     min_width=0.001, decimals=5):
+    """Split cells with the given posterior masses into nbins equal-mass bins.
+
+    The posterior is taken to be uniform within each cell and is mixed with
+    a ``prior_floor`` fraction of the (uniform) prior before splitting.
+    Inner edges closer than ``min_width`` to the previous edge are dropped.
+    """
+    cell_edges = np.asarray(cell_edges, dtype=float)
+    widths = np.diff(cell_edges)
+    mass = np.asarray(cell_mass, dtype=float)
+    mass = (1 - prior_floor) * mass / mass.sum() + prior_floor * widths / widths.sum()
+
+    cdf = np.concatenate([[0.0], np.cumsum(mass)])
+    cdf /= cdf[-1]
+    inner = np.interp(np.linspace(0, 1, nbins + 1)[1:-1], cdf, cell_edges)
+
+    edges = [cell_edges[0]]
+    for e in np.round(inner, decimals):
+        if e - edges[-1] >= min_width and cell_edges[-1] - e >= min_width:
+            edges.append(float(e))
+    edges.append(cell_edges[-1])
+    return [round(float(e), decimals) for e in edges]
+
+
+def adaptive_edges_from_evidence(edges, log_evidence, nbins, **kwargs):
+    """Equal-mass layout from the evidences of an existing set of bins."""
+    widths = np.diff(edges)
+    logmass = np.asarray(log_evidence) + np.log(widths)
+    return equal_mass_edges(edges, np.exp(logmass - logmass.max()), nbins, **kwargs)
+
+
+def adaptive_edges_from_samples(samples, lo, hi, nbins, weights=None,
+                                ncells=200, **kwargs):
+    """Equal-mass layout from the posterior samples of a pilot run."""
+    cell_edges = np.linspace(lo, hi, ncells + 1)
+    mass, _ = np.histogram(samples, bins=cell_edges, weights=weights)
+    return equal_mass_edges(cell_edges, mass, nbins, **kwargs)
+
+
+def adaptive_edges(ecc_min, ecc_max, nbins=None, pilot_runs_dir=None,
+                   pilot_file=None, mass_error=None, bin_dlogz=None,
+                   param="eccentricity", space="linear", **kwargs):
+    """Lay out adaptive bin edges from either pilot bins or a pilot run.
+
+    Give either ``nbins`` or ``mass_error``; if ``mass_error`` is set the
+    number of bins follows from ``bin_dlogz`` (defaulting to the pilot's
+    median evidence error) and ``nbins`` is ignored. With ``space="log10"``
+    the layout is done in log10(e) and ``min_width`` is in decades.
+    """
+    if space == "log10":
+        if ecc_min <= 0:
+            raise ValueError(f"log10 bins need a positive lower edge, got {ecc_min}")
+        fwd, inv = np.log10, lambda x: 10 ** np.asarray(x)
+    else:
+        fwd = inv = np.asarray
+
+    if pilot_runs_dir is not None:
+        edges, logz, dlogz = read_pilot_evidence(pilot_runs_dir, param)
+        if not (np.isclose(edges[0], ecc_min) and np.isclose(edges[-1], ecc_max)):
+            print(f"[WARN] Pilot bins cover [{edges[0]}, {edges[-1]}], "
+                  f"not [{ecc_min}, {ecc_max}]")
+        pilot_dlogz = float(np.median(dlogz))
+    elif pilot_file is not None:
+        samples, weights, pilot_dlogz = read_pilot_samples(pilot_file, param)
+    else:
+        raise ValueError("Need pilot_runs_dir or pilot_file for an adaptive layout")
+
+    if mass_error is not None:
+        nbins = bins_for_mass_error(bin_dlogz or pilot_dlogz, mass_error)
+    elif nbins is None:
+        raise ValueError("Need nbins or mass_error for an adaptive layout")
+
+    if pilot_runs_dir is not None:
+        new = adaptive_edges_from_evidence(fwd(edges), logz, nbins, **kwargs)
+    else:
+        new = adaptive_edges_from_samples(fwd(samples), fwd(ecc_min), fwd(ecc_max),
+                                          nbins, weights=weights, **kwargs)
+    if space == "log10":
+        new = [float(f"{e:.4g}") for e in inv(new)]
+        new[0], new[-1] = ecc_min, ecc_max
+    return [float(e) for e in new]
+
+
+def make_edges(layout, ecc_min, ecc_max, step=None, nbins=None,
+               prior="uniform", **adaptive_kwargs):
+    """Bin edges for any of the supported layouts (see module docstring).
+
+    ``prior`` is the name of the parent prior; its coordinate is used for
+    the adaptive layout and a uniform_log10 prior must stay above zero.
+    """
+    space = prior_space(prior)
+    if isinstance(layout, (list, tuple)):
+        edges = check_edges(layout)
+    elif layout == "linear":
+        edges = linear_edges(ecc_min, ecc_max, step)
+    elif layout == "log10":
+        edges = log10_edges(ecc_min, ecc_max, nbins)
+    elif layout == "adaptive":
+        edges = adaptive_edges(ecc_min, ecc_max, nbins=nbins, space=space,
+                               **adaptive_kwargs)
+    else:
+        raise ValueError(f"Unknown bin layout '{layout}'")
+
+    if space == "log10" and edges[0] <= 0:
+        raise ValueError(f"Parent prior is {prior} but the lowest bin edge is "
+                         f"{edges[0]}; set ecc_min above zero")
+    return edges
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--ecc-min", type=float, default=0.0)
+    parser.add_argument("--ecc-max", type=float, default=0.2)
+    parser.add_argument("--prior", default="uniform",
+                        choices=["uniform", "uniform_log10"],
+                        help="Name of the parent eccentricity prior")
+    pilot = parser.add_mutually_exclusive_group(required=True)
+    pilot.add_argument("--pilot-runs-dir",
+                       help="Directory of finished e_* bins to take evidences from")
+    pilot.add_argument("--pilot-file",
+                       help="Result of a single pilot run over the full prior")
+    parser.add_argument("--nbins", type=int, default=None)
+    parser.add_argument("--mass-error", type=float, default=None,
+                        help="Target absolute error on each bin's posterior mass")
+    parser.add_argument("--bin-dlogz", type=float, default=None,
+                        help="Evidence error expected from a production bin "
+                             "(default: median of the pilot)")
+    parser.add_argument("--prior-floor", type=float, default=0.05)
+    parser.add_argument("--min-width", type=float, default=0.001)
+    parser.add_argument("--parameter", default="eccentricity")
+    opts = parser.parse_args(args)
+
+    edges = adaptive_edges(opts.ecc_min, opts.ecc_max, nbins=opts.nbins,
+                           pilot_runs_dir=opts.pilot_runs_dir,
+                           pilot_file=opts.pilot_file,
+                           mass_error=opts.mass_error, bin_dlogz=opts.bin_dlogz,
+                           param=opts.parameter, space=prior_space(opts.prior),
+                           prior_floor=opts.prior_floor, min_width=opts.min_width)
+    for name, lo, hi in zip(bin_dir_names(edges), edges[:-1], edges[1:]):
+        print(f"{name}  {format_edge(lo)}  {format_edge(hi)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Condition an event's strain and estimate its PSDs once for all bins.
+
+Every bin of every approximant of an event has the same [data] section, so
+each pycbc_inference job reads the same 4096 s, 16 kHz GWOSC frames,
+high-passes and resamples them, and estimates the same median-mean PSD
+before it starts sampling. This does that work once per distinct [data]
+section (and low-frequency cutoff) with pycbc's own data loading, and
+writes the result under <event>/conditioned/<key>/:
+
+- <IFO>-CONDITIONED.gwf, the conditioned 2048 Hz analysis segment
+  (including the psd-inverse-length/2 padding pycbc adds) in channel
+  <IFO>:ECC_PE-CONDITIONED_STRAIN,
+- <IFO>-PSD.txt, the estimated and truncated PSD,
+- manifest.json, the [data] settings they were made from.
+
+generate_bins.py --conditioned-data then points each bin's [data] section
+at these files: frame-files and channel-name at the conditioned frames,
+psd-file instead of the psd-estimation options, and the analysis times
+widened by the padding. Filtering, resampling and PSD estimation are
+dropped, since they have already been applied. Jobs then read a few
+hundred kB each instead of the full frames.
+
+Needs pycbc (run it in the same environment as the jobs).
+
+Usage:
+    python condition_data.py --event gw200105
+    python condition_data.py --event gw190814 gw200105 --approximant all --variant all
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import generate_bins
+from inifile import IniFile
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+CHANNEL = "ECC_PE-CONDITIONED_STRAIN"
+
+# [model] settings that change the estimated PSD
+MODEL_KEYS = ("low-frequency-cutoff", "psd-low-frequency-cutoff")
+# [data] settings replaced by the conditioned files
+CONDITIONING_KEYS = ("frame-files", "frame-cache", "frame-type", "channel-name",
+                     "strain-high-pass", "pad-data", "psd-estimation",
+                     "psd-start-time", "psd-end-time", "psd-segment-length",
+                     "psd-segment-stride", "psd-num-segments", "psd-inverse-length",
+                     "psd-file", "asd-file", "psd-model")
+
+
+def data_settings(config):
+    """The [data] and PSD-relevant [model] settings of a parsed config.ini."""
+    settings = {f"data:{key}": " ".join(value.split())
+                for (section, key), value in config.values.items() if section == "data"}
+    for key in MODEL_KEYS:
+        if config.has("model", key):
+            settings[f"model:{key}"] = " ".join(config.get("model", key).split())
+    return settings
+
+
+def data_key(settings):
+    text = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+
+def conditioned_dir(event, key, root=None):
+    root = root or generate_bins.REPO_ROOT
+    return os.path.join(root, event, "conditioned", key)
+
+
+def format_per_ifo(values):
+    return " ".join(f"{ifo}:{value}" for ifo, value in values.items())
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def conditioned_overrides(config, directory, abs_directory=None):
+    """[data] overrides that make a bin read the conditioned files in directory.
+
+    ``abs_directory`` is the same directory as seen by the jobs (default:
+    ``directory``). Returns None if nothing has been conditioned for this
+    config's [data] section.
+    """
+    manifest = read_manifest(directory)
+    if manifest is None or manifest["key"] != data_key(data_settings(config)):
+        return None
+    abs_directory = abs_directory or directory
+    ifos = manifest["instruments"]
+    overrides = {("data", key): None for key in CONDITIONING_KEYS}
+    overrides.update({
+        ("data", "frame-files"): format_per_ifo(
+            {ifo: os.path.join(abs_directory, manifest["frames"][ifo]) for ifo in ifos}),
+        # channel names keep their IFO prefix, as in the base configs
+        ("data", "channel-name"): " ".join(f"{ifo}:{CHANNEL}" for ifo in ifos),
+        ("data", "pad-data"): "0",
+        ("data", "psd-file"): format_per_ifo(
+            {ifo: os.path.join(abs_directory, manifest["psds"][ifo]) for ifo in ifos}),
+        ("data", "analysis-start-time"): format_per_ifo(manifest["analysis_start_time"]),
+        ("data", "analysis-end-time"): format_per_ifo(manifest["analysis_end_time"]),
+    })
+    return overrides
+
+
+def condition(config_path, output_dir, force=False):
+    """Write the conditioned frames and PSDs of one config.ini's [data] section."""
+    from pycbc.frame import write_frame
+    from pycbc.inference.models.data_utils import (data_from_cli, data_opts_from_config,
+                                                   fd_data_from_strain_dict)
+    from pycbc.types import MultiDetOptionAction
+    from pycbc.workflow import WorkflowConfigParser
+
+    settings = data_settings(IniFile.read(config_path))
+    key = data_key(settings)
+    directory = os.path.join(output_dir, key)
+    if not force and read_manifest(directory) is not None:
+        print(f"[SKIP] {directory} is already conditioned")
+        return directory
+
+    cp = WorkflowConfigParser([config_path])
+    filter_flow = cp.get_cli_option("model", "low_frequency_cutoff", nargs="+",
+                                    type=float, action=MultiDetOptionAction)
+    opts = data_opts_from_config(cp, "data", filter_flow)
+    ifos = list(opts.instruments)
+    # data_opts_from_config pads the analysis times by psd-inverse-length/2;
+    # the conditioned files are read back without that option, so the
+    # padding goes into the analysis times instead. pycbc offsets them from
+    # int(trigger-time), so subtracting the fractional trigger time would
+    # truncate them by a second
+    start = {ifo: int(opts.gps_start_time[ifo] - int(opts.trigger_time)) for ifo in ifos}
+    end = {ifo: int(opts.gps_end_time[ifo] - int(opts.trigger_time)) for ifo in ifos}
+
+    print(f"[INFO] Reading and conditioning {', '.join(ifos)} data for {config_path}")
+    strain_dict, psd_strain_dict = data_from_cli(opts)
+    _, psds = fd_data_from_strain_dict(opts, strain_dict, psd_strain_dict)
+
+    os.makedirs(directory, exist_ok=True)
+    frames, psd_files = {}, {}
+    for ifo in ifos:
+        frames[ifo] = f"{ifo}-CONDITIONED.gwf"
+        psd_files[ifo] = f"{ifo}-PSD.txt"
+        write_frame(os.path.join(directory, frames[ifo]), f"{ifo}:{CHANNEL}", strain_dict[ifo])
+        psds[ifo].save(os.path.join(directory, psd_files[ifo]))
+
+    manifest = {"version": MANIFEST_VERSION, "key": key, "settings": settings,
+                "source": os.path.abspath(config_path), "instruments": ifos,
+                "analysis_start_time": start, "analysis_end_time": end,
+                "frames": frames, "psds": psd_files}
+    tmp = os.path.join(directory, MANIFEST_NAME + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(directory, MANIFEST_NAME))
+    print(f"[INFO] Wrote conditioned data to {directory}")
+    return directory
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--event", nargs="+", required=True,
+                        help=f"Events to condition, or 'all' ({', '.join(generate_bins.EVENTS)})")
+    parser.add_argument("--approximant", nargs="+", default=["all"],
+                        help=f"Waveform families whose base config.ini to read, or 'all' "
+                             f"({', '.join(generate_bins.APPROXIMANTS)})")
+    parser.add_argument("--variant", nargs="+", default=["all"],
+                        help=f"Workflow variants, or 'all' ({', '.join(generate_bins.VARIANTS)})")
+    parser.add_argument("--force", action="store_true",
+                        help="Condition again even if the output already exists")
+    opts = parser.parse_args(args)
+
+    for event in generate_bins.expand(opts.event, list(generate_bins.EVENTS)):
+        done = set()
+        for approximant in generate_bins.expand(opts.approximant, generate_bins.APPROXIMANTS):
+            for variant in generate_bins.expand(opts.variant, list(generate_bins.VARIANTS)):
+                config_path = os.path.join(generate_bins.workflow_dir(event, approximant, variant),
+                                           "base", "config.ini")
+                if not os.path.isfile(config_path):
+                    continue
+                key = data_key(data_settings(IniFile.read(config_path)))
+                if key in done:
+                    continue
+                condition(config_path, os.path.dirname(conditioned_dir(event, key)),
+                          force=opts.force)
+                done.add(key)
+        print(f"[INFO] {event}: {len(done)} distinct [data] sections")
+
+
+if __name__ == "__main__":
+    main()
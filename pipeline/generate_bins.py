@@ -0,0 +1,334 @@
+"""Generate the runs/ tree of one or more binned workflows.
+
+Replaces the per-directory copies of master.py. For every requested event,
+approximant and variant (workflow or workflowlog), the base config.ini,
+run.sh and submit.sub under <event>/<approximant>/<variant>/base are parsed
+once (see inifile.py), and each bin's files are rendered in memory from a
+set of per-bin overrides and written in a single pass.
+
+Any config setting can be overridden for all bins with --set, and --sweep
+generates the same bin grid once per combination of sampler or model
+settings, each in its own runs_<key>-<value> directory.
+
+Usage:
+    python generate_bins.py --event gw200105 --approximant seob
+    python generate_bins.py --event gw190814 gw200105 --approximant all
+    python generate_bins.py --event gw200105 --approximant teob --variant workflowlog
+    python generate_bins.py --event gw200105 --approximant seob --layout adaptive \\
+        --pilot-runs-dir pilot --nbins 20
+    python generate_bins.py --event gw200105 --approximant seob \\
+        --set sampler:walks=50 --sweep sampler:nlive=2000,4000
+    python generate_bins.py --event gw200105 --approximant all --conditioned-data --marg-tables
+    python generate_bins.py --event gw200105 --approximant seob \\
+        --relative-binning gw200105/seob/workflow/posteriors.hdf
+    python generate_bins.py --event gw200105 --approximant all --marg-tables --waveform-cache 8192
+    python generate_bins.py --event gw200105 --approximant seob --rom-file gw200105/seob/rom.hdf
+"""
+import argparse
+import itertools
+import os
+
+import bin_layout
+import condition_data
+import heterodyne
+import surrogate
+from inifile import CommandScript, IniFile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APPROXIMANTS = ["seob", "seobHM", "teob", "teobHM"]
+
+# Parent eccentricity prior of each binned event
+EVENTS = {
+    "gw190814": {"ecc_max": 0.1},
+    "gw200105": {"ecc_max": 0.2},
+}
+
+# workflowlog runs use a uniform_log10 prior starting at 1e-4
+VARIANTS = {
+    "workflow": {"ecc_min": 0.0, "layout": "linear"},
+    "workflowlog": {"ecc_min": 0.0001, "layout": "log10"},
+}
+
+
+def workflow_dir(event, approximant, variant):
+    return os.path.join(REPO_ROOT, event, approximant, variant)
+
+
+def parse_setting(text):
+    """Parse SECTION:KEY=VALUE into ((section, key), value)."""
+    target, sep, value = text.partition("=")
+    section, colon, key = target.partition(":")
+    if not (sep and colon and section and key):
+        raise argparse.ArgumentTypeError(f"Expected SECTION:KEY=VALUE, got '{text}'")
+    return (section.strip(), key.strip()), value.strip()
+
+
+def parse_sweep(text):
+    """Parse SECTION:KEY=V1,V2,... into ((section, key), [V1, V2, ...])."""
+    target, values = parse_setting(text)
+    return target, [v.strip() for v in values.split(",") if v.strip()]
+
+
+def sweep_points(sweeps):
+    """(directory suffix, overrides) for every combination of swept settings."""
+    if not sweeps:
+        return [("", {})]
+    targets = [t for t, _ in sweeps]
+    points = []
+    for values in itertools.product(*[v for _, v in sweeps]):
+        label = "_".join(f"{key}-{value}" for (_, key), value in zip(targets, values))
+        points.append(("_" + label, dict(zip(targets, values))))
+    return points
+
+
+def bin_overrides(lo, hi, param="eccentricity"):
+    section = f"prior-{param}"
+    return {(section, f"min-{param}"): bin_layout.format_edge(lo),
+            (section, f"max-{param}"): bin_layout.format_edge(hi)}
+
+
+def generate(event, approximant, variant="workflow", layout=None, ecc_min=None,
+             ecc_max=None, step=0.005, nbins=20, abs_root=None, logs_dir=None,
+             output_parent_dir="runs", settings=None, sweeps=None,
+             conditioned_data=False, marg_tables=False, relative_binning=None,
+             epsilon=heterodyne.EPSILON, waveform_cache=None, rom_file=None,
+             max_mismatch=surrogate.MAX_MISMATCH,
+             **adaptive_kwargs):
+    """Write runs*/e_*/{config.ini,run.sh,submit.sub} for one workflow.
+
+    ``settings`` is a {(section, key): value} dict applied to every bin's
+    config.ini; ``sweeps`` a list of ((section, key), values) pairs whose
+    combinations each get their own copy of the bin grid. With
+    ``conditioned_data`` the [data] section is pointed at the output of
+    condition_data.py, if there is one for it, and with ``marg_tables``
+    run.sh starts pycbc_inference through marg_tables.py. ``relative_binning``
+    is a pilot posterior file: each bin then uses the relative_time model
+    with a fiducial waveform taken from the pilot inside that bin (see
+    heterodyne.py). ``waveform_cache`` is the memory in MB per job for
+    waveform_cache.py's cache of generated waveforms, split between the
+    job's processes. ``rom_file`` is a surrogate built by surrogate.py,
+    used in place of the approximant if its largest validation mismatch is
+    at most ``max_mismatch``.
+    """
+    wdir = workflow_dir(event, approximant, variant)
+    base = os.path.join(wdir, "base")
+    defaults = dict(EVENTS.get(event, {}), **VARIANTS.get(variant, {}))
+    layout = layout or defaults.get("layout", "linear")
+    ecc_min = defaults.get("ecc_min", 0.0) if ecc_min is None else ecc_min
+    ecc_max = defaults.get("ecc_max") if ecc_max is None else ecc_max
+    if ecc_max is None:
+        raise ValueError(f"No default ecc_max for {event}; pass --ecc-max")
+
+    config = IniFile.read(os.path.join(base, "config.ini"))
+    run = CommandScript.read(os.path.join(base, "run.sh"))
+    submit = IniFile.read(os.path.join(base, "submit.sub"))
+    run_mode = os.stat(os.path.join(base, "run.sh")).st_mode & 0o777
+
+    settings = dict(settings or {})
+    for target in list(settings) + [t for t, _ in sweeps or []]:
+        if not config.has(*target):
+            print(f"[WARN] {event}/{approximant}/{variant}: [{target[0]}] "
+                  f"{target[1]} is not in the base config, adding it")
+
+    if conditioned_data:
+        key = condition_data.data_key(condition_data.data_settings(config))
+        data_overrides = condition_data.conditioned_overrides(
+            config, condition_data.conditioned_dir(event, key),
+            condition_data.conditioned_dir(event, key, abs_root) if abs_root else None)
+        if data_overrides is None:
+            print(f"[WARN] {event}/{approximant}/{variant}: no conditioned data for this "
+                  f"[data] section, reading the raw frames (run condition_data.py first)")
+        else:
+            settings = {**data_overrides, **settings}
+
+    parent_prior = config.get("prior-eccentricity", "name")
+    edges = bin_layout.make_edges(layout, ecc_min, ecc_max, step=step, nbins=nbins,
+                                  prior=parent_prior, **adaptive_kwargs)
+    names = bin_layout.bin_dir_names(edges)
+
+    # Absolute paths written into run.sh and submit.sub
+    abs_dir = os.path.join(abs_root, event, approximant, variant) if abs_root else wdir
+    # Condor does not create the output/error/log directory itself. The
+    # default one is made in this checkout, which the jobs see at abs_dir.
+    local_logs_dir = logs_dir or os.path.join(wdir, "logs")
+    logs_dir = logs_dir or os.path.join(abs_dir, "logs")
+    os.makedirs(local_logs_dir, exist_ok=True)
+
+    root = abs_root or REPO_ROOT
+    table_dir = os.path.join(root, event, "marg_tables")
+    command = "pycbc_inference"
+    if rom_file:
+        rom_name, rom_approximant = surrogate.rom_info(rom_file)
+        if rom_approximant != config.get("static_params", "approximant"):
+            print(f"[SKIP] {event}/{approximant}/{variant}: {rom_file} is a surrogate of "
+                  f"{rom_approximant}")
+            return 0
+        try:
+            surrogate.check_validation(rom_file, max_mismatch)
+        except ValueError as exc:
+            print(f"[SKIP] {event}/{approximant}/{variant}: {exc}")
+            return 0
+        settings = {("static_params", "approximant"): rom_name, **settings}
+        abs_rom = os.path.join(root, os.path.relpath(os.path.abspath(rom_file), REPO_ROOT))
+        command = (f"python {os.path.join(root, 'pipeline', 'surrogate.py')} --mode run "
+                   f"--rom-file {abs_rom} --max-mismatch {max_mismatch:g}")
+        if marg_tables:
+            command += f" --table-dir {table_dir}"
+        if relative_binning or waveform_cache:
+            print(f"[WARN] {event}/{approximant}/{variant}: --relative-binning and "
+                  f"--waveform-cache are not used with a surrogate")
+    elif relative_binning:
+        pilot = heterodyne.read_pilot(relative_binning)
+        trigger_time = config.get("data", "trigger-time") if config.has("data", "trigger-time") else None
+        command = f"python {os.path.join(root, 'pipeline', 'heterodyne.py')}"
+        if marg_tables:
+            command += f" --table-dir {table_dir}"
+        if waveform_cache:
+            print(f"[WARN] {event}/{approximant}/{variant}: the waveform cache only applies "
+                  f"to marginalized_time, not using it with relative binning")
+    elif waveform_cache:
+        command = (f"python {os.path.join(root, 'pipeline', 'waveform_cache.py')} "
+                   f"--cache-mb {waveform_cache:g}")
+        if marg_tables:
+            command += f" --table-dir {table_dir}"
+    elif marg_tables:
+        command = (f"python {os.path.join(root, 'pipeline', 'marg_tables.py')} "
+                   f"--table-dir {table_dir}")
+    if command != "pycbc_inference" and \
+            not any(line.strip().startswith("pycbc_inference") for line in run.lines):
+        print(f"[WARN] {event}/{approximant}/{variant}: no pycbc_inference line in "
+              f"run.sh, running it directly")
+
+    nwritten = 0
+    for suffix, sweep_settings in sweep_points(sweeps):
+        parent_dir = output_parent_dir + suffix
+        for folder_name, lo, hi in zip(names, edges[:-1], edges[1:]):
+            bin_abs = os.path.join(abs_dir, parent_dir, folder_name)
+            log_prefix = f"{approximant}_{event}{suffix}_{folder_name}"
+            model_overrides = {}
+            if relative_binning and not rom_file:
+                fid = heterodyne.fiducial_params(pilot, lo, hi, prior=parent_prior,
+                                                 trigger_time=trigger_time)
+                model_overrides = heterodyne.relbin_overrides(fid, epsilon)
+            files = {
+                "config.ini": config.render({**model_overrides, **settings,
+                                             **sweep_settings, **bin_overrides(lo, hi)}),
+                "run.sh": run.render({
+                    (None, "--config-file"): os.path.join(bin_abs, "config.ini"),
+                    (None, "--output-file"): os.path.join(bin_abs, "result.hdf"),
+                }).replace("\npycbc_inference", f"\n{command}", 1),
+                "submit.sub": submit.render({
+                    (None, "executable"): os.path.join(bin_abs, "run.sh"),
+                    (None, "output"): f"{logs_dir}/{log_prefix}.out",
+                    (None, "error"): f"{logs_dir}/{log_prefix}.err",
+                    (None, "log"): f"{logs_dir}/{log_prefix}.log",
+                }),
+            }
+            new_dir = os.path.join(wdir, parent_dir, folder_name)
+            os.makedirs(new_dir, exist_ok=True)
+            for fname, text in files.items():
+                with open(os.path.join(new_dir, fname), "w") as f:
+                    f.write(text)
+            os.chmod(os.path.join(new_dir, "run.sh"), run_mode)
+            nwritten += 1
+
+        print(f"[INFO] {event}/{approximant}/{variant}: {len(names)} bins in "
+              f"{os.path.join(wdir, parent_dir)}")
+    return nwritten
+
+
+def expand(values, choices):
+    return choices if values == ["all"] else values
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--event", nargs="+", required=True,
+                        help=f"Events to generate, or 'all' ({', '.join(EVENTS)})")
+    parser.add_argument("--approximant", nargs="+", default=["all"],
+                        help=f"Waveform families, or 'all' ({', '.join(APPROXIMANTS)})")
+    parser.add_argument("--variant", nargs="+", default=["workflow"],
+                        help="Workflow variants, or 'all' "
+                             f"({', '.join(VARIANTS)}); missing ones are skipped")
+    parser.add_argument("--layout", default=None,
+                        choices=["linear", "log10", "adaptive"],
+                        help="Bin layout (default: linear, log10 for workflowlog)")
+    parser.add_argument("--edges", type=bin_layout.parse_edges, default=None,
+                        help="Explicit comma separated bin edges; overrides --layout")
+    parser.add_argument("--ecc-min", type=float, default=None)
+    parser.add_argument("--ecc-max", type=float, default=None)
+    parser.add_argument("--step", type=float, default=0.005,
+                        help="Bin width of the linear layout")
+    parser.add_argument("--nbins", type=int, default=20,
+                        help="Number of log10 or adaptive bins")
+    parser.add_argument("--pilot-runs-dir", default=None,
+                        help="Finished bins whose evidences drive the adaptive layout")
+    parser.add_argument("--pilot-file", default=None,
+                        help="Single pilot run whose samples drive the adaptive layout")
+    parser.add_argument("--mass-error", type=float, default=None,
+                        help="Size the adaptive layout from this per-bin mass error")
+    parser.add_argument("--abs-root", default=None,
+                        help="Repository root as seen by the jobs (default: this checkout)")
+    parser.add_argument("--logs-dir", default=None,
+                        help="Condor log directory (default: <variant dir>/logs)")
+    parser.add_argument("--output-parent-dir", default="runs")
+    parser.add_argument("--set", dest="settings", type=parse_setting, action="append",
+                        default=[], metavar="SECTION:KEY=VALUE",
+                        help="Override a config.ini setting in every bin")
+    parser.add_argument("--sweep", dest="sweeps", type=parse_sweep, action="append",
+                        default=[], metavar="SECTION:KEY=V1,V2",
+                        help="Generate the bin grid once per value (combinations "
+                             "of several sweeps), in runs_<key>-<value>/")
+    parser.add_argument("--marg-tables", action="store_true",
+                        help="Run pycbc_inference through marg_tables.py so the bins "
+                             "share one distance-marginalization table")
+    parser.add_argument("--conditioned-data", action="store_true",
+                        help="Read the strain and PSDs written by condition_data.py "
+                             "instead of the raw frames")
+    parser.add_argument("--relative-binning", default=None, metavar="PILOT_FILE",
+                        help="Use the relative_time (heterodyned) model, with each bin's "
+                             "fiducial waveform taken from this pilot posterior")
+    parser.add_argument("--epsilon", type=float, default=heterodyne.EPSILON,
+                        help="Relative-binning phase error tolerance")
+    parser.add_argument("--waveform-cache", type=float, default=None, metavar="MB",
+                        help="Cache generated waveforms by intrinsic parameters, using "
+                             "up to this much memory per job, split between its "
+                             "--nprocesses (see waveform_cache.py)")
+    parser.add_argument("--rom-file", default=None,
+                        help="Use this surrogate (built by surrogate.py) as the approximant")
+    parser.add_argument("--max-mismatch", type=float, default=surrogate.MAX_MISMATCH,
+                        help="Skip the surrogate if its largest validation mismatch is above this")
+    opts = parser.parse_args(args)
+
+    adaptive_kwargs = {}
+    if (opts.layout or "") == "adaptive":
+        adaptive_kwargs = {"pilot_runs_dir": opts.pilot_runs_dir,
+                           "pilot_file": opts.pilot_file,
+                           "mass_error": opts.mass_error}
+
+    total = 0
+    for event in expand(opts.event, list(EVENTS)):
+        for approximant in expand(opts.approximant, APPROXIMANTS):
+            for variant in expand(opts.variant, list(VARIANTS)):
+                if not os.path.isdir(os.path.join(workflow_dir(event, approximant, variant), "base")):
+                    continue
+                total += generate(
+                    event, approximant, variant,
+                    layout=opts.edges or opts.layout, ecc_min=opts.ecc_min,
+                    ecc_max=opts.ecc_max, step=opts.step, nbins=opts.nbins,
+                    abs_root=opts.abs_root, logs_dir=opts.logs_dir,
+                    output_parent_dir=opts.output_parent_dir,
+                    settings=dict(opts.settings), sweeps=opts.sweeps,
+                    conditioned_data=opts.conditioned_data,
+                    marg_tables=opts.marg_tables,
+                    relative_binning=opts.relative_binning, epsilon=opts.epsilon,
+                    waveform_cache=opts.waveform_cache, rom_file=opts.rom_file,
+                    max_mismatch=opts.max_mismatch,
+                    **adaptive_kwargs)
+    print(f"All config, run, and submit files generated ({total} bins). You can go "
+          "ahead and do 'python run_all.py' to submit all the jobs.")
+
+
+if __name__ == "__main__":
+    main()
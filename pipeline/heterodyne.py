@@ -0,0 +1,170 @@
+"""Relative-binning (heterodyned) likelihood for the binned eccentric runs.
+
+pycbc's ``relative_time`` model is the heterodyned counterpart of
+``marginalized_time``: it keeps the tc/ra/dec/polarization vector,
+phase and distance marginalizations of the same [model] section, but
+evaluates each template only at the edges of a few hundred frequency
+bins, relative to a fiducial waveform near the likelihood peak, instead
+of over the full frequency grid of the 100-200 s segment.
+
+Two things are needed to use it here:
+
+- Fiducial parameters. Every eccentricity bin gets its own: the
+  highest-likelihood sample of a pilot posterior (e.g. an earlier
+  posteriors.hdf) inside the bin, or, if the pilot has none there, the
+  overall best sample moved to the middle of the bin. relbin_overrides()
+  turns them into the [model] settings (name = relative_time, epsilon and
+  one <param>_ref per parameter) that generate_bins.py --relative-binning
+  writes into each bin's config.ini.
+- Waveforms at arbitrary frequencies. relative_time asks for templates
+  through pycbc's frequency-sequence interface, which the time-domain
+  plugins (SEOBNRv5E_tdtaper, SEOBNRv5EHM, teobresums) do not provide.
+  register_sequences() adds one for the config's approximant: the
+  time-domain waveform is start-tapered, Fourier transformed on a grid
+  padded to at least four times its length, and its amplitude and
+  unwrapped phase are interpolated to the requested frequencies.
+
+Run as a script it starts pycbc_inference with those generators
+registered (and, with --table-dir, the shared distance tables of
+marg_tables.py); generate_bins.py --relative-binning writes this into
+run.sh. benchmark_relbin.py compares the two models.
+
+Usage:
+    python heterodyne.py [--table-dir DIR] --config-file config.ini --output-file result.hdf ...
+"""
+import argparse
+import configparser
+
+import h5py
+import numpy as np
+
+import marg_tables
+
+EPSILON = 0.5
+# Parameters of the fiducial waveform, as waveform (not sampling) parameters
+FIDUCIAL_PARAMS = ("mass1", "mass2", "spin1z", "spin2z", "eccentricity", "anomaly",
+                   "rel_anomaly", "inclination", "ra", "dec", "polarization", "tc")
+# Time-domain padding of the Fourier transform, in waveform lengths; keeps
+# the phase step between frequency samples below pi/2 for unwrapping
+PAD_FACTOR = 4
+
+
+def mass1_mass2(mchirp, q):
+    """Component masses from chirp mass and q = mass1 / mass2 >= 1."""
+    mtotal = mchirp * (1 + q) ** 1.2 / q ** 0.6
+    return mtotal * q / (1 + q), mtotal / (1 + q)
+
+
+def read_pilot(path):
+    """{column: array} of a posterior file, with mass1/mass2 added if needed."""
+    with h5py.File(path, "r") as f:
+        samples = {name: f["samples"][name][:] for name in f["samples"]}
+    if "mass1" not in samples and {"mchirp", "q"} <= set(samples):
+        samples["mass1"], samples["mass2"] = mass1_mass2(samples["mchirp"], samples["q"])
+    return samples
+
+
+def bin_centre(lo, hi, prior):
+    if prior == "uniform_log10" and lo > 0:
+        return float(np.sqrt(lo * hi))
+    return 0.5 * (lo + hi)
+
+
+def fiducial_params(samples, lo, hi, prior="uniform", param="eccentricity",
+                    trigger_time=None):
+    """Fiducial waveform parameters for the bin [lo, hi) of ``param``.
+
+    The sample with the highest loglikelihood inside the bin (the first
+    one if the pilot has no loglikelihood column); if there is none, the
+    best sample overall with ``param`` set to the middle of the bin.
+    """
+    x = samples[param]
+    rank = samples.get("loglikelihood", np.zeros(len(x)))
+    inside = np.flatnonzero((x >= lo) & (x < hi))
+    best = inside[np.argmax(rank[inside])] if len(inside) else int(np.argmax(rank))
+    fid = {p: float(samples[p][best]) for p in FIDUCIAL_PARAMS if p in samples}
+    if not len(inside):
+        fid[param] = bin_centre(lo, hi, prior)
+    if "tc" not in fid and trigger_time is not None:
+        fid["tc"] = float(trigger_time)
+    return fid
+
+
+def relbin_overrides(fid, epsilon=EPSILON):
+    """[model] settings that switch a marginalized_time config to relative_time."""
+    overrides = {("model", "name"): "relative_time", ("model", "epsilon"): f"{epsilon:g}"}
+    overrides.update({("model", f"{p}_ref"): repr(v) for p, v in fid.items()})
+    return overrides
+
+
+def fd_amp_phase(h, f):
+    """Amplitude and unwrapped phase of a TimeSeries' Fourier transform at f.
+
+    The transform is referenced to the merger at t = 0, like pycbc's own
+    frequency-domain waveforms.
+    """
+    f = np.asarray(f, dtype=float)
+    n = 1 << int(np.ceil(np.log2(PAD_FACTOR * len(h))))
+    freqs = np.fft.rfftfreq(n, d=h.delta_t)
+    spectrum = np.fft.rfft(h.numpy(), n) * h.delta_t
+    amp = np.interp(f, freqs, np.abs(spectrum), left=0.0, right=0.0)
+    phase = np.interp(f, freqs, np.unwrap(np.angle(spectrum)))
+    return amp, phase - 2 * np.pi * f * float(h.start_time)
+
+
+def td_polarizations(params, f_lower, sample_rate):
+    """Start-tapered (hp, hc) TimeSeries of a time-domain approximant."""
+    from pycbc.waveform import get_td_waveform
+
+    params = dict(params, f_lower=f_lower, delta_t=1.0 / sample_rate)
+    params.pop("delta_f", None)
+    hp, hc = get_td_waveform(**params)
+    return hp.taper_timeseries("TAPER_START"), hc.taper_timeseries("TAPER_START")
+
+
+def sequence_generator(f_lower, sample_rate):
+    """A pycbc frequency-sequence generator for a time-domain approximant."""
+    from pycbc.types import Array
+
+    def generate(sample_points=None, **params):
+        # get_fd_waveform_sequence overwrites f_lower and delta_f
+        out = []
+        for h in td_polarizations(params, f_lower, sample_rate):
+            amp, phase = fd_amp_phase(h, sample_points)
+            out.append(Array(amp * np.exp(1j * phase)))
+        return tuple(out)
+    return generate
+
+
+def register_sequences(config_path, sample_rate=None):
+    """Give the config's time-domain approximant a frequency-sequence generator."""
+    from pycbc.waveform.plugin import add_custom_waveform
+    from pycbc.waveform.waveform import fd_sequence
+
+    cp = configparser.ConfigParser(interpolation=None, strict=False)
+    cp.read(config_path)
+    approximant = cp.get("static_params", "approximant").strip()
+    if approximant in fd_sequence:
+        return approximant
+    f_lower = cp.getfloat("static_params", "f_lower")
+    sample_rate = sample_rate or cp.getfloat("data", "sample-rate", fallback=2048)
+    add_custom_waveform(approximant, sequence_generator(f_lower, sample_rate),
+                        "frequency", sequence=True)
+    return approximant
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--table-dir", default=None,
+                        help="Shared distance-marginalization tables (see marg_tables.py)")
+    opts, inference_args = parser.parse_known_args(args)
+    config_path = marg_tables.config_file(inference_args)
+
+    register_sequences(config_path)
+    if opts.table_dir:
+        marg_tables.install(opts.table_dir, config_path)
+    marg_tables.run_inference(inference_args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Structured editing of config.ini, submit.sub and run.sh.
+
+Each file is parsed once into its lines plus an index of where every
+setting lives. Rendering a variant applies a dict of overrides to a copy of
+the line list, so only the changed settings are re-serialised and the rest
+of the file (comments, blank lines, ordering) is kept byte for byte.
+
+    config = IniFile.read("base/config.ini")
+    text = config.render({("prior-eccentricity", "min-eccentricity"): "0.005",
+                          ("sampler", "nlive"): "2000"})
+
+Keys outside any section (as in a Condor submit description) live in
+section ``None``. A value of ``None`` in the overrides removes the setting;
+settings not in the file are added at the end of their section, and
+unknown sections are appended to the file.
+"""
+import re
+
+_SECTION = re.compile(r"^\[(?P<name>[^\]]+)\]\s*$")
+_KEY = re.compile(r"^(?P<key>[^=\s#;][^=]*?)\s*=\s*(?P<value>.*?)\s*$")
+_OPTION = re.compile(r"^(?P<key>--[\w-]+)(?:\s+(?P<value>.*?))?\s*(?P<cont>\\)?\s*$")
+_EXPORT = re.compile(r"^export\s+(?P<key>\w+)=(?P<value>.*?)\s*$")
+
+
+class IniFile:
+    """An INI-style file indexed by (section, key)."""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.index = {}  # (section, key) -> (first line, last line + 1)
+        self.values = {}  # (section, key) -> value
+        self.section_end = {None: 0}  # section -> insertion point for new keys
+        self.order = [None]
+
+        section = None
+        last = None
+        for i, line in enumerate(self.lines):
+            stripped = line.strip()
+            if last is not None and line[:1] in " \t" and stripped:
+                # continuation of a multi-line value
+                start, _ = self.index[last]
+                self.index[last] = (start, i + 1)
+                self.values[last] += "\n" + stripped
+                self.section_end[section] = i + 1
+                continue
+            last = None
+            m = _SECTION.match(stripped)
+            if m:
+                section = m.group("name").strip()
+                self.order.append(section)
+                self.section_end[section] = i + 1
+                continue
+            if not stripped or stripped[0] in "#;":
+                continue
+            m = _KEY.match(stripped)
+            if m:
+                last = (section, m.group("key"))
+                self.index[last] = (i, i + 1)
+                self.values[last] = m.group("value")
+                self.section_end[section] = i + 1
+
+    @classmethod
+    def read(cls, path):
+        with open(path) as f:
+            return cls(f.readlines())
+
+    def sections(self):
+        return [s for s in self.order if s is not None]
+
+    def has(self, section, key):
+        return (section, key) in self.index
+
+    def get(self, section, key, default=None):
+        return self.values.get((section, key), default)
+
+    @staticmethod
+    def format(section, key, value):
+        return f"{key} = {value}\n"
+
+    def render(self, overrides=None):
+        """Return the file text with ``overrides`` applied."""
+        if not overrides:
+            return "".join(self.lines)
+        out = list(self.lines)
+        inserts = {}  # line index -> lines to insert before it
+        new_sections = {}
+        for (section, key), value in overrides.items():
+            span = self.index.get((section, key))
+            if span is not None:
+                start, end = span
+                out[start] = "" if value is None else self.format(section, key, value)
+                for i in range(start + 1, end):
+                    out[i] = ""
+            elif value is None:
+                continue
+            elif section is None and None not in self.section_end:
+                raise KeyError(f"Cannot add '{key}' to {type(self).__name__}")
+            elif section in self.section_end:
+                inserts.setdefault(self.section_end[section], []).append(
+                    self.format(section, key, value))
+            else:
+                new_sections.setdefault(section, []).append(
+                    self.format(section, key, value))
+
+        text = []
+        for i, line in enumerate(out):
+            text.extend(inserts.get(i, ()))
+            text.append(line)
+        text.extend(inserts.get(len(out), ()))
+        for section, lines in new_sections.items():
+            text.append(f"\n[{section}]\n")
+            text.extend(lines)
+        return "".join(text)
+
+    def write(self, path, overrides=None):
+        with open(path, "w") as f:
+            f.write(self.render(overrides))
+
+
+class CommandScript(IniFile):
+    """A job script indexed by its ``--option value`` and ``export`` lines.
+
+    Options and exported variables share one key space in section ``None``,
+    e.g. ``{(None, "--nprocesses"): "16", (None, "OMP_NUM_THREADS"): "4"}``.
+    Flags without a value map to ``""``.
+    """
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.index = {}
+        self.values = {}
+        self.continued = {}
+        self.section_end = {}
+        self.order = [None]
+        for i, line in enumerate(self.lines):
+            stripped = line.strip()
+            m = _OPTION.match(stripped) or _EXPORT.match(stripped)
+            if m is None:
+                continue
+            key = (None, m.group("key"))
+            self.index[key] = (i, i + 1)
+            self.values[key] = m.group("value") or ""
+            self.continued[key] = bool(m.groupdict().get("cont"))
+
+    def format(self, section, key, value):
+        if key.startswith("--"):
+            cont = " \\" if self.continued.get((section, key), True) else ""
+            return f"{key} {value}{cont}\n" if value != "" else f"{key}{cont}\n"
+        return f"export {key}={value}\n"
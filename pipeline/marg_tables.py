@@ -0,0 +1,207 @@
+"""Build the distance-marginalization table once and share it between bins.
+
+With marginalize_distance_interpolator = True, pycbc_inference evaluates
+the distance-marginalized likelihood on a marginalize_distance_density
+grid of (<s|h>, <h|h>) values, each a sum over marginalize_distance_samples
+distances, and fits a spline to it before sampling starts. The grid
+depends only on the distance prior and the [model] marginalization
+settings, not on the eccentricity bin, yet every bin job rebuilds it.
+
+This wraps pycbc_inference so that the grid is computed once and stored
+as a versioned table under --table-dir/<key>/ (lvals.npy, shr.npy,
+hhr.npy and manifest.json). <key> is a hash of the settings the grid
+depends on and of the pycbc version. Later jobs with the same key load
+the .npy files read-only with mmap and only fit the spline. The first
+job to need a table writes it, or it can be built up front with --build,
+which sets up the model of one config.ini without sampling.
+
+The sky-location/time/polarization draws of marginalize_vector_params are
+made afresh at every likelihood call, so there is no per-job table to
+share for those.
+
+Usage (in run.sh, in place of pycbc_inference; generate_bins.py
+--marg-tables writes this):
+    python marg_tables.py --table-dir /path/gw200105/marg_tables \\
+        --config-file config.ini --output-file result.hdf --nprocesses 32 ...
+    python marg_tables.py --table-dir ../../marg_tables --build --config-file base/config.ini
+"""
+import argparse
+import configparser
+import hashlib
+import json
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+TABLE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+# [model] options that determine the table
+MODEL_KEYS = ("marginalize_phase", "marginalize_distance", "marginalize_distance_param",
+              "marginalize_distance_samples", "marginalize_distance_snr_range",
+              "marginalize_distance_density")
+
+
+def table_settings(config_path):
+    """The settings of a config.ini that the distance table depends on."""
+    cp = configparser.ConfigParser(interpolation=None, strict=False)
+    cp.read(config_path)
+    settings = {f"model:{key}": " ".join(cp.get("model", key).split())
+                for key in MODEL_KEYS if cp.has_option("model", key)}
+    param = cp.get("model", "marginalize_distance_param", fallback="distance").strip()
+    for section in cp.sections():
+        # the distance prior and any transform producing distance from it
+        if section == f"prior-{param}" or section.startswith(f"waveform_transforms-{param}") \
+                or section.startswith("waveform_transforms-distance"):
+            for key, value in cp.items(section):
+                settings[f"{section}:{key}"] = " ".join(value.split())
+    return settings
+
+
+def table_key(settings, version):
+    text = json.dumps({"settings": settings, "pycbc": version, "table": TABLE_VERSION},
+                      sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+
+def load_table(directory):
+    """(shr, hhr, lvals) memory-mapped read-only, or None if there is no table."""
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        if json.load(f).get("version") != TABLE_VERSION:
+            return None
+    return tuple(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                 for name in ("shr", "hhr", "lvals"))
+
+
+def save_table(directory, shr, hhr, lvals, manifest):
+    """Write a table atomically; if another job got there first, keep theirs."""
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    for name, values in (("shr", shr), ("hhr", hhr), ("lvals", lvals)):
+        np.save(os.path.join(tmp, f"{name}.npy"), values)
+    with open(os.path.join(tmp, MANIFEST_NAME), "w") as f:
+        json.dump(dict(manifest, version=TABLE_VERSION), f, indent=1, sort_keys=True)
+    try:
+        os.rename(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def compute_table(dist_marg, phase, snr_range, density):
+    """The grid of pycbc's setup_distance_marg_interpolant."""
+    from pycbc.inference.models.tools import marginalize_likelihood
+
+    dist_rescale, _ = dist_marg
+    snr_min, snr_max = snr_range
+    smax, smin = dist_rescale.max(), dist_rescale.min()
+    shr = np.geomspace(snr_min ** 2.0 / smax, snr_max ** 2.0 / smin, density[0])
+    hhr = np.geomspace(snr_min ** 2.0 / smax / smax, snr_max ** 2.0 / smin / smin, density[1])
+    lvals = np.zeros((len(shr), len(hhr)))
+    for i, sh in enumerate(shr):
+        for j, hh in enumerate(hhr):
+            lvals[i, j] = marginalize_likelihood(sh, hh, distance=dist_marg, phase=phase)
+    return shr, hhr, lvals
+
+
+def interpolant(shr, hhr, lvals):
+    """pycbc's bounds-checked spline wrapper around a (shr, hhr, lvals) table."""
+    from scipy.interpolate import RectBivariateSpline
+
+    shr_min, shr_max, hhr_min, hhr_max = shr[0], shr[-1], hhr[0], hhr[-1]
+    interp = RectBivariateSpline(shr, hhr, lvals)
+
+    def interp_wrapper(x, y, bounds_check=True):
+        k = None
+        if bounds_check:
+            if isinstance(x, float):
+                if x > shr_max or x < shr_min or y > hhr_max or y < hhr_min:
+                    return -np.inf
+            else:
+                k = (x > shr_max) | (x < shr_min)
+                k = k | (y > hhr_max) | (y < hhr_min)
+        v = interp(x, y, grid=False)
+        if k is not None:
+            v[k] = -np.inf
+        return v
+    return interp_wrapper
+
+
+def install(table_dir, config_path):
+    """Make pycbc build distance interpolants from the shared table."""
+    import pycbc
+    from pycbc.inference.models import tools
+
+    settings = table_settings(config_path)
+    directory = os.path.join(table_dir, table_key(settings, pycbc.__version__))
+
+    def setup_distance_marg_interpolant(dist_marg, phase=False, snr_range=(1, 50),
+                                        density=(1000, 1000)):
+        table = load_table(directory)
+        if table is None:
+            print(f"[INFO] Computing distance marginalization table for {directory}")
+            table = compute_table(dist_marg, phase, snr_range, density)
+            save_table(directory, *table, {"settings": settings, "pycbc": pycbc.__version__,
+                                           "phase": bool(phase), "snr_range": list(snr_range),
+                                           "density": list(density)})
+        else:
+            print(f"[INFO] Loaded distance marginalization table from {directory}")
+        return interpolant(*table)
+
+    # setup_marginalization looks the function up in its module at call time
+    tools.setup_distance_marg_interpolant = setup_distance_marg_interpolant
+    return directory
+
+
+def build(config_path):
+    """Set up the model of a config.ini (reading its data), which builds the table."""
+    from pycbc.inference import models
+    from pycbc.workflow import WorkflowConfigParser
+
+    models.read_from_config(WorkflowConfigParser([config_path]))
+
+
+def config_file(inference_args):
+    """The first --config-file of a pycbc_inference command line."""
+    config = argparse.ArgumentParser(add_help=False)
+    config.add_argument("--config-file", nargs="+", required=True)
+    return config.parse_known_args(inference_args)[0].config_file[0]
+
+
+def run_inference(inference_args):
+    """Run pycbc_inference in this process, with whatever has been installed."""
+    executable = shutil.which("pycbc_inference")
+    if executable is None:
+        raise RuntimeError("pycbc_inference is not on the PATH")
+    sys.argv = [executable] + inference_args
+    runpy.run_path(executable, run_name="__main__")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--table-dir", required=True,
+                        help="Directory holding the tables (one subdirectory per key)")
+    parser.add_argument("--build", action="store_true",
+                        help="Only build the table for --config-file, do not sample")
+    opts, inference_args = parser.parse_known_args(args)
+    config_path = config_file(inference_args)
+
+    directory = install(opts.table_dir, config_path)
+    if opts.build:
+        if load_table(directory) is None:
+            build(config_path)
+        else:
+            print(f"[SKIP] {directory} already exists")
+        return
+    run_inference(inference_args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Recombine the eccentricity bins of a workflow into one posteriors.hdf.
+
+Each bin under runs/ was sampled with the eccentricity prior restricted to
+[e_lo, e_hi). The posterior over the parent prior is recovered by drawing
+from bin i in proportion to Z_i * w_i, where Z_i is the bin evidence and
+w_i the width of the bin in the coordinate of its prior (e for ``uniform``,
+log10(e) for ``uniform_log10``).
+
+The merge is incremental. Every bin's result.hdf is reduced once to a
+shuffled equal-weight draw that is kept in a cache directory, and a
+manifest records the file's mtime, size and hash together with the bin's
+evidence and sample counts. On later merges only bins whose result.hdf or
+config.ini changed are read again, in parallel over a process pool; the
+others are taken from the cache. Bins are read in chunks, so a worker only
+ever holds one chunk of one bin in memory. Weighted bins are reduced by
+systematic resampling (see resample.py).
+
+Usage (from a workflow directory):
+    python ../../../pipeline/merge_bins.py --runs-dir runs --output-file posteriors.hdf
+"""
+import argparse
+import configparser
+import glob
+import hashlib
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+from resample import (SKIP_COLUMNS, draw_samples, effective_sample_size,
+                      logsumexp, weight_stats)
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def read_bin_prior(config_path, param="eccentricity"):
+    """Return (prior name, min, max) of ``[prior-<param>]`` in a config.ini."""
+    cp = configparser.ConfigParser(interpolation=None, strict=False)
+    cp.read(config_path)
+    section = f"prior-{param}"
+    return (cp.get(section, "name").strip(),
+            cp.getfloat(section, f"min-{param}"),
+            cp.getfloat(section, f"max-{param}"))
+
+
+def prior_width(name, lo, hi):
+    """Width of [lo, hi] in the coordinate the prior is uniform in."""
+    if name == "uniform_log10":
+        return np.log10(hi) - np.log10(lo)
+    if name == "uniform":
+        return hi - lo
+    raise ValueError(f"Unsupported bin prior '{name}'")
+
+
+def file_digest(path, blocksize=1 << 24):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_state(path):
+    st = os.stat(path)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def extract_bin(bin_dir, cache_file, param="eccentricity", chunk_size=100000,
+                seed=0):
+    """Reduce one bin to a shuffled equal-weight draw and return its manifest entry.
+
+    The draw holds round(ESS) rows, so any prefix of it is itself a fair
+    posterior draw from the bin. Runs in a worker process.
+    """
+    name = os.path.basename(bin_dir)
+    result = os.path.join(bin_dir, "result.hdf")
+    config = os.path.join(bin_dir, "config.ini")
+    prior, lo, hi = read_bin_prior(config, param)
+    rng = np.random.default_rng([seed, zlib.crc32(name.encode())])
+
+    with h5py.File(result, "r") as f:
+        if "log_evidence" not in f.attrs:
+            return None
+        samples = f["samples"]
+        params = [p for p in samples if p not in SKIP_COLUMNS]
+        lsum, lsum2, nraw = weight_stats(samples, chunk_size)
+        ess = effective_sample_size(lsum, lsum2)
+        ncache = max(int(round(ess)), 1)
+        draws = draw_samples(samples, ncache, rng, chunk_size, params, lsum)
+        log_evidence = float(f.attrs["log_evidence"])
+        dlog_evidence = float(f.attrs.get("dlog_evidence", 0.0))
+
+    with h5py.File(cache_file, "w") as f:
+        grp = f.create_group("samples")
+        for p in params:
+            grp.create_dataset(p, data=draws[p])
+
+    return {
+        "name": name,
+        "result": dict(file_state(result), sha256=file_digest(result)),
+        "config": dict(file_state(config), sha256=file_digest(config)),
+        "cache": os.path.basename(cache_file),
+        "prior": prior,
+        "min": lo,
+        "max": hi,
+        "log_evidence": log_evidence,
+        "dlog_evidence": dlog_evidence,
+        "nraw": nraw,
+        "ess": ess,
+        "ncache": ncache,
+        "params": params,
+    }
+
+
+def load_manifest(cache_dir, param):
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("parameter") != param:
+        print(f"[INFO] Ignoring stale manifest {path}")
+        return {}
+    return manifest["bins"]
+
+
+def save_manifest(cache_dir, param, entries):
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "parameter": param,
+                   "bins": entries}, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def is_unchanged(entry, path, key):
+    """Compare a file against its manifest record, hashing only if stat differs.
+
+    A file whose content is unchanged but was touched has its stat refreshed
+    in the entry.
+    """
+    old = entry[key]
+    state = file_state(path)
+    if state["mtime_ns"] == old["mtime_ns"] and state["size"] == old["size"]:
+        return True
+    if state["size"] != old["size"] or file_digest(path) != old["sha256"]:
+        return False
+    old.update(state)
+    return True
+
+
+def update_cache(runs_dir, cache_dir, param="eccentricity", chunk_size=100000,
+                 seed=0, nproc=1):
+    """Bring the per-bin cache up to date and return the manifest entries."""
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = load_manifest(cache_dir, param)
+
+    entries, stale = {}, []
+    for bin_dir in sorted(glob.glob(os.path.join(runs_dir, "e_*"))):
+        name = os.path.basename(bin_dir)
+        result = os.path.join(bin_dir, "result.hdf")
+        config = os.path.join(bin_dir, "config.ini")
+        if not (os.path.isfile(result) and os.path.isfile(config)):
+            print(f"[SKIP] No result.hdf/config.ini in {bin_dir}")
+            continue
+        entry = manifest.get(name)
+        if (entry is not None
+                and os.path.isfile(os.path.join(cache_dir, entry["cache"]))
+                and is_unchanged(entry, result, "result")
+                and is_unchanged(entry, config, "config")):
+            entries[name] = entry
+        else:
+            stale.append(bin_dir)
+
+    for name in set(manifest) - set(entries):
+        cache_file = os.path.join(cache_dir, manifest[name]["cache"])
+        if os.path.isfile(cache_file) and not any(
+                os.path.basename(d) == name for d in stale):
+            os.remove(cache_file)
+
+    print(f"[INFO] {len(entries)} bins unchanged, reading {len(stale)}")
+    args = [(d, os.path.join(cache_dir, os.path.basename(d) + ".hdf"), param,
+             chunk_size, seed) for d in stale]
+    if nproc > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=nproc) as pool:
+            new = list(pool.map(extract_bin, *zip(*args)))
+    else:
+        new = [extract_bin(*a) for a in args]
+
+    for bin_dir, entry in zip(stale, new):
+        if entry is None:
+            print(f"[SKIP] {bin_dir}/result.hdf has no log_evidence (run not finished?)")
+            continue
+        entries[entry["name"]] = entry
+
+    save_manifest(cache_dir, param, entries)
+    return sorted(entries.values(), key=lambda b: b["min"])
+
+
+def bin_fractions(bins):
+    """Posterior mass of each bin and the evidence over the parent prior."""
+    widths = np.array([prior_width(b["prior"], b["min"], b["max"]) for b in bins])
+    logz = np.array([b["log_evidence"] for b in bins])
+    dlogz = np.array([b["dlog_evidence"] for b in bins])
+
+    for prev, cur in zip(bins[:-1], bins[1:]):
+        if not np.isclose(prev["max"], cur["min"]):
+            print(f"[WARN] Bins {prev['name']} and {cur['name']} do not tile the prior "
+                  f"({prev['max']} != {cur['min']})")
+
+    logmass = logz + np.log(widths)
+    lognorm = logsumexp(logmass)
+    frac = np.exp(logmass - lognorm)
+    log_evidence = lognorm - np.log(widths.sum())
+    dlog_evidence = np.sqrt(np.sum((frac * dlogz) ** 2))
+    return frac, log_evidence, dlog_evidence
+
+
+def default_nsamples(bins, frac):
+    """Largest output size for which no bin is asked for more than its ESS."""
+    ratios = [b["ncache"] / f for b, f in zip(bins, frac) if f > 0]
+    return int(min(ratios))
+
+
+def allocate(nsamples, frac, rng):
+    """Split nsamples between bins by systematic allocation.
+
+    Unlike a multinomial draw, no bin gets more than one sample above its
+    expected share, so the default output size never oversamples a bin.
+    """
+    edges = np.floor(np.cumsum(frac) / np.sum(frac) * nsamples + rng.random())
+    edges = np.clip(edges, 0, nsamples).astype(int)
+    edges[-1] = nsamples
+    return np.diff(np.concatenate([[0], edges]))
+
+
+def merge_bins(runs_dir, output_file, nsamples=None, param="eccentricity",
+               chunk_size=100000, seed=0, cache_dir=None, nproc=1):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(output_file)),
+                                 "merge_cache")
+    bins = update_cache(runs_dir, cache_dir, param, chunk_size, seed, nproc)
+    if not bins:
+        raise RuntimeError(f"No finished bins found under {runs_dir}")
+
+    frac, log_evidence, dlog_evidence = bin_fractions(bins)
+    if nsamples is None:
+        nsamples = default_nsamples(bins, frac)
+    rng = np.random.default_rng(seed)
+    counts = allocate(nsamples, frac, rng)
+
+    params = [p for p in bins[0]["params"] if all(p in b["params"] for b in bins)]
+    out = {p: np.empty(nsamples, dtype=float) for p in params}
+    slots = rng.permutation(nsamples)
+
+    offset = 0
+    for b, f_bin, count in zip(bins, frac, counts):
+        if count > b["ncache"]:
+            print(f"[WARN] {b['name']}: {count} samples requested but only "
+                  f"{b['ncache']} cached, repeating samples")
+        print(f"[INFO] {b['name']}: fraction {f_bin:.4f}, "
+              f"drawing {count} of {b['nraw']} samples (ESS {b['ess']:.0f})")
+        if count == 0:
+            continue
+        # Cached draws are already shuffled, so the first rows are a fair draw
+        idx = np.arange(count) % b["ncache"]
+        dest = slots[offset:offset + count]
+        with h5py.File(os.path.join(cache_dir, b["cache"]), "r") as f:
+            for p in params:
+                out[p][dest] = f["samples"][p][:min(count, b["ncache"])][idx]
+        offset += count
+
+    with h5py.File(output_file, "w") as f:
+        f.attrs["log_evidence"] = log_evidence
+        f.attrs["dlog_evidence"] = dlog_evidence
+        grp = f.create_group("samples")
+        for p in params:
+            grp.create_dataset(p, data=out[p])
+        meta = f.create_group("bins")
+        meta.create_dataset("name", data=np.array([b["name"] for b in bins], dtype="S"))
+        for key in ("min", "max", "log_evidence", "dlog_evidence", "nraw", "ess"):
+            meta.create_dataset(key, data=np.array([b[key] for b in bins]))
+        meta.create_dataset("fraction", data=frac)
+        meta.create_dataset("nsamples", data=counts)
+
+    print(f"[INFO] Wrote {nsamples} samples from {len(bins)} bins to {output_file} "
+          f"(log Z = {log_evidence:.3f} +/- {dlog_evidence:.3f})")
+    return output_file
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs-dir", default="runs",
+                        help="Directory holding the e_* bin directories")
+    parser.add_argument("--output-file", default="posteriors.hdf")
+    parser.add_argument("--nsamples", type=int, default=None,
+                        help="Number of combined samples (default: as many as "
+                             "the bins support without oversampling)")
+    parser.add_argument("--parameter", default="eccentricity",
+                        help="Parameter the prior was binned in")
+    parser.add_argument("--chunk-size", type=int, default=100000,
+                        help="Rows read from a bin at a time")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Where per-bin draws and the manifest are kept "
+                             "(default: merge_cache/ next to the output file)")
+    parser.add_argument("--nprocesses", type=int, default=1,
+                        help="Worker processes used to read changed bins")
+    parser.add_argument("--seed", type=int, default=0)
+    opts = parser.parse_args(args)
+    merge_bins(opts.runs_dir, opts.output_file, nsamples=opts.nsamples,
+               param=opts.parameter, chunk_size=opts.chunk_size, seed=opts.seed,
+               cache_dir=opts.cache_dir, nproc=opts.nprocesses)
+
+
+if __name__ == "__main__":
+    main()
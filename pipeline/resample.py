@@ -0,0 +1,166 @@
+"""Resample a weighted dynesty result file to an equal-weight posterior.
+
+pycbc_inference with dynesty stores every dead point under samples/ with
+its log importance weight in samples/logwt; an nlive = 4000 run keeps far
+more rows than it has independent samples. This reduces such a file to
+an equal-weight posterior of a requested size (by default the Kish
+effective sample size, ESS = (sum w)^2 / sum w^2) by systematic
+(low-variance) resampling: one uniform offset u places draws at the
+cumulative weights (u + k) / N, so every row is drawn floor or ceil of
+N w_i times and the draw adds less noise than multinomial resampling.
+
+The file is streamed: a first pass over logwt gives the normalisation and
+the ESS, a second reads the parameter columns a chunk at a time and keeps
+only the rows drawn from it. Only the output posterior is held in memory.
+It is written shuffled, so any prefix of it is a fair draw, with the ESS
+and the number of input rows as attributes.
+
+Files without logwt are already equal-weight; they are subsampled without
+replacement (or repeated, when more rows are asked for than they have).
+
+Usage (from a bin directory):
+    python ../../../../pipeline/resample.py --input-file result.hdf --output-file pos.hdf
+    python ../../../../pipeline/resample.py --input-file result.hdf --output-file pos.hdf --nsamples 20000
+"""
+import argparse
+
+import h5py
+import numpy as np
+
+# Columns written by pycbc's dynesty io that are not posterior parameters
+WEIGHT_COLUMN = "logwt"
+SKIP_COLUMNS = (WEIGHT_COLUMN,)
+
+
+def logsumexp(x):
+    x = np.asarray(x, dtype=float)
+    if x.size == 0:
+        return -np.inf
+    m = np.max(x)
+    if not np.isfinite(m):
+        return m
+    return m + np.log(np.sum(np.exp(x - m)))
+
+
+def weight_stats(samples, chunk_size):
+    """Stream the logwt column and return (log sum w, log sum w^2, n).
+
+    Files without a logwt column are treated as equal-weight posteriors.
+    """
+    n = len(samples[next(iter(samples))])
+    if WEIGHT_COLUMN not in samples:
+        return np.log(n), np.log(n), n
+    ds = samples[WEIGHT_COLUMN]
+    lsum = lsum2 = -np.inf
+    for start in range(0, n, chunk_size):
+        logwt = ds[start:start + chunk_size]
+        lsum = np.logaddexp(lsum, logsumexp(logwt))
+        lsum2 = np.logaddexp(lsum2, logsumexp(2 * logwt))
+    return lsum, lsum2, n
+
+
+def effective_sample_size(lsum, lsum2):
+    return float(np.exp(2 * lsum - lsum2))
+
+
+def systematic_positions(ndraw, rng):
+    """Sorted positions (u + k) / ndraw in [0, 1) of a systematic resample."""
+    return (rng.random() + np.arange(ndraw)) / ndraw
+
+
+def iter_draws(samples, ndraw, rng, chunk_size, lsum=None):
+    """Yield (start, stop, local indices) of the rows drawn from each chunk.
+
+    Weighted files are resampled systematically in proportion to
+    exp(logwt); equal-weight files are drawn without replacement where
+    possible.
+    """
+    n = len(samples[next(iter(samples))])
+    if WEIGHT_COLUMN not in samples:
+        idx = np.sort(rng.choice(n, ndraw, replace=ndraw > n))
+        for start in range(0, n, chunk_size):
+            stop = min(start + chunk_size, n)
+            lo, hi = np.searchsorted(idx, [start, stop])
+            yield start, stop, idx[lo:hi] - start
+        return
+
+    ds = samples[WEIGHT_COLUMN]
+    if lsum is None:
+        lsum, _, _ = weight_stats(samples, chunk_size)
+    # Each chunk claims the positions that fall inside its share of the
+    # total weight.
+    positions = systematic_positions(ndraw, rng)
+    cum = 0.0
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        cw = cum + np.cumsum(np.exp(ds[start:stop] - lsum))
+        lo, hi = np.searchsorted(positions, [cum, cw[-1]], side="right")
+        if stop == n:
+            hi = ndraw
+        local = np.searchsorted(cw, positions[lo:hi], side="right")
+        yield start, stop, np.minimum(local, stop - start - 1)
+        cum = cw[-1]
+
+
+def draw_samples(samples, ndraw, rng, chunk_size, params=None, lsum=None):
+    """{param: array} of ndraw equal-weight rows, in shuffled order."""
+    if params is None:
+        params = [p for p in samples if p not in SKIP_COLUMNS]
+    draws = {p: np.empty(ndraw, dtype=samples[p].dtype) for p in params}
+    slots = rng.permutation(ndraw)
+    offset = 0
+    for start, stop, local in iter_draws(samples, ndraw, rng, chunk_size, lsum):
+        if len(local) == 0:
+            continue
+        dest = slots[offset:offset + len(local)]
+        for p in params:
+            draws[p][dest] = samples[p][start:stop][local]
+        offset += len(local)
+    return draws
+
+
+def resample(input_file, output_file, nsamples=None, chunk_size=100000, seed=0):
+    """Write an equal-weight posterior of nsamples rows (default: the ESS)."""
+    rng = np.random.default_rng(seed)
+    with h5py.File(input_file, "r") as f:
+        samples = f["samples"]
+        lsum, lsum2, nraw = weight_stats(samples, chunk_size)
+        ess = effective_sample_size(lsum, lsum2)
+        if nsamples is None:
+            nsamples = max(int(round(ess)), 1)
+        print(f"[INFO] {input_file}: {nraw} samples, ESS {ess:.0f} "
+              f"({100 * ess / nraw:.1f}% efficiency)")
+        if nsamples > ess:
+            print(f"[WARN] Drawing {nsamples} samples from an ESS of {ess:.0f}, "
+                  f"the output repeats samples")
+        draws = draw_samples(samples, nsamples, rng, chunk_size, lsum=lsum)
+        attrs = dict(f.attrs)
+
+    with h5py.File(output_file, "w") as f:
+        f.attrs.update(attrs)
+        f.attrs["ess"] = ess
+        f.attrs["nraw"] = nraw
+        grp = f.create_group("samples")
+        for p, values in draws.items():
+            grp.create_dataset(p, data=values)
+    print(f"[INFO] Wrote {nsamples} equal-weight samples to {output_file}")
+    return ess
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--input-file", required=True,
+                        help="pycbc_inference result file with a samples group")
+    parser.add_argument("--output-file", required=True)
+    parser.add_argument("--nsamples", type=int, default=None,
+                        help="Number of equal-weight samples (default: the ESS)")
+    parser.add_argument("--chunk-size", type=int, default=100000,
+                        help="Rows read at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    opts = parser.parse_args(args)
+    resample(opts.input_file, opts.output_file, nsamples=opts.nsamples,
+             chunk_size=opts.chunk_size, seed=opts.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Size each bin's request_cpus and request_memory from measured usage.
+
+Every generated submit.sub asks for the same slot as the base file, although
+low-eccentricity bins, HM runs and the two waveform families have very
+different footprints. This reads the HTCondor job log of each finished bin
+(or of a single profiling run), takes the peak resident memory and the
+cores actually kept busy ((user + system CPU time) / wall time), and
+rewrites the bin's request_memory and request_cpus with a safety margin.
+--nprocesses in run.sh is lowered along with request_cpus so the job never
+uses more cores than it asks for. Smaller slots match and backfill faster.
+
+Bins without a log of their own take the measurement of the nearest
+measured bin. request_cpus is capped at --max-cpus, by default the
+request_cpus of the workflow's base/submit.sub, so a bin that was sized
+down earlier can be sized up again.
+
+Usage (from a workflow directory):
+    python ../../../pipeline/resources.py --runs-dir runs
+    python ../../../pipeline/resources.py --runs-dir runs --apply
+    python ../../../pipeline/resources.py --runs-dir runs --profile-log logs/profile.log --apply
+"""
+import argparse
+import datetime
+import math
+import os
+import re
+
+from inifile import CommandScript, IniFile
+from submit_bins import find_bins
+
+_EVENT = re.compile(r"^(?P<code>\d{3}) \((?P<job>[\d.]+)\) "
+                    r"(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}|\d{2}/\d{2} \d{2}:\d{2}:\d{2})")
+_USAGE = re.compile(r"Usr (\d+) (\d+):(\d+):(\d+), Sys (\d+) (\d+):(\d+):(\d+)\s+-\s+Run Remote Usage")
+_RESOURCE = re.compile(r"^\s*(?P<name>Cpus|Memory \(MB\)|Disk \(KB\))\s*:\s*(?P<usage>[\d.]+)")
+_RSS = re.compile(r"(?P<value>\d+)\s+-\s+ResidentSetSize of job \(KB\)")
+_MEMUSAGE = re.compile(r"(?P<value>\d+)\s+-\s+MemoryUsage of job \(MB\)")
+_RETURN = re.compile(r"Normal termination \(return value (?P<code>\d+)\)")
+
+SUBMIT, EXECUTE, EVICTED, TERMINATED, IMAGE_SIZE = "000", "001", "004", "005", "006"
+ABORTED, HELD, RELEASED = "009", "012", "013"
+
+
+def parse_time(text, year=None):
+    if "-" in text:
+        return datetime.datetime.strptime(text, "%Y-%m-%d %H:%M:%S")
+    year = year or datetime.datetime.now().year
+    return datetime.datetime.strptime(f"{year}/{text}", "%Y/%m/%d %H:%M:%S")
+
+
+def parse_events(text):
+    """Split HTCondor user-log text into (code, job id, time, body lines).
+
+    Only complete events (terminated by a '...' line) are returned, together
+    with the number of characters consumed, so callers can resume parsing
+    from where a partially written event starts.
+    """
+    events = []
+    consumed = 0
+    current = None
+    pos = 0
+    for line in text.splitlines(True):
+        pos += len(line)
+        stripped = line.rstrip("\n")
+        m = _EVENT.match(stripped)
+        if m and current is None:
+            current = (m.group("code"), m.group("job"), parse_time(m.group("time")),
+                       [stripped[m.end():].strip()])
+        elif stripped.strip() == "...":
+            if current is not None:
+                events.append(current)
+            current = None
+            consumed = pos
+        elif current is not None:
+            current[3].append(stripped)
+    return events, consumed
+
+
+def _seconds(days, hours, minutes, seconds):
+    return ((int(days) * 24 + int(hours)) * 60 + int(minutes)) * 60 + int(seconds)
+
+
+def summarize_events(events, summary=None):
+    """Fold parsed events into a per-log summary of the latest run.
+
+    Keys: state (idle, running, held, done, failed or aborted), submitted,
+    started, ended, return_code, wall (s), cpu (s of user + system time),
+    peak_rss_mb and cpus_used. Passing the previous summary back in folds
+    newly appended events into it.
+    """
+    s = summary if summary is not None else {"peak_rss_mb": 0.0}
+    for code, _, time, body in events:
+        text = "\n".join(body)
+        if code == SUBMIT:
+            s.setdefault("submitted", time)
+            s["state"] = "idle"
+        elif code == EXECUTE:
+            s["started"] = time
+            s["state"] = "running"
+            s.pop("ended", None)
+            s.pop("return_code", None)
+        elif code in (EVICTED, RELEASED):
+            s["state"] = "idle"
+        elif code == HELD:
+            s["state"] = "held"
+        elif code == IMAGE_SIZE:
+            m = _RSS.search(text)
+            if m:
+                s["peak_rss_mb"] = max(s["peak_rss_mb"], int(m.group("value")) / 1024)
+            m = _MEMUSAGE.search(text)
+            if m:
+                s["peak_rss_mb"] = max(s["peak_rss_mb"], float(m.group("value")))
+        elif code == TERMINATED:
+            s["ended"] = time
+            m = _RETURN.search(text)
+            s["return_code"] = int(m.group("code")) if m else None
+            s["state"] = "done" if s["return_code"] == 0 else "failed"
+            m = _USAGE.search(text)
+            if m:
+                g = m.groups()
+                s["cpu"] = _seconds(*g[:4]) + _seconds(*g[4:])
+            for line in body:
+                m = _RESOURCE.match(line)
+                if m and m.group("name") == "Memory (MB)":
+                    s["peak_rss_mb"] = max(s["peak_rss_mb"], float(m.group("usage")))
+                elif m and m.group("name") == "Cpus":
+                    s["cpus_used"] = float(m.group("usage"))
+            if "started" in s:
+                s["wall"] = (time - s["started"]).total_seconds()
+        elif code == ABORTED:
+            s["state"] = "aborted"
+    if s.get("wall") and s.get("cpu") is not None:
+        # CPU time over wall time is the number of cores actually kept busy
+        s["cpus_used"] = s["cpu"] / s["wall"]
+    return s
+
+
+def read_job_log(path):
+    with open(path, errors="replace") as f:
+        events, _ = parse_events(f.read())
+    return summarize_events(events)
+
+
+def measured_usage(path):
+    """(cores used, peak RSS in MB) of a finished job log, or None."""
+    if not os.path.isfile(path):
+        return None
+    s = read_job_log(path)
+    if s.get("return_code") != 0 or not s.get("cpus_used") or not s.get("peak_rss_mb"):
+        return None
+    return s["cpus_used"], s["peak_rss_mb"]
+
+
+def size_request(cpus_used, rss_mb, max_cpus, cpu_margin=0.2, memory_margin=0.3,
+                 cpu_step=4, min_cpus=1):
+    """New (request_cpus, request_memory in GB) from measured usage."""
+    cpus = math.ceil(cpus_used * (1 + cpu_margin) / cpu_step) * cpu_step
+    cpus = int(min(max(cpus, min_cpus), max_cpus))
+    memory_gb = max(int(math.ceil(rss_mb * (1 + memory_margin) / 1024)), 1)
+    return cpus, memory_gb
+
+
+def parse_memory_gb(text):
+    value, _, unit = text.strip().partition(" ")
+    unit = unit.strip().upper() or "MB"
+    return float(value) * {"KB": 1 / 1024 ** 2, "MB": 1 / 1024, "GB": 1, "TB": 1024}[unit]
+
+
+def base_cpus(runs_dir):
+    """request_cpus of the base/submit.sub next to runs_dir, or None."""
+    path = os.path.join(os.path.dirname(os.path.abspath(runs_dir)), "base", "submit.sub")
+    if not os.path.isfile(path):
+        return None
+    return int(IniFile.read(path).get(None, "request_cpus"))
+
+
+def plan(runs_dir, profile_log=None, max_cpus=None, **kwargs):
+    """Measured usage and the new requests of every bin.
+
+    request_cpus is capped at max_cpus, by default the base submit file's;
+    without either, at each bin's current request.
+    """
+    bins = find_bins(runs_dir)
+    max_cpus = max_cpus or base_cpus(runs_dir)
+    rows = []
+    profile = measured_usage(profile_log) if profile_log else None
+    if profile_log and profile is None:
+        raise RuntimeError(f"No finished, successful job in {profile_log}")
+    for name, bin_dir in bins:
+        sub = IniFile.read(os.path.join(bin_dir, "submit.sub"))
+        usage = profile or measured_usage(sub.get(None, "log"))
+        rows.append({"name": name, "dir": bin_dir, "usage": usage,
+                     "source": "profile" if profile else ("log" if usage else None),
+                     "cpus": int(sub.get(None, "request_cpus")),
+                     "memory_gb": parse_memory_gb(sub.get(None, "request_memory"))})
+
+    measured = [i for i, r in enumerate(rows) if r["usage"]]
+    for i, row in enumerate(rows):
+        if not row["usage"] and measured:
+            nearest = min(measured, key=lambda j: abs(j - i))
+            row["usage"] = rows[nearest]["usage"]
+            row["source"] = f"from {rows[nearest]['name']}"
+        if row["usage"]:
+            row["new_cpus"], row["new_memory_gb"] = size_request(
+                *row["usage"], max_cpus=max_cpus or row["cpus"], **kwargs)
+    return rows
+
+
+def apply(rows):
+    """Rewrite request_cpus/request_memory and --nprocesses of each bin."""
+    for row in rows:
+        if "new_cpus" not in row:
+            continue
+        sub_path = os.path.join(row["dir"], "submit.sub")
+        IniFile.read(sub_path).write(sub_path, {
+            (None, "request_cpus"): str(row["new_cpus"]),
+            (None, "request_memory"): f"{row['new_memory_gb']} GB",
+        })
+        run_path = os.path.join(row["dir"], "run.sh")
+        run = CommandScript.read(run_path)
+        if run.has(None, "--nprocesses"):
+            run.write(run_path, {(None, "--nprocesses"): str(row["new_cpus"])})
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs-dir", default="runs")
+    parser.add_argument("--profile-log", default=None,
+                        help="Job log of a profiling run to size every bin from")
+    parser.add_argument("--cpu-margin", type=float, default=0.2)
+    parser.add_argument("--memory-margin", type=float, default=0.3)
+    parser.add_argument("--cpu-step", type=int, default=4,
+                        help="Round request_cpus up to a multiple of this")
+    parser.add_argument("--max-cpus", type=int, default=None,
+                        help="Largest request_cpus (default: that of ../base/submit.sub)")
+    parser.add_argument("--apply", action="store_true",
+                        help="Rewrite submit.sub and run.sh (default: only report)")
+    opts = parser.parse_args(args)
+
+    rows = plan(opts.runs_dir, profile_log=opts.profile_log,
+                cpu_margin=opts.cpu_margin, memory_margin=opts.memory_margin,
+                cpu_step=opts.cpu_step, max_cpus=opts.max_cpus)
+    print(f"{'bin':<12} {'used cpus':>9} {'peak GB':>8}   {'request':>14} -> {'new':<14} source")
+    for r in rows:
+        used = (f"{r['usage'][0]:9.1f} {r['usage'][1] / 1024:8.1f}"
+                if r["usage"] else f"{'-':>9} {'-':>8}")
+        old = f"{r['cpus']} / {r['memory_gb']:g} GB"
+        new = f"{r['new_cpus']} / {r['new_memory_gb']} GB" if "new_cpus" in r else "unchanged"
+        print(f"{r['name']:<12} {used}   {old:>14} -> {new:<14} {r['source'] or ''}")
+    if opts.apply:
+        apply(rows)
+        print(f"[INFO] Updated requests of {sum('new_cpus' in r for r in rows)} bins")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Report the progress of every bin of a workflow in one table.
+
+For each runs/e_* bin this reads the Condor job log (queue state, run time),
+the dynesty progress line in the verbose stderr output (iteration and the
+current dlogz against the target in config.ini) and the age of the
+checkpoint file, which pycbc_inference rewrites every
+checkpoint_time_interval seconds. From the observed decay of dlogz it
+estimates the time to completion, and flags stragglers: held bins, running
+bins whose checkpoint or output has gone stale, and bins whose estimate is
+far beyond the median of the others.
+
+Logs are tailed: the byte offset reached in each file and the state folded
+from it are kept in runs/.status.json, so a poll only reads what was
+appended since the previous one.
+
+Usage (from a workflow directory):
+    python ../../../pipeline/status_bins.py --runs-dir runs
+    python ../../../pipeline/status_bins.py --runs-dir runs --watch 300
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import re
+import statistics
+import time
+
+from inifile import CommandScript, IniFile
+from resources import parse_events, summarize_events
+from submit_bins import find_bins
+
+STATE_NAME = ".status.json"
+STATE_VERSION = 1
+
+# dynesty's print_func output, e.g. "iter: 5321 | ... | dlogz: 12.345 >  0.100"
+_PROGRESS = re.compile(r"iter:\s*(?P<iter>\d+).*?dlogz:\s*(?P<dlogz>[-+\d.eEinf]+)\s*>")
+
+_TIMES = ("submitted", "started", "ended")
+HISTORY = 20
+
+
+def read_new(path, entry):
+    """Bytes appended to ``path`` since the offset stored in ``entry``.
+
+    The offset restarts from zero when the file was replaced or truncated
+    (e.g. a retried job overwriting its output).
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if entry.get("inode") != st.st_ino or st.st_size < entry.get("offset", 0):
+        entry.clear()
+        entry.update(inode=st.st_ino, offset=0)
+    entry["mtime"] = st.st_mtime
+    if st.st_size == entry["offset"]:
+        return b""
+    with open(path, "rb") as f:
+        f.seek(entry["offset"])
+        return f.read(st.st_size - entry["offset"])
+
+
+def tail_job_log(path, entry):
+    """Fold the complete events appended to a Condor job log into entry."""
+    data = read_new(path, entry)
+    if data is None:
+        return None
+    summary = entry.get("summary", {"peak_rss_mb": 0.0})
+    for key in _TIMES:
+        if key in summary:
+            summary[key] = datetime.datetime.fromisoformat(summary[key])
+    if data:
+        # Condor logs are ASCII; latin-1 keeps characters and bytes aligned
+        events, consumed = parse_events(data.decode("latin-1"))
+        summarize_events(events, summary)
+        entry["offset"] += consumed
+    entry["summary"] = {k: v.isoformat() if k in _TIMES else v for k, v in summary.items()}
+    return summary
+
+
+def tail_progress(path, entry):
+    """Latest dynesty iteration and dlogz appended to the stderr file."""
+    data = read_new(path, entry)
+    if data is None:
+        return None
+    if data:
+        # progress lines are rewritten in place with carriage returns
+        end = max(data.rfind(b"\n"), data.rfind(b"\r")) + 1
+        for line in reversed(re.split(r"[\r\n]", data[:end].decode("latin-1"))):
+            m = _PROGRESS.search(line)
+            if m:
+                entry["iter"] = int(m.group("iter"))
+                entry["dlogz"] = float(m.group("dlogz"))
+                history = entry.setdefault("history", [])
+                history.append((entry["mtime"], entry["dlogz"]))
+                del history[:-HISTORY]
+                entry.setdefault("first_dlogz", entry["dlogz"])
+                break
+        entry["offset"] += end
+    return entry
+
+
+def estimate_remaining(entry, target, now):
+    """Seconds until dlogz reaches target, from the decay rate of log(dlogz)."""
+    history = [(t, d) for t, d in entry.get("history", []) if d > 0]
+    if len(history) < 2 or history[-1][0] <= history[0][0]:
+        return None
+    (t0, d0), (t1, d1) = history[0], history[-1]
+    rate = (math.log(d0) - math.log(d1)) / (t1 - t0)
+    if rate <= 0:
+        return None
+    return max((math.log(d1) - math.log(target)) / rate - (now - t1), 0.0)
+
+
+def progress_fraction(entry, target):
+    first, current = entry.get("first_dlogz"), entry.get("dlogz")
+    if not first or not current or first <= target:
+        return None
+    if current <= target:
+        return 1.0
+    return min(max(math.log(first / current) / math.log(first / target), 0.0), 1.0)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    if seconds >= 86400:
+        return f"{seconds // 86400}d{seconds % 86400 // 3600:02d}h"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+def load_state(runs_dir):
+    path = os.path.join(runs_dir, STATE_NAME)
+    if os.path.isfile(path):
+        with open(path) as f:
+            state = json.load(f)
+        if state.get("version") == STATE_VERSION:
+            return state
+    return {"version": STATE_VERSION, "bins": {}}
+
+
+def save_state(runs_dir, state):
+    path = os.path.join(runs_dir, STATE_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def bin_status(name, bin_dir, entry, now):
+    """Poll one bin and return its row of the status table."""
+    if "paths" not in entry:
+        sub = IniFile.read(os.path.join(bin_dir, "submit.sub"))
+        config = IniFile.read(os.path.join(bin_dir, "config.ini"))
+        output = CommandScript.read(os.path.join(bin_dir, "run.sh")).get(
+            None, "--output-file", os.path.join(bin_dir, "result.hdf"))
+        entry["paths"] = {"log": sub.get(None, "log"), "err": sub.get(None, "error"),
+                          "result": output}
+        entry["target"] = float(config.get("sampler", "dlogz", "0.1"))
+        entry["interval"] = float(config.get("sampler", "checkpoint_time_interval", "1800"))
+    paths = entry["paths"]
+
+    summary = tail_job_log(paths["log"], entry.setdefault("log", {})) or {}
+    progress = tail_progress(paths["err"], entry.setdefault("err", {})) or {}
+    state = summary.get("state", "unsubmitted")
+    if state != "done" and os.path.isfile(paths["result"]) and not summary:
+        state = "done"
+
+    row = {"name": name, "state": state, "iter": progress.get("iter"),
+           "dlogz": progress.get("dlogz"), "target": entry["target"],
+           "progress": progress_fraction(progress, entry["target"]),
+           "runtime": None, "checkpoint_age": None, "eta": None, "flags": []}
+    if state == "done":
+        row["progress"] = 1.0
+    if summary.get("started"):
+        end = summary.get("ended") if state != "running" else None
+        row["runtime"] = ((end or datetime.datetime.now()) - summary["started"]).total_seconds()
+
+    checkpoint = paths["result"] + ".checkpoint"
+    if os.path.isfile(checkpoint):
+        row["checkpoint_age"] = now - os.stat(checkpoint).st_mtime
+    if state == "running":
+        row["eta"] = estimate_remaining(progress, entry["target"], now)
+        stale = 2 * entry["interval"]
+        if row["runtime"] and row["runtime"] > stale and \
+                (row["checkpoint_age"] is None or row["checkpoint_age"] > stale):
+            row["flags"].append("stale checkpoint")
+        if progress.get("mtime") and now - progress["mtime"] > entry["interval"]:
+            row["flags"].append("no output")
+    elif state in ("held", "failed", "aborted"):
+        row["flags"].append(state)
+    return row
+
+
+def flag_stragglers(rows, factor=3.0):
+    """Flag running bins expected to finish far later than the median."""
+    etas = [r["eta"] for r in rows if r["eta"] is not None]
+    if len(etas) < 3:
+        return
+    median = statistics.median(etas)
+    for r in rows:
+        if r["eta"] is not None and r["eta"] > factor * max(median, 600):
+            r["flags"].append(f"slow ({r['eta'] / max(median, 1):.0f}x median)")
+
+
+def status(runs_dir, straggler_factor=3.0):
+    runs_dir = os.path.abspath(runs_dir)
+    state = load_state(runs_dir)
+    now = time.time()
+    rows = []
+    for name, bin_dir in find_bins(runs_dir):
+        rows.append(bin_status(name, bin_dir, state["bins"].setdefault(name, {}), now))
+    flag_stragglers(rows, straggler_factor)
+    save_state(runs_dir, state)
+    return rows
+
+
+def print_table(rows):
+    print(f"{'bin':<12} {'state':<11} {'runtime':>8} {'iter':>8} {'dlogz':>10} "
+          f"{'done':>5} {'ckpt age':>8} {'eta':>8}  flags")
+    for r in rows:
+        dlogz = f"{r['dlogz']:.3g}/{r['target']:g}" if r["dlogz"] is not None else "-"
+        done = f"{100 * r['progress']:.0f}%" if r["progress"] is not None else "-"
+        print(f"{r['name']:<12} {r['state']:<11} {format_duration(r['runtime']):>8} "
+              f"{r['iter'] if r['iter'] is not None else '-':>8} {dlogz:>10} {done:>5} "
+              f"{format_duration(r['checkpoint_age']):>8} {format_duration(r['eta']):>8}  "
+              f"{', '.join(r['flags'])}")
+    counts = {}
+    for r in rows:
+        counts[r["state"]] = counts.get(r["state"], 0) + 1
+    etas = [r["eta"] for r in rows if r["eta"] is not None]
+    print("[INFO] " + ", ".join(f"{n} {s}" for s, n in sorted(counts.items()))
+          + (f"; last running bin expected in {format_duration(max(etas))}" if etas else ""))
+    stragglers = [r["name"] for r in rows if r["flags"]]
+    if stragglers:
+        print(f"[WARN] Needs attention: {', '.join(stragglers)}")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs-dir", default="runs")
+    parser.add_argument("--straggler-factor", type=float, default=3.0,
+                        help="Flag bins whose ETA exceeds this multiple of the median")
+    parser.add_argument("--watch", type=float, default=0,
+                        help="Poll again every this many seconds (0: once)")
+    opts = parser.parse_args(args)
+    while True:
+        print_table(status(opts.runs_dir, opts.straggler_factor))
+        if not opts.watch:
+            break
+        time.sleep(opts.watch)
+        print()
+
+
+if __name__ == "__main__":
+    main()
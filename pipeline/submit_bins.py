@@ -0,0 +1,265 @@
+"""Submit all bins of a workflow to HTCondor in one call.
+
+Instead of one condor_submit per runs/e_* directory, the bins are written
+into a single DAG (runs/bins.dag) with a per-job retry count and a
+category throttle on how many bins run at once, and submitted with one
+condor_submit_dag. Alternatively --mode queue writes one submit
+description with a ``queue ... from`` list over the bins, throttled with
+max_materialize and retried with max_retries.
+
+--scheduler local runs the same DAG on this machine instead of handing it
+to Condor, for development and small events. The machine's cores are split
+between concurrently running bins (e.g. four bins of 16 processes on a
+64-core box): each bin runs a run_local.sh copy of its run.sh with
+--nprocesses and OMP_NUM_THREADS rewritten to its share, so the machine is
+never oversubscribed. The DAG's throttle and retries are honoured.
+
+Usage (from a workflow directory):
+    python ../../../pipeline/submit_bins.py --runs-dir runs --max-jobs 10 --retry 2
+    python ../../../pipeline/submit_bins.py --runs-dir runs --scheduler local \\
+        --cores 64 --processes-per-bin 16
+"""
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from inifile import CommandScript, IniFile
+
+DAG_NAME = "bins.dag"
+QUEUE_NAME = "bins.sub"
+CATEGORY = "bins"
+
+
+def find_bins(runs_dir):
+    """(name, directory) of every bin with a submit.sub, in order."""
+    bins = []
+    for bin_dir in sorted(glob.glob(os.path.join(os.path.abspath(runs_dir), "e_*"))):
+        if os.path.isfile(os.path.join(bin_dir, "submit.sub")):
+            bins.append((os.path.basename(bin_dir), bin_dir))
+        else:
+            print(f"[SKIP] No submit.sub in {os.path.basename(bin_dir)}")
+    return bins
+
+
+def write_dag(runs_dir, bins, max_jobs=0, retry=2):
+    """Write runs/bins.dag with one node per bin and return its path."""
+    dag = os.path.join(os.path.abspath(runs_dir), DAG_NAME)
+    with open(dag, "w") as f:
+        for name, bin_dir in bins:
+            f.write(f"JOB {name} {os.path.join(bin_dir, 'submit.sub')} DIR {bin_dir}\n")
+            if retry:
+                f.write(f"RETRY {name} {retry}\n")
+            f.write(f"CATEGORY {name} {CATEGORY}\n")
+        if max_jobs:
+            f.write(f"MAXJOBS {CATEGORY} {max_jobs}\n")
+    return dag
+
+
+def write_queue_submit(runs_dir, bins, max_jobs=0, retry=2):
+    """Write one submit description queuing every bin and return its path.
+
+    The per-bin executable, logs and resource requests are taken from each
+    bin's submit.sub and passed in as queue variables.
+    """
+    items = []
+    for name, bin_dir in bins:
+        sub = IniFile.read(os.path.join(bin_dir, "submit.sub"))
+        logs_dir = os.path.dirname(sub.get(None, "log"))
+        prefix = os.path.splitext(os.path.basename(sub.get(None, "log")))[0]
+        items.append((bin_dir, logs_dir, prefix,
+                      sub.get(None, "request_cpus", "1"),
+                      sub.get(None, "request_memory", "1 GB").replace(" ", "")))
+
+    first = IniFile.read(os.path.join(bins[0][1], "submit.sub"))
+    overrides = {
+        (None, "executable"): "$(bin_dir)/run.sh",
+        (None, "initialdir"): "$(bin_dir)",
+        (None, "output"): "$(logs_dir)/$(prefix).out",
+        (None, "error"): "$(logs_dir)/$(prefix).err",
+        (None, "log"): "$(logs_dir)/$(prefix).log",
+        (None, "request_cpus"): "$(cpus)",
+        (None, "request_memory"): "$(memory)",
+    }
+    if max_jobs:
+        overrides[(None, "max_materialize")] = str(max_jobs)
+    if retry:
+        overrides[(None, "max_retries")] = str(retry)
+    lines = [line for line in first.render(overrides).splitlines(True)
+             if not line.strip().startswith("queue")]
+
+    path = os.path.join(os.path.abspath(runs_dir), QUEUE_NAME)
+    with open(path, "w") as f:
+        f.writelines(lines)
+        f.write("queue bin_dir, logs_dir, prefix, cpus, memory from (\n")
+        for item in items:
+            f.write("    " + ", ".join(item) + "\n")
+        f.write(")\n")
+    return path
+
+
+def read_dag(dag):
+    """Parse the subset of DAG syntax written by write_dag."""
+    jobs, retries, categories, maxjobs = {}, {}, {}, {}
+    with open(dag) as f:
+        for line in f:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == "JOB":
+                jobs[words[1]] = (words[2], words[4] if len(words) > 4 else None)
+            elif words[0] == "RETRY":
+                retries[words[1]] = int(words[2])
+            elif words[0] == "CATEGORY":
+                categories[words[1]] = words[2]
+            elif words[0] == "MAXJOBS":
+                maxjobs[words[1]] = int(words[2])
+    return jobs, retries, categories, maxjobs
+
+
+def local_script(submit_file, nprocesses, threads):
+    """Write run_local.sh next to a bin's run.sh, sized for its core share.
+
+    --nprocesses and OMP_NUM_THREADS are rewritten so that the bin uses
+    nprocesses * threads cores; the Condor run.sh is left untouched.
+    """
+    run_sh = IniFile.read(submit_file).get(None, "executable")
+    script = CommandScript.read(run_sh)
+    overrides = {}
+    if script.has(None, "--nprocesses"):
+        overrides[(None, "--nprocesses")] = str(nprocesses)
+    if script.has(None, "OMP_NUM_THREADS"):
+        overrides[(None, "OMP_NUM_THREADS")] = str(threads)
+    path = os.path.join(os.path.dirname(run_sh), "run_local.sh")
+    script.write(path, overrides)
+    os.chmod(path, os.stat(run_sh).st_mode & 0o777)
+    return path
+
+
+def run_local_job(name, submit_file, cwd, retry, executable=None, env=None):
+    """Run one node's executable like Condor would, retrying on failure."""
+    sub = IniFile.read(submit_file)
+    executable = executable or sub.get(None, "executable")
+    for attempt in range(retry + 1):
+        with open(sub.get(None, "output"), "a") as out, \
+                open(sub.get(None, "error"), "a") as err:
+            code = subprocess.call([executable], cwd=cwd, stdout=out, stderr=err,
+                                   env=env)
+        if code == 0:
+            print(f"[INFO] {name} finished")
+            return True
+        print(f"[WARN] {name} exited with {code} (attempt {attempt + 1} of {retry + 1})")
+    print(f"[ERROR] {name} failed")
+    return False
+
+
+def run_dag_locally(dag, cores=None, processes_per_bin=None, threads=1):
+    """Stand-in for condor_submit_dag that runs the nodes on this machine.
+
+    The available cores are split between concurrently running bins: each
+    bin gets processes_per_bin * threads cores (by default its request_cpus,
+    capped at the machine), and as many bins run at once as fit, further
+    limited by the DAG's MAXJOBS throttle.
+    """
+    jobs, retries, _, maxjobs = read_dag(dag)
+    cores = cores or os.cpu_count()
+    if processes_per_bin is None:
+        requested = max(int(IniFile.read(sub).get(None, "request_cpus", "1"))
+                        for sub, _ in jobs.values())
+        processes_per_bin = max(min(requested, cores) // threads, 1)
+    limit = max(cores // (processes_per_bin * threads), 1)
+    if maxjobs:
+        limit = min(limit, *maxjobs.values())
+    print(f"[INFO] Running {len(jobs)} bins locally, {limit} at a time with "
+          f"{processes_per_bin} processes x {threads} threads each ({cores} cores)")
+
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads))
+    scripts = {}
+    for name, (submit_file, _) in jobs.items():
+        sub = IniFile.read(submit_file)
+        for key in ("output", "error"):
+            os.makedirs(os.path.dirname(sub.get(None, key)), exist_ok=True)
+        scripts[name] = local_script(submit_file, processes_per_bin, threads)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=limit) as pool:
+        results = list(pool.map(
+            lambda item: run_local_job(item[0], item[1][0], item[1][1],
+                                       retries.get(item[0], 0),
+                                       executable=scripts[item[0]], env=env),
+            jobs.items()))
+    failed = [name for name, ok in zip(jobs, results) if not ok]
+    print(f"[INFO] {len(jobs) - len(failed)} of {len(jobs)} bins succeeded "
+          f"in {time.time() - start:.0f} s")
+    return failed
+
+
+def submit(runs_dir, mode="dag", scheduler="condor", max_jobs=0, retry=2,
+           dry_run=False, cores=None, processes_per_bin=None, threads=1):
+    bins = find_bins(runs_dir)
+    if not bins:
+        raise RuntimeError(f"No bins with a submit.sub under {runs_dir}")
+
+    if mode == "queue":
+        if scheduler == "local":
+            raise ValueError("The local scheduler runs DAGs; use --mode dag")
+        path = write_queue_submit(runs_dir, bins, max_jobs, retry)
+        cmd = ["condor_submit", path]
+    else:
+        path = write_dag(runs_dir, bins, max_jobs, retry)
+        cmd = ["condor_submit_dag", "-force", path]
+    print(f"[INFO] Wrote {path} for {len(bins)} bins")
+
+    if dry_run:
+        return path
+    if scheduler == "local":
+        run_dag_locally(path, cores=cores, processes_per_bin=processes_per_bin,
+                        threads=threads)
+        return path
+    if shutil.which(cmd[0]) is None:
+        raise RuntimeError(f"{cmd[0]} not found; use --scheduler local to run "
+                           "the bins on this machine")
+    try:
+        result = subprocess.run(cmd, cwd=os.path.dirname(path), check=True,
+                                capture_output=True, text=True)
+        print(result.stdout.strip())
+    except subprocess.CalledProcessError as e:
+        print(f"[ERROR] Failed to submit {path}")
+        print(e.stderr.strip())
+        raise
+    return path
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs-dir", default="runs",
+                        help="Directory holding the e_* bin directories")
+    parser.add_argument("--mode", choices=["dag", "queue"], default="dag",
+                        help="One DAG over the bins, or one multi-queue submit file")
+    parser.add_argument("--scheduler", choices=["condor", "local"], default="condor",
+                        help="Submit to HTCondor, or run the DAG on this machine")
+    parser.add_argument("--max-jobs", type=int, default=0,
+                        help="Maximum number of bins running at once (0: no limit)")
+    parser.add_argument("--retry", type=int, default=2,
+                        help="Times a failed bin is retried")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only write the DAG/submit file")
+    local = parser.add_argument_group("local scheduler")
+    local.add_argument("--cores", type=int, default=None,
+                       help="Cores to split between bins (default: all)")
+    local.add_argument("--processes-per-bin", type=int, default=None,
+                       help="--nprocesses of each bin (default: its request_cpus)")
+    local.add_argument("--threads", type=int, default=1,
+                       help="OMP_NUM_THREADS of each process")
+    opts = parser.parse_args(args)
+    submit(opts.runs_dir, mode=opts.mode, scheduler=opts.scheduler,
+           max_jobs=opts.max_jobs, retry=opts.retry, dry_run=opts.dry_run,
+           cores=opts.cores, processes_per_bin=opts.processes_per_bin,
+           threads=opts.threads)
+
+
+if __name__ == "__main__":
+    main()
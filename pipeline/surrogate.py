@@ -0,0 +1,496 @@
+"""Reduced-order surrogate of an eccentric approximant over a config's prior box.
+
+Every likelihood call of the binned runs integrates the SEOBNRv5E(HM) or
+TEOBResumS-Dali equations of motion, yet each event's prior covers a
+small box (mchirp 1.15-1.2 for GW170817, 3.4-3.7 for GW200105,
+eccentricity <= 0.2). --mode build samples that box, exactly as given by
+the [prior-*] sections of a config.ini, and builds a reduced-order model
+of the approximant over it:
+
+- The box has every variable parameter except tc, ra, dec, polarization,
+  distance and inclination: waveforms are made face-on at 1 Mpc and
+  scaled as in waveform_cache.py, so only the dominant-mode
+  approximants (the seob and teob runs, not seobHM or teobHM) are
+  supported. uniform_angle priors span [0, 2 pi).
+- --ntrain waveforms at scrambled Halton points are generated with the
+  config's [static_params], Fourier transformed as in heterodyne.py and
+  reduced to log-amplitude and phase of hp and hc at --nfreq
+  log-spaced frequencies between f_lower and the Nyquist frequency of
+  [model] sample_rate. Where the amplitude is below AMP_FLOOR of its
+  peak (before the band is reached, after the ringdown) it is held at
+  that floor and the phase is continued linearly, so that the basis
+  does not have to describe noise. The leading-order chirp phase of mchirp (with
+  whichever sign fits the training set better) is taken out of the
+  phases first, and both are referenced to the hp phase at the middle
+  of the band. The surrogate is therefore only defined up to a constant
+  phase, which the phase-marginalized 22-mode runs do not see.
+- Each of the four is given a reduced basis (the leading right singular
+  vectors, enough to reproduce every training waveform to --tolerance)
+  and as many empirical interpolation nodes. The values at the nodes are
+  fit over the box with thin-plate-spline radial basis functions.
+
+The result goes to one HDF file. --mode validate then compares the
+surrogate with the original approximant on --nvalidate uniformly drawn
+held-out points, reporting the mismatch (one minus the match maximized
+over time and phase, weighted by --psd) of hp and hc into
+<rom file>.validation.csv and the file's attributes. Half of the points
+are drawn from the upper half of the eccentricity range, and their
+largest mismatch is reported on its own.
+
+--mode run registers the surrogate under its --name (default
+ROM_<approximant>) as a frequency-domain and frequency-sequence
+approximant and runs pycbc_inference; configs then only change
+[static_params] approximant. generate_bins.py --rom-file does both. A
+surrogate that has not been validated, or whose largest mismatch is
+above --max-mismatch, is refused.
+
+Usage:
+    python surrogate.py --mode build --config-file ../gw170817/seob/config.ini \\
+        --rom-file ../gw170817/seob/rom.hdf --ntrain 2000 --nprocesses 32
+    python surrogate.py --mode validate --rom-file ../gw170817/seob/rom.hdf --nvalidate 200
+    python surrogate.py --mode run --rom-file rom.hdf [--table-dir DIR] \\
+        --config-file config.ini --output-file result.hdf ...
+"""
+import argparse
+import configparser
+import csv
+import functools
+import json
+import multiprocessing
+import os
+import time
+
+import h5py
+import numpy as np
+from scipy.interpolate import CubicSpline
+
+import heterodyne
+import marg_tables
+import waveform_cache
+
+ROM_VERSION = 1
+NTRAIN = 1000
+NVALIDATE = 200
+NFREQ = 4000
+TOLERANCE = 1e-2
+MAX_MISMATCH = 1e-3
+AMP_FLOOR = 1e-4
+PSD = "aLIGOZeroDetHighPower"
+# Parameters not in the box: scaled analytically, or not seen by the waveform
+NON_BOX_PARAMS = waveform_cache.EXTRINSIC_PARAMS + ("distance", "inclination")
+ANGLE_BOUNDS = {"uniform_angle": (0.0, 2 * np.pi)}
+QUANTITIES = ("logamp_plus", "phase_plus", "logamp_cross", "phase_cross")
+MTSUN_SI = 4.925490947641267e-06
+
+
+def read_box(config_path):
+    """(static params, {param: (lower, upper)}, sample rate) of a config.ini."""
+    cp = configparser.ConfigParser(interpolation=None, strict=False)
+    cp.read(config_path)
+    static = {}
+    for key, value in cp.items("static_params"):
+        try:
+            static[key] = float(value)
+        except ValueError:
+            static[key] = value.strip()
+    if not waveform_cache.dominant_mode(static):
+        raise ValueError(f"{config_path}: surrogates are only built for dominant-mode "
+                         f"approximants ({', '.join(waveform_cache.DOMINANT_MODE)} without "
+                         f"a mode_array)")
+    box = {}
+    for param in cp.options("variable_params"):
+        if param in NON_BOX_PARAMS:
+            continue
+        section = f"prior-{param}"
+        name = cp.get(section, "name").strip()
+        if cp.has_option(section, f"min-{param}"):
+            box[param] = (cp.getfloat(section, f"min-{param}"),
+                          cp.getfloat(section, f"max-{param}"))
+        elif name in ANGLE_BOUNDS:
+            box[param] = ANGLE_BOUNDS[name]
+        else:
+            raise ValueError(f"[{section}] has no bounds for the surrogate box")
+    sample_rate = cp.getfloat("model", "sample_rate", fallback=None) or \
+        cp.getfloat("data", "sample-rate")
+    return static, box, sample_rate
+
+
+def chirp_phase(f, mchirp):
+    """Leading-order (Newtonian) stationary-phase chirp phase."""
+    return 3.0 / 128 * (np.pi * mchirp * MTSUN_SI * f) ** (-5.0 / 3)
+
+
+def waveform_params(point, static):
+    params = dict(static, **point)
+    params.setdefault("distance", 1.0)
+    if "mchirp" in params and "mass1" not in params:
+        params["mass1"], params["mass2"] = heterodyne.mass1_mass2(params["mchirp"], params["q"])
+    params["inclination"] = 0.0
+    return params
+
+
+def training_waveform(point, static, freqs, sample_rate):
+    """{quantity: values at freqs} of one box point, or None if generation fails."""
+    try:
+        hp, hc = heterodyne.td_polarizations(waveform_params(point, static),
+                                             static["f_lower"], sample_rate)
+    except Exception as exc:
+        print(f"[WARN] Waveform failed at {point}: {exc}")
+        return None
+    out = {}
+    for label, h in (("plus", hp), ("cross", hc)):
+        amp, phase = heterodyne.fd_amp_phase(h, freqs)
+        amp, phase = floor_tails(freqs, amp, phase)
+        out[f"logamp_{label}"] = np.log(amp)
+        out[f"phase_{label}"] = phase
+    # the unwrapped phase starts from an arbitrary multiple of 2 pi below
+    # the band; a common constant phase is a shift of coalescence phase
+    anchor = out["phase_plus"][len(freqs) // 2]
+    out["phase_plus"] -= anchor
+    out["phase_cross"] -= anchor
+    return out
+
+
+def floor_tails(f, amp, phase, floor=AMP_FLOOR):
+    """Hold amplitude at floor * peak outside the band it exceeds it, extend phase linearly."""
+    above = np.flatnonzero(amp >= floor * np.max(amp))
+    lo, hi = max(above[0], 1), min(above[-1], len(f) - 2)
+    phase = phase.copy()
+    slope = (phase[lo + 1] - phase[lo]) / (f[lo + 1] - f[lo])
+    phase[:lo] = phase[lo] + slope * (f[:lo] - f[lo])
+    slope = (phase[hi] - phase[hi - 1]) / (f[hi] - f[hi - 1])
+    phase[hi + 1:] = phase[hi] + slope * (f[hi + 1:] - f[hi])
+    return np.maximum(amp, floor * np.max(amp)), phase
+
+
+def reduced_basis(matrix, tolerance):
+    """Orthonormal rows spanning every row of matrix to max error <= tolerance."""
+    _, _, vt = np.linalg.svd(matrix, full_matrices=False)
+    lo, hi = 1, len(vt)
+    while lo < hi:
+        k = (lo + hi) // 2
+        residual = matrix - (matrix @ vt[:k].T) @ vt[:k]
+        if np.max(np.abs(residual)) <= tolerance:
+            hi = k
+        else:
+            lo = k + 1
+    return vt[:lo]
+
+
+def eim_nodes(basis):
+    """Empirical interpolation nodes of basis, and the (k, nfreq) interpolant."""
+    nodes = [int(np.argmax(np.abs(basis[0])))]
+    for j in range(1, len(basis)):
+        coeffs = np.linalg.solve(basis[:j, nodes].T, basis[j, nodes])
+        residual = basis[j] - coeffs @ basis[:j]
+        nodes.append(int(np.argmax(np.abs(residual))))
+    nodes = np.array(nodes)
+    # values at the nodes -> values at all frequencies
+    interpolant = np.linalg.solve(basis[:, nodes], basis)
+    return nodes, interpolant
+
+
+def unit_box(points, lower, upper):
+    return (points - lower) / (upper - lower)
+
+
+def scaled_points(unit, box):
+    lower, upper = (np.array([b[i] for b in box.values()]) for i in (0, 1))
+    return lower + unit * (upper - lower)
+
+
+def generate_all(points, box, static, freqs, sample_rate, nprocesses):
+    worker = functools.partial(training_waveform, static=static, freqs=freqs,
+                               sample_rate=sample_rate)
+    dicts = [dict(zip(box, p)) for p in points]
+    if nprocesses > 1:
+        with multiprocessing.Pool(nprocesses) as pool:
+            return pool.map(worker, dicts, chunksize=1)
+    return [worker(p) for p in dicts]
+
+
+def build(config_path, rom_file, ntrain=NTRAIN, nfreq=NFREQ, tolerance=TOLERANCE,
+          name=None, nprocesses=1, seed=0):
+    from scipy.stats import qmc
+
+    static, box, sample_rate = read_box(config_path)
+    name = name or f"ROM_{static['approximant']}"
+    freqs = np.geomspace(static["f_lower"], sample_rate / 2, nfreq)
+    unit = qmc.Halton(len(box), scramble=True, seed=seed).random(ntrain)
+    points = scaled_points(unit, box)
+    print(f"[INFO] Generating {ntrain} {static['approximant']} waveforms over "
+          + ", ".join(f"{p} [{lo:g}, {hi:g}]" for p, (lo, hi) in box.items()))
+    start = time.perf_counter()
+    waveforms = generate_all(points, box, static, freqs, sample_rate, nprocesses)
+    ok = [k for k, w in enumerate(waveforms) if w is not None]
+    print(f"[INFO] {len(ok)} waveforms in {time.perf_counter() - start:.0f} s")
+    points = points[ok]
+    waveforms = [waveforms[k] for k in ok]
+
+    params = list(box)
+    reference = np.zeros((len(points), nfreq))
+    if "mchirp" in params:
+        reference = chirp_phase(freqs, points[:, params.index("mchirp"), None])
+    with h5py.File(rom_file, "w") as f:
+        f.attrs.update({"version": ROM_VERSION, "name": name, "params": params,
+                        "lower": [box[p][0] for p in params],
+                        "upper": [box[p][1] for p in params],
+                        "sample_rate": sample_rate, "config": os.path.abspath(config_path),
+                        "static_params": json.dumps(static), "tolerance": tolerance})
+        f["frequencies"] = freqs
+        f["train_points"] = points
+        for quantity in QUANTITIES:
+            matrix = np.array([w[quantity] for w in waveforms])
+            sign = 0
+            if quantity.startswith("phase"):
+                sign = min((1, -1), key=lambda s: np.sum(np.var(matrix - s * reference, axis=0)))
+                matrix = matrix - sign * reference
+            basis = reduced_basis(matrix, tolerance)
+            nodes, interpolant = eim_nodes(basis)
+            grp = f.create_group(quantity)
+            grp.attrs["chirp_sign"] = sign
+            grp["nodes"] = nodes
+            grp["interpolant"] = interpolant
+            grp["node_values"] = matrix[:, nodes]
+            print(f"[INFO] {quantity}: {len(nodes)} basis functions")
+    print(f"[INFO] Wrote {name} to {rom_file}")
+    return rom_file
+
+
+def rom_info(rom_file):
+    """(name the surrogate registers, approximant it was built from)."""
+    with h5py.File(rom_file, "r") as f:
+        return str(f.attrs["name"]), json.loads(f.attrs["static_params"])["approximant"]
+
+
+class Surrogate:
+    """A surrogate read back from its HDF file."""
+
+    def __init__(self, rom_file):
+        from scipy.interpolate import RBFInterpolator
+
+        with h5py.File(rom_file, "r") as f:
+            if f.attrs["version"] != ROM_VERSION:
+                raise ValueError(f"{rom_file} is version {f.attrs['version']}, "
+                                 f"expected {ROM_VERSION}")
+            self.name = str(f.attrs["name"])
+            self.params = [str(p) for p in f.attrs["params"]]
+            self.lower = np.array(f.attrs["lower"])
+            self.upper = np.array(f.attrs["upper"])
+            self.sample_rate = float(f.attrs["sample_rate"])
+            self.static = json.loads(f.attrs["static_params"])
+            self.freqs = f["frequencies"][:]
+            x = unit_box(f["train_points"][:], self.lower, self.upper)
+            self.interpolants = {q: f[q]["interpolant"][:] for q in QUANTITIES}
+            self.signs = {q: int(f[q].attrs["chirp_sign"]) for q in QUANTITIES}
+            self.fits = {q: RBFInterpolator(x, f[q]["node_values"][:],
+                                            kernel="thin_plate_spline")
+                         for q in QUANTITIES}
+
+    def point(self, params):
+        x = np.array([params[p] for p in self.params], dtype=float)
+        margin = 1e-9 * (self.upper - self.lower)
+        if np.any(x < self.lower - margin) or np.any(x > self.upper + margin):
+            from pycbc.waveform.waveform import FailedWaveformError
+            raise FailedWaveformError(f"{self.name}: outside the surrogate's box")
+        return unit_box(x, self.lower, self.upper)[None, :]
+
+    def polarizations(self, f, **params):
+        """Complex (hp, hc) at frequencies f, including distance and inclination."""
+        f = np.asarray(f, dtype=float)
+        x = self.point(params)
+        inside = (f >= self.freqs[0]) & (f <= self.freqs[-1])
+        reference = chirp_phase(self.freqs, params["mchirp"]) if "mchirp" in self.params else 0
+        out = []
+        for label in ("plus", "cross"):
+            logamp, phase = (self.fits[f"{q}_{label}"](x)[0] @ self.interpolants[f"{q}_{label}"]
+                             for q in ("logamp", "phase"))
+            phase = phase + self.signs[f"phase_{label}"] * reference
+            h = np.zeros(len(f), dtype=complex)
+            h[inside] = np.exp(CubicSpline(self.freqs, logamp)(f[inside])
+                               + 1j * CubicSpline(self.freqs, phase)(f[inside]))
+            out.append(h / params.get("distance", 1.0))
+        cosi = np.cos(params.get("inclination", 0.0))
+        return out[0] * 0.5 * (1 + cosi ** 2), out[1] * cosi
+
+
+def check_validation(rom_file, max_mismatch=MAX_MISMATCH):
+    """The validation summary of rom_file; ValueError if it is missing or too poor."""
+    with h5py.File(rom_file, "r") as f:
+        attrs = dict(f.attrs)
+    params = [str(p) for p in attrs["params"]]
+    if "mismatch_max" not in attrs:
+        raise ValueError(f"{rom_file} has not been validated (run surrogate.py --mode validate)")
+    if "eccentricity" in params and "mismatch_max_eccentric" not in attrs:
+        raise ValueError(f"{rom_file} has no validation at eccentric points "
+                         f"(re-run surrogate.py --mode validate)")
+    if not attrs["mismatch_max"] <= max_mismatch:
+        raise ValueError(f"{rom_file}: largest validation mismatch "
+                         f"{attrs['mismatch_max']:.2e} is above {max_mismatch:.2e}")
+    return {k: v for k, v in attrs.items() if k.startswith(("mismatch_", "validation_"))}
+
+
+def register(rom_file, max_mismatch=MAX_MISMATCH):
+    """Add the surrogate to pycbc as an FD and an FD-sequence approximant."""
+    from pycbc.types import Array, FrequencySeries
+    from pycbc.waveform.plugin import add_custom_waveform
+
+    check_validation(rom_file, max_mismatch)
+    rom = Surrogate(rom_file)
+
+    def fd_waveform(**params):
+        df = params["delta_f"]
+        f_final = params.get("f_final") or rom.freqs[-1]
+        f = np.arange(int(min(f_final, rom.freqs[-1]) / df) + 1) * df
+        hp, hc = rom.polarizations(f, **params)
+        hp[f < params.get("f_lower", rom.freqs[0])] = 0
+        hc[f < params.get("f_lower", rom.freqs[0])] = 0
+        return FrequencySeries(hp, delta_f=df), FrequencySeries(hc, delta_f=df)
+
+    def fd_sequence(sample_points=None, **params):
+        return tuple(Array(h) for h in rom.polarizations(sample_points, **params))
+
+    add_custom_waveform(rom.name, fd_waveform, "frequency", force=True)
+    add_custom_waveform(rom.name, fd_sequence, "frequency", sequence=True, force=True)
+    return rom.name
+
+
+def match(h1, h2, weight, upsample=8):
+    """Overlap of h1 and h2 maximized over time and phase."""
+    norm = np.sqrt(np.sum(np.abs(h1) ** 2 * weight) * np.sum(np.abs(h2) ** 2 * weight))
+    overlap = np.fft.ifft(h1 * np.conj(h2) * weight, upsample * len(h1)) * upsample * len(h1)
+    return float(np.max(np.abs(overlap)) / norm)
+
+
+@functools.lru_cache(maxsize=1)
+def load(rom_file):
+    return Surrogate(rom_file)
+
+
+def validation_mismatch(point, rom_file, psd_name):
+    """(mismatch of hp, mismatch of hc) of the surrogate at one box point."""
+    rom = load(rom_file)
+    params = waveform_params(point, rom.static)
+    try:
+        hp, hc = heterodyne.td_polarizations(params, rom.static["f_lower"], rom.sample_rate)
+    except Exception as exc:
+        print(f"[WARN] Waveform failed at {point}: {exc}")
+        return np.nan, np.nan
+    n = 1 << int(np.ceil(np.log2(heterodyne.PAD_FACTOR * len(hp))))
+    df = 1.0 / (n * hp.delta_t)
+    f = np.arange(int(rom.freqs[-1] / df) + 1) * df
+    band = (f >= rom.freqs[0]) & (f <= rom.freqs[-1])
+    f = f[band]
+    if psd_name == "flat":
+        weight = np.ones(len(f))
+    else:
+        from pycbc.psd import from_string
+        psd = from_string(psd_name, int(rom.freqs[-1] / df) + 1, df, rom.freqs[0])
+        weight = 1.0 / psd.numpy()[band]
+    surrogate = rom.polarizations(f, **params)
+    mismatches = []
+    for h, s in zip((hp, hc), surrogate):
+        amp, phase = heterodyne.fd_amp_phase(h, f)
+        mismatches.append(1 - match(amp * np.exp(1j * phase), s, weight))
+    return tuple(mismatches)
+
+
+def validate(rom_file, nvalidate=NVALIDATE, psd_name=PSD, nprocesses=1, seed=1):
+    """Mismatches at uniformly drawn held-out points; writes <rom_file>.validation.csv."""
+    rom = load(rom_file)
+    rng = np.random.default_rng(seed)
+    unit = rng.random((nvalidate, len(rom.params)))
+    eccentric = np.zeros(nvalidate, dtype=bool)
+    if "eccentricity" in rom.params:
+        # half of the points in the upper half of the eccentricity range
+        i = rom.params.index("eccentricity")
+        eccentric[nvalidate // 2:] = True
+        unit[:, i] = 0.5 * (unit[:, i] + eccentric)
+    points = rom.lower + unit * (rom.upper - rom.lower)
+    dicts = [dict(zip(rom.params, p)) for p in points]
+    worker = functools.partial(validation_mismatch, rom_file=rom_file, psd_name=psd_name)
+    print(f"[INFO] Validating {rom.name} at {nvalidate} held-out points ({psd_name} PSD)")
+    if nprocesses > 1:
+        with multiprocessing.Pool(nprocesses) as pool:
+            mismatches = np.array(pool.map(worker, dicts, chunksize=1))
+    else:
+        mismatches = np.array([worker(p) for p in dicts])
+
+    report = rom_file + ".validation.csv"
+    with open(report, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(rom.params + ["mismatch_plus", "mismatch_cross"])
+        for p, mm in zip(points, mismatches):
+            writer.writerow([f"{v:.8g}" for v in p] + [f"{v:.3e}" for v in mm])
+
+    worst = np.nanmax(mismatches, axis=1)
+    summary = {"validation_n": int(np.sum(np.isfinite(worst))),
+               "validation_psd": psd_name,
+               "mismatch_median": float(np.nanmedian(worst)),
+               "mismatch_90": float(np.nanpercentile(worst, 90)),
+               "mismatch_max": float(np.nanmax(worst))}
+    if np.any(np.isfinite(worst[eccentric])):
+        summary["mismatch_max_eccentric"] = float(np.nanmax(worst[eccentric]))
+    with h5py.File(rom_file, "a") as f:
+        f.attrs.update(summary)
+    k = int(np.nanargmax(worst))
+    print(f"[INFO] Mismatch (max of hp, hc): median {summary['mismatch_median']:.2e}, "
+          f"90% {summary['mismatch_90']:.2e}, max {summary['mismatch_max']:.2e} at "
+          + ", ".join(f"{p}={v:.6g}" for p, v in zip(rom.params, points[k])))
+    if "mismatch_max_eccentric" in summary:
+        print(f"[INFO] Max mismatch with eccentricity above "
+              f"{0.5 * (rom.lower[i] + rom.upper[i]):g}: {summary['mismatch_max_eccentric']:.2e}")
+    print(f"[INFO] Wrote {report}")
+    return summary
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=["build", "validate", "run"], default="build",
+                        help="Build (and validate) a surrogate, only validate one, or run "
+                             "pycbc_inference with it")
+    parser.add_argument("--rom-file", required=True)
+    parser.add_argument("--config-file", nargs="+", default=None,
+                        help="With --mode build: the config.ini whose prior box to cover; "
+                             "with --mode run: passed on to pycbc_inference")
+    parser.add_argument("--name", default=None,
+                        help="Approximant name of the surrogate (default: ROM_<approximant>)")
+    parser.add_argument("--ntrain", type=int, default=NTRAIN)
+    parser.add_argument("--nvalidate", type=int, default=NVALIDATE,
+                        help="Held-out validation points (0: do not validate)")
+    parser.add_argument("--nfreq", type=int, default=NFREQ,
+                        help="Log-spaced frequencies the basis is built on")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="Largest basis error in log-amplitude and phase (rad)")
+    parser.add_argument("--psd", default=PSD,
+                        help="PSD of the validation mismatch (a pycbc PSD name, or 'flat')")
+    parser.add_argument("--max-mismatch", type=float, default=MAX_MISMATCH,
+                        help="With --mode run: refuse a surrogate whose largest validation "
+                             "mismatch is above this")
+    parser.add_argument("--nprocesses", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--table-dir", default=None,
+                        help="With --mode run: shared distance-marginalization tables")
+    opts, inference_args = parser.parse_known_args(args)
+    if opts.mode != "run" and inference_args:
+        parser.error(f"unrecognized arguments: {' '.join(inference_args)}")
+    if opts.mode != "validate" and not opts.config_file:
+        parser.error(f"--mode {opts.mode} needs --config-file")
+
+    if opts.mode == "run":
+        register(opts.rom_file, opts.max_mismatch)
+        if opts.table_dir:
+            marg_tables.install(opts.table_dir, opts.config_file[0])
+        marg_tables.run_inference(["--config-file"] + opts.config_file + inference_args)
+        return
+    if opts.mode == "build":
+        build(opts.config_file[0], opts.rom_file, ntrain=opts.ntrain, nfreq=opts.nfreq,
+              tolerance=opts.tolerance, name=opts.name, nprocesses=opts.nprocesses,
+              seed=opts.seed)
+    if opts.nvalidate:
+        validate(opts.rom_file, nvalidate=opts.nvalidate, psd_name=opts.psd,
+                 nprocesses=opts.nprocesses, seed=opts.seed + 1)
+
+
+if __name__ == "__main__":
+    main()
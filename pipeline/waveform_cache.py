@@ -0,0 +1,204 @@
+"""Cache waveforms across likelihood calls with the same intrinsic parameters.
+
+With tc, sky position and polarization vector-marginalized and distance
+(and, for the 22-only runs, phase) marginalized, the waveform of a
+marginalized_time likelihood call depends only on the intrinsic
+parameters: mchirp, q, spin1z, spin2z, eccentricity and rel_anomaly or
+anomaly, plus inclination and coa_phase for the higher-mode runs.
+Revisits of the same point (rwalk proposals, posterior reconstruction of
+the marginalized parameters, repeated evaluations in the samplers'
+bookkeeping) still run the full EOB integration every time.
+
+install() wraps the generate method of pycbc's
+FDomainDetFrameTwoPolNoRespGenerator, which marginalized_time uses, with
+a per-process least-recently-used cache of its (hp, hc). The key is every
+parameter passed to the waveform model except tc, ra, dec and
+polarization, each rounded to --digits significant digits. Fewer digits
+turn near-misses into hits at the cost of a small waveform error. For
+the dominant-mode approximants (DOMINANT_MODE) inclination is left out of
+the key: the waveform is made face-on and scaled by (1 + cos^2 i) / 2 and
+cos i, which is exact for a waveform with only the (2, +-2) modes.
+
+--cache-mb is the memory for the whole job, split evenly between the
+--nprocesses processes of pycbc_inference, each of which keeps its own
+cache; it has to fit in request_memory next to the job's other usage. A
+200 s, 2048 Hz entry is about 6.5 MB, so 8192 MB over 32 processes holds
+about 40 waveforms per process.
+
+Every --report-every lookups, and when the process exits, each process
+prints its hits, misses and the waveform generation time the hits saved
+(hits times the mean time of a miss).
+
+Usage (in run.sh, in place of pycbc_inference; generate_bins.py
+--waveform-cache writes this):
+    python waveform_cache.py --cache-mb 8192 [--table-dir DIR] \\
+        --config-file config.ini --output-file result.hdf --nprocesses 32 ...
+"""
+import argparse
+import collections
+import math
+import multiprocessing.util
+import os
+import time
+
+import numpy as np
+
+import marg_tables
+
+CACHE_MB = 4096
+DIGITS = 12
+REPORT_EVERY = 10000
+# Parameters the radiation-frame waveform does not depend on
+EXTRINSIC_PARAMS = ("tc", "ra", "dec", "polarization")
+# Approximants that only model the (2, +-2) modes, unless given a mode_array
+DOMINANT_MODE = ("SEOBNRv5E_tdtaper", "SEOBNRv5E", "teobresums")
+
+
+def quantise(value, digits):
+    if isinstance(value, (float, np.floating)):
+        return float(f"{value:.{digits}g}")
+    if isinstance(value, (int, np.integer, str, bool)) or value is None:
+        return value
+    return repr(value)
+
+
+def dominant_mode(params):
+    return params.get("approximant") in DOMINANT_MODE and "mode_array" not in params
+
+
+class WaveformCache:
+    """Bounded LRU store of (hp, hc) with hit/miss counters."""
+
+    def __init__(self, max_bytes, digits=DIGITS, report_every=REPORT_EVERY):
+        self.max_bytes = max_bytes
+        self.digits = digits
+        self.report_every = report_every
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.lookups = self.hits = self.misses = self.evictions = 0
+        self.miss_time = 0.0
+
+    def key(self, params, skip=()):
+        return tuple(sorted((name, quantise(value, self.digits))
+                            for name, value in params.items()
+                            if name not in EXTRINSIC_PARAMS and name not in skip))
+
+    def get(self, key):
+        self.lookups += 1
+        if self.report_every and self.lookups % self.report_every == 0:
+            self.report()
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return value
+
+    def put(self, key, value, seconds):
+        self.misses += 1
+        self.miss_time += seconds
+        size = sum(h.numpy().nbytes for h in value)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.nbytes -= sum(h.numpy().nbytes for h in old)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        mean_miss = self.miss_time / self.misses if self.misses else 0.0
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "mb": self.nbytes / 2 ** 20,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "generation_s": self.miss_time, "saved_s": self.hits * mean_miss}
+
+    def report(self):
+        s = self.stats()
+        print(f"[INFO] waveform cache (pid {os.getpid()}): {s['hits']} hits, "
+              f"{s['misses']} misses ({100 * s['hit_rate']:.1f}% hit rate), "
+              f"{s['entries']} entries / {s['mb']:.0f} MB, {s['evictions']} evicted; "
+              f"{s['generation_s']:.0f} s generating, ~{s['saved_s']:.0f} s saved", flush=True)
+
+
+def polarizations(generator, params):
+    """(hp, hc) as FDomainDetFrameTwoPolNoRespGenerator.generate makes them."""
+    from pycbc.types import TimeSeries
+    from pycbc.waveform.utils import apply_fseries_time_shift
+
+    # the radiation-frame generator does not take the location parameters
+    rfparams = {k: v for k, v in params.items() if k not in generator.location_args}
+    hp, hc = generator.rframe_generator.generate(**rfparams)
+    if isinstance(hp, TimeSeries):
+        df = params["delta_f"]
+        hp = hp.to_frequencyseries(delta_f=df)
+        hc = hc.to_frequencyseries(delta_f=df)
+        tshift = 1. / df - abs(hp._epoch)
+        hp = apply_fseries_time_shift(hp, tshift, copy=True)
+        hc = apply_fseries_time_shift(hc, tshift, copy=True)
+    hp._epoch = hc._epoch = generator._epoch
+    return hp, hc
+
+
+def nprocesses(inference_args):
+    """The --nprocesses of a pycbc_inference command line (1 if not given)."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--nprocesses", type=int, default=1)
+    return max(parser.parse_known_args(inference_args)[0].nprocesses, 1)
+
+
+def install(max_bytes=CACHE_MB * 2 ** 20, digits=DIGITS, report_every=REPORT_EVERY):
+    """Route marginalized_time's waveform generation through a WaveformCache."""
+    from pycbc.waveform.generator import FDomainDetFrameTwoPolNoRespGenerator
+
+    cache = WaveformCache(max_bytes, digits=digits, report_every=report_every)
+    uncached = FDomainDetFrameTwoPolNoRespGenerator.generate
+
+    def generate(self, **kwargs):
+        if self.recalib:
+            return uncached(self, **kwargs)
+        self.current_params.update(kwargs)
+        params = self.current_params
+        face_on = dominant_mode(params) and "inclination" in params
+        key = cache.key(params, skip=("inclination",) if face_on else ())
+        value = cache.get(key)
+        if value is None:
+            start = time.perf_counter()
+            value = polarizations(self, dict(params, inclination=0.0) if face_on else params)
+            cache.put(key, value, time.perf_counter() - start)
+        hp, hc = value
+        if face_on:
+            cosi = math.cos(params["inclination"])
+            hp, hc = hp * (0.5 * (1 + cosi ** 2)), hc * cosi
+        return {detname: (hp.copy(), hc.copy()) for detname in self.detectors}
+
+    FDomainDetFrameTwoPolNoRespGenerator.generate = generate
+    # runs at exit in the main process and in multiprocessing workers
+    multiprocessing.util.Finalize(cache, cache.report, exitpriority=10)
+    return cache
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cache-mb", type=float, default=CACHE_MB,
+                        help="Memory for cached waveforms, for the whole job")
+    parser.add_argument("--digits", type=int, default=DIGITS,
+                        help="Significant digits of the parameters in the cache key")
+    parser.add_argument("--report-every", type=int, default=REPORT_EVERY,
+                        help="Print the counters every this many lookups (0: only at exit)")
+    parser.add_argument("--table-dir", default=None,
+                        help="Shared distance-marginalization tables (see marg_tables.py)")
+    opts, inference_args = parser.parse_known_args(args)
+    config_path = marg_tables.config_file(inference_args)
+
+    per_process = opts.cache_mb / nprocesses(inference_args)
+    print(f"[INFO] Waveform cache: {per_process:.0f} MB per process")
+    install(int(per_process * 2 ** 20), digits=opts.digits, report_every=opts.report_every)
+    if opts.table_dir:
+        marg_tables.install(opts.table_dir, config_path)
+    marg_tables.run_inference(inference_args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Pack every event's posteriors into one indexed archive.
+
+Finds <event>/<approximant>/[workflow|workflowlog/]posteriors.hdf under the
+repository (plus any --extra comparison files) and writes them into a
+single HDF5 file:
+
+    index              one row per posterior: event, approximant, hm,
+                       prior (uniform or log10), nsamples, offset, source
+    samples/<param>    every posterior's column, concatenated in index order
+                       (NaN where a posterior does not have the parameter)
+
+A posterior is the slice [offset, offset + nsamples) of each column, so any
+(event, approximant, prior) is found with one dictionary lookup and read
+without touching the others; see posterior_store.open_archive. ``anomaly``
+and ``rel_anomaly`` are stored as one ``anomaly`` column.
+
+By default the columns are contiguous and uncompressed so that readers can
+memory-map them. --compress writes chunked, gzip-compressed columns
+instead (much smaller, for copying around); those are read through h5py.
+
+Usage:
+    python build_archive.py --output-file posteriors_archive.hdf
+    python build_archive.py --output-file posteriors_archive.hdf --compress \\
+        --extra gw200105:planes=../gw200105/comparisons/converted_posteriors_pycbc_format.hdf
+"""
+import argparse
+import glob
+import os
+
+import h5py
+import numpy as np
+
+from posterior_store import GROUP, INDEX_DTYPE, canonical
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APPROXIMANTS = ["seob", "seobHM", "teob", "teobHM"]
+
+# Variant directory -> eccentricity prior of its runs
+PRIORS = {"": "uniform", "workflow": "uniform", "workflowlog": "log10"}
+
+
+def find_posteriors(root):
+    """(event, approximant, prior, path) of every posterior under root."""
+    found = []
+    for event_dir in sorted(glob.glob(os.path.join(root, "gw*"))):
+        event = os.path.basename(event_dir)
+        for approximant in APPROXIMANTS:
+            for variant, prior in PRIORS.items():
+                path = os.path.join(event_dir, approximant, variant, "posteriors.hdf")
+                if os.path.isfile(path):
+                    found.append((event, approximant, prior, path))
+    return found
+
+
+def parse_extra(text):
+    """Parse EVENT:NAME=PATH into (event, name, "uniform", path)."""
+    target, _, path = text.partition("=")
+    event, _, name = target.partition(":")
+    if not (event and name and path):
+        raise argparse.ArgumentTypeError(f"Expected EVENT:NAME=PATH, got '{text}'")
+    return event.lower(), name, "uniform", path
+
+
+def build_archive(sources, output_file, compress=False):
+    """Write the archive for (event, approximant, prior, path) sources."""
+    entries = []
+    columns = []
+    for event, approximant, prior, path in sources:
+        if not h5py.is_hdf5(path):
+            # e.g. a git-lfs pointer that has not been fetched
+            print(f"[SKIP] {path} is not an HDF5 file")
+            continue
+        with h5py.File(path, "r") as f:
+            if GROUP not in f:
+                print(f"[SKIP] No {GROUP}/ group in {path}")
+                continue
+            names = list(f[GROUP].keys())
+            nsamples = len(f[GROUP][names[0]])
+        for name in names:
+            if canonical(name) not in columns:
+                columns.append(canonical(name))
+        entries.append((event, approximant, prior, path, nsamples))
+    if not entries:
+        raise RuntimeError("No posteriors to archive")
+
+    index = np.zeros(len(entries), dtype=INDEX_DTYPE)
+    offset = 0
+    for row, (event, approximant, prior, path, nsamples) in zip(index, entries):
+        row["event"] = event
+        row["approximant"] = approximant
+        row["hm"] = approximant.endswith("HM")
+        row["prior"] = prior
+        row["nsamples"] = nsamples
+        row["offset"] = offset
+        row["source"] = os.path.relpath(path, REPO_ROOT) if path.startswith(REPO_ROOT) else path
+        offset += nsamples
+
+    kwargs = {"chunks": (min(offset, 65536),), "compression": "gzip",
+              "compression_opts": 4, "shuffle": True} if compress else {}
+    with h5py.File(output_file, "w") as out:
+        out.create_dataset("index", data=index)
+        group = out.create_group(GROUP)
+        datasets = {name: group.create_dataset(name, shape=(offset,), dtype="f8",
+                                               fillvalue=np.nan, **kwargs)
+                    for name in columns}
+        for row, (_, _, _, path, _) in zip(index, entries):
+            start, stop = row["offset"], row["offset"] + row["nsamples"]
+            with h5py.File(path, "r") as f:
+                for name, data in f[GROUP].items():
+                    datasets[canonical(name)][start:stop] = data[()]
+            print(f"[INFO] {row['event'].decode()}/{row['approximant'].decode()} "
+                  f"({row['prior'].decode()}): {row['nsamples']} samples")
+        if not compress:
+            for name, ds in datasets.items():
+                # make sure every column is allocated so it can be memory-mapped
+                if ds.id.get_offset() is None:
+                    ds[:1] = ds[:1]
+    print(f"[INFO] Wrote {len(entries)} posteriors, {len(columns)} columns to {output_file}")
+    return output_file
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--root", default=REPO_ROOT,
+                        help="Directory holding the gw* event directories")
+    parser.add_argument("--output-file", default="posteriors_archive.hdf")
+    parser.add_argument("--extra", type=parse_extra, action="append", default=[],
+                        metavar="EVENT:NAME=PATH",
+                        help="Additional posterior, e.g. a comparison analysis")
+    parser.add_argument("--compress", action="store_true",
+                        help="Chunked gzip columns instead of memory-mappable ones")
+    opts = parser.parse_args(args)
+    build_archive(find_posteriors(opts.root) + opts.extra, opts.output_file,
+                  compress=opts.compress)
+
+
+if __name__ == "__main__":
+    main()
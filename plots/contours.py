@@ -0,0 +1,188 @@
+"""Credible-region contours for every 2D panel of a corner plot at once.
+
+corner.corner bins, smooths and contours each off-diagonal panel on its
+own, so overlaying six models on a 6-parameter corner plot builds 90 2D
+histograms one by one. corner_contours does the same work per model in
+bulk:
+
+- the bin index of every sample in every parameter is computed once, and
+  all pairwise 2D histograms are filled by a single bincount over the
+  sample matrix;
+- the histograms are smoothed together with a separable Gaussian applied
+  in Fourier space (the same kernel, in bins, as corner's ``smooth``,
+  including its reflecting edges);
+- the density threshold enclosing each credible level is found from one
+  sort per panel, as in corner;
+- the contour lines at those thresholds are traced with contourpy on
+  corner's edge-extended grid.
+
+The result is a dict of plain arrays, so it can be cached on disk with
+kde_cache.cached and computed in a worker process:
+
+    contours = cached_corner_contours(samples, ranges, bins=35, smooth=2.0, levels=[0.9])
+    draw_contours(axes, contours, color="green", linewidths=1.0)
+
+draw_contours puts the lines onto the axes grid of a corner figure. Unlike
+corner it does not fill the inside of the contours with the background
+colour, so overlaid models do not hide each other's contours.
+"""
+import contourpy
+import numpy as np
+from matplotlib.collections import LineCollection
+
+from kde_cache import cached
+
+# Rows of the sample matrix binned per bincount call
+CHUNK = 2 ** 16
+# gaussian_filter's default kernel truncation, in standard deviations
+TRUNCATE = 4.0
+
+
+def bin_indices(samples, ranges, bins):
+    """Bin of every sample in every column on [lo, hi] ranges; -1 outside."""
+    lo = np.array([r[0] for r in ranges], dtype=float)
+    hi = np.array([r[1] for r in ranges], dtype=float)
+    with np.errstate(invalid="ignore"):
+        pos = (samples - lo) / (hi - lo) * bins
+        idx = np.floor(pos).astype(np.int64)
+        # the upper edge belongs to the last bin, as in np.histogram2d
+        idx[samples == hi] = bins - 1
+        idx[~((samples >= lo) & (samples <= hi))] = -1
+    return idx
+
+
+def pairwise_histograms(samples, ranges, bins=35, weights=None, pairs=None):
+    """(pairs, counts) of all 2D histograms of a (n, m) sample matrix.
+
+    ``pairs`` lists (x column, y column); by default every (j, i) with
+    j < i, the lower triangle of a corner plot. counts[k] is the histogram
+    of pair k with x along the first axis, like np.histogram2d.
+    """
+    samples = np.asarray(samples, dtype=float)
+    nparams = samples.shape[1]
+    if pairs is None:
+        pairs = [(j, i) for i in range(nparams) for j in range(i)]
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    ncells = bins * bins
+    # one bin past the last panel collects the samples outside a panel's range
+    dump = len(pairs) * ncells
+    offsets = np.arange(len(pairs)) * ncells
+    counts = np.zeros(dump + 1)
+    for start in range(0, len(samples), CHUNK):
+        idx = bin_indices(samples[start:start + CHUNK], ranges, bins)
+        ix, iy = idx[:, pairs[:, 0]], idx[:, pairs[:, 1]]
+        flat = np.where((ix >= 0) & (iy >= 0), offsets + ix * bins + iy, dump)
+        w = None
+        if weights is not None:
+            w = np.repeat(np.asarray(weights, dtype=float)[start:start + CHUNK], len(pairs))
+        counts += np.bincount(flat.ravel(), w, minlength=dump + 1)
+    return pairs, counts[:dump].reshape(len(pairs), bins, bins)
+
+
+def gaussian_smooth(grids, sigma):
+    """Smooth the last two axes with a Gaussian of ``sigma`` bins.
+
+    Equivalent to scipy.ndimage.gaussian_filter(grid, sigma) for every
+    grid: the grids are padded by reflection and convolved in Fourier
+    space, one axis after the other.
+    """
+    if not sigma:
+        return grids
+    pad = int(np.ceil(TRUNCATE * sigma))
+    widths = [(0, 0)] * (grids.ndim - 2) + [(pad, pad), (pad, pad)]
+    padded = np.pad(grids, widths, mode="symmetric")
+    for axis in (-2, -1):
+        n = padded.shape[axis]
+        kernel = np.exp(-0.5 * (2 * np.pi * np.fft.rfftfreq(n) * sigma) ** 2)
+        padded = np.fft.irfft(np.fft.rfft(padded, axis=axis)
+                              * np.expand_dims(kernel, -1 if axis == -2 else 0), n, axis=axis)
+    return padded[..., pad:-pad, pad:-pad]
+
+
+def credible_thresholds(grids, levels):
+    """Density thresholds enclosing each credible level, one row per grid."""
+    flat = grids.reshape(len(grids), -1)
+    ordered = -np.sort(-flat, axis=1)
+    cumulative = np.cumsum(ordered, axis=1)
+    cumulative /= cumulative[:, -1:]
+    thresholds = np.empty((len(grids), len(levels)))
+    for k, level in enumerate(levels):
+        last = np.maximum((cumulative <= level).sum(axis=1) - 1, 0)
+        thresholds[:, k] = ordered[np.arange(len(grids)), last]
+    thresholds.sort(axis=1)
+    # contour levels must increase strictly; nudge repeats as corner does
+    for row in thresholds:
+        repeated = np.diff(row) == 0
+        while np.any(repeated):
+            row[np.where(repeated)[0][0]] *= 1.0 - 1e-4
+            repeated = np.diff(row) == 0
+        row.sort()
+    return thresholds
+
+
+def extended_grid(grid, edges_x, edges_y):
+    """corner's grid of bin centres, extended by two cells to close contours."""
+    def centres(edges):
+        c = 0.5 * (edges[1:] + edges[:-1])
+        return np.concatenate([c[0] + np.array([-2, -1]) * (c[1] - c[0]), c,
+                               c[-1] + np.array([1, 2]) * (c[-1] - c[-2])])
+    nx, ny = grid.shape
+    extended = np.full((nx + 4, ny + 4), grid.min())
+    extended[2:-2, 2:-2] = grid
+    extended[2:-2, 1], extended[2:-2, -2] = grid[:, 0], grid[:, -1]
+    extended[1, 2:-2], extended[-2, 2:-2] = grid[0], grid[-1]
+    extended[1, 1], extended[1, -2] = grid[0, 0], grid[0, -1]
+    extended[-2, 1], extended[-2, -2] = grid[-1, 0], grid[-1, -1]
+    return centres(edges_x), centres(edges_y), extended
+
+
+def corner_contours(samples, ranges, bins=35, smooth=None, levels=(0.9,), weights=None):
+    """Contour lines of the credible ``levels`` in every 2D corner panel.
+
+    Returns a dict of arrays: ``pairs`` (x, y column of each panel),
+    ``thresholds`` (per panel and level), and the lines as ``vertices``
+    with, per line, its panel, level and end offset in ``lines``.
+    """
+    pairs, counts = pairwise_histograms(samples, ranges, bins, weights)
+    grids = gaussian_smooth(counts, smooth)
+    thresholds = credible_thresholds(grids, levels)
+    edges = [np.linspace(lo, hi, bins + 1) for lo, hi in ranges]
+    vertices, lines, end = [], [], 0
+    for k, (jx, jy) in enumerate(pairs):
+        x, y, z = extended_grid(grids[k], edges[jx], edges[jy])
+        generator = contourpy.contour_generator(x, y, z.T, line_type=contourpy.LineType.Separate)
+        for level, threshold in enumerate(thresholds[k]):
+            for line in generator.lines(threshold):
+                vertices.append(line)
+                end += len(line)
+                lines.append((k, level, end))
+    return {"pairs": pairs, "thresholds": thresholds,
+            "vertices": np.concatenate(vertices) if vertices else np.empty((0, 2)),
+            "lines": np.array(lines, dtype=np.int64).reshape(-1, 3)}
+
+
+def cached_corner_contours(samples, ranges, bins=35, smooth=None, levels=(0.9,), weights=None):
+    """corner_contours(), memoised on disk (see kde_cache)."""
+    params = {"ranges": [list(map(float, r)) for r in ranges], "bins": bins,
+              "smooth": smooth, "levels": list(levels)}
+    return cached("corner_contours", [np.asarray(samples), weights], params,
+                  lambda: corner_contours(samples, ranges, bins, smooth, levels, weights))
+
+
+def panel_lines(contours, k):
+    """Vertex arrays of the lines in panel k."""
+    starts = np.concatenate([[0], contours["lines"][:-1, 2]])
+    return [contours["vertices"][start:end]
+            for start, (panel, _, end) in zip(starts, contours["lines"]) if panel == k]
+
+
+def draw_contours(axes, contours, color, **kwargs):
+    """Add the lines of each panel to axes[y column, x column] of a corner figure.
+
+    Extra keyword arguments (linewidths, linestyles, ...) go to LineCollection.
+    """
+    for k, (jx, jy) in enumerate(contours["pairs"]):
+        lines = panel_lines(contours, k)
+        if lines:
+            axes[jy, jx].add_collection(LineCollection(lines, colors=color, **kwargs),
+                                        autolim=False)
@@ -1,10 +1,14 @@
 import numpy as np
-import h5py
 import corner
 import matplotlib.pyplot as plt
 from matplotlib.patches import Patch
 from matplotlib.lines import Line2D
-from scipy.stats import gaussian_kde
+
+import posterior_store
+from contours import cached_corner_contours, draw_contours
+from kde_cache import kde_curve
+from parallel import parallel_map
+from posterior_stats import cached_describe
 
 # Parameter setup - Keep all 6 parameters
 param_labels = [
@@ -30,17 +34,12 @@ seobHM_file = "/home/kkacanja/ecc_pe/gw200105/seobHM/workflow/pos.hdf"
 planes_file = "/home/kkacanja/ecc_pe/gw200105/comparisons/converted_posteriors_pycbc_format.hdf"
 morras_file = "/home/kkacanja/ecc_pe/gw200105/comparisons/converted_posteriors_pycbc_format_morras.hdf"
 
-# Corrected load_samples function
 def load_samples(fname, param_names):
-    with h5py.File(fname, "r") as f:
-        data_columns = []
-        for p in param_names:
-            try:
-                data_columns.append(f[f"samples/{p}"][:])
-            except KeyError:
-                print(f"Error: Parameter '{p}' not found in '{fname}'. Please check the HDF5 structure.")
-                raise
-        return np.vstack(data_columns).T
+    try:
+        return posterior_store.load_samples(fname, param_names)
+    except KeyError as e:
+        print(f"Error: {e.args[0]}. Please check the HDF5 structure.")
+        raise
 
 # Load samples
 teob_samples = load_samples(teob_file, param_names_teob)
@@ -119,28 +118,52 @@ model_colors = {
     "morras": "#AE78C3"  # PURPLE
 }
 
+# 90% contour settings: Gaussian smoothing (in bins) and line style per model
+contour_smooth = {
+    "teob": 1.4,
+    "seob": 2.0,
+    "teobHM": 1.4,
+    "seobHM": 2.0,
+    "planes": 2.0,
+    "morras": 2.0
+}
+contour_styles = {
+    "teob": {"linewidths": 1.2, "linestyles": "dashdot"},
+    "seob": {"linewidths": 1.0},
+    "teobHM": {"linewidths": 1.2, "linestyles": "dashdot"},
+    "seobHM": {"linewidths": 1.0, "linestyles": "-"},
+    "planes": {"linewidths": 1.3, "linestyles": "dotted"},
+    "morras": {"linewidths": 1.2, "linestyles": "dashed"}
+}
+
+def model_contours(model_name):
+    """90% contours of every 2D panel of one model; runs in a worker process."""
+    return cached_corner_contours(all_samples[model_name], ranges_for_plot, bins=35,
+                                  smooth=contour_smooth[model_name], levels=[0.9])
+
+all_contours = dict(zip(all_samples, parallel_map(model_contours, all_samples)))
+
 # --- Custom plotting function for 1D histograms ---
 def plot_1d_histogram(ax, x, **kwargs):
     color = kwargs.get('color', 'black')
     smooth = kwargs.get('smooth', 1.0)
     weights = kwargs.get('weights', None)
 
-    x = x[np.isfinite(x)]
+    finite = np.isfinite(x)
+    x = x[finite]
     if len(x) == 0:
         return
 
     if weights is not None:
-        weights = weights[np.isfinite(x)]
+        weights = weights[finite]
 
     if len(np.unique(x)) == 1:
         ax.axvline(x[0], color=color, linestyle='-', linewidth=kwargs.get('lw', 1.0) * 1.5)
         return
 
-    kde = gaussian_kde(x, weights=weights) if weights is not None else gaussian_kde(x)
-
     x_min, x_max = ax.get_xlim()
     kde_eval_x = np.linspace(x_min, x_max, 500)
-    pdf_kde = kde.evaluate(kde_eval_x)
+    pdf_kde = kde_curve(x, kde_eval_x, weights=weights)
 
     ax.fill_between(kde_eval_x, 0, pdf_kde, color=color, alpha=0.2)
     ax.plot(kde_eval_x, pdf_kde, color=color, linewidth=kwargs.get('lw', 1.0))
@@ -155,16 +178,13 @@ fig = corner.corner(
     label_kwargs={"fontsize": 14},
     color=model_colors["teob"],
     bins=35,
-    smooth=1.4,
     hist_kwargs={"density": True},
-    contour_kwargs={"linewidths": 1.2, "linestyles": "dashdot"},
     quantiles=[],
-    levels=[0.9],
     show_titles=False,
     show_scatter=False,
     plot_datapoints=False,
     plot_density=False, # No 2D shading
-    plot_contours=True,
+    plot_contours=False, # drawn below from contours.py
     range=ranges_for_plot,
     plot_fn=plot_1d_histogram
 )
@@ -175,16 +195,13 @@ corner.corner(
     fig=fig,
     color=model_colors["planes"],
     bins=35,
-    smooth=2.0,
     quantiles=[],
-    levels=[0.9],
     hist_kwargs={"density": True},
-    contour_kwargs={"linewidths": 1.3, "linestyles": "dotted"},
     show_titles=False,
     show_scatter=False,
     plot_datapoints=False,
     plot_density=False, # No 2D shading
-    plot_contours=True,
+    plot_contours=False, # drawn below from contours.py
     range=ranges_for_plot,
     plot_fn=plot_1d_histogram
 )
@@ -195,16 +212,13 @@ corner.corner(
     fig=fig,
     color=model_colors["morras"],
     bins=35,
-    smooth=2.0,
     quantiles=[],
-    levels=[0.9],
     hist_kwargs={"density": True},
-    contour_kwargs={"linewidths": 1.2, "linestyles": "dashed"},
     show_titles=False,
     show_scatter=False,
     plot_datapoints=False,
     plot_density=False, # No 2D shading
-    plot_contours=True,
+    plot_contours=False, # drawn below from contours.py
     range=ranges_for_plot,
     plot_fn=plot_1d_histogram
 )
@@ -215,16 +229,13 @@ corner.corner(
     fig=fig,
     color=model_colors["teobHM"],
     bins=35,
-    smooth=1.4,
     hist_kwargs={"density": True},
-    contour_kwargs={"linewidths": 1.2, "linestyles": "dashdot"},
     quantiles=[],
-    levels=[0.9],
     show_titles=False,
     show_scatter=False,
     plot_datapoints=False,
     plot_density=False, # No 2D shading
-    plot_contours=True,
+    plot_contours=False, # drawn below from contours.py
     range=ranges_for_plot,
     plot_fn=plot_1d_histogram
 )
@@ -235,16 +246,13 @@ corner.corner(
     fig=fig,
     color=model_colors["seobHM"],
     bins=35,
-    smooth=2.0,
     hist_kwargs={"density": True},
-    contour_kwargs={"linewidths": 1.0, "linestyles": "-"},
     quantiles=[],
-    levels=[0.9],
     show_titles=False,
     show_scatter=False,
     plot_datapoints=False,
     plot_density=False, # No 2D shading
-    plot_contours=True,
+    plot_contours=False, # drawn below from contours.py
     range=ranges_for_plot,
     plot_fn=plot_1d_histogram
 )
@@ -255,16 +263,13 @@ corner.corner(
     fig=fig,
     color=model_colors["seob"],
     bins=35,
-    smooth=2.0,
     hist_kwargs={"density": True},
-    contour_kwargs={"linewidths": 1.0},
     quantiles=[],
-    levels=[0.9],
     show_titles=False,
     show_scatter=False,
     plot_datapoints=False,
     plot_density=False, # No 2D shading
-    plot_contours=True,
+    plot_contours=False, # drawn below from contours.py
     range=ranges_for_plot,
     plot_fn=plot_1d_histogram
 )
@@ -273,6 +278,11 @@ corner.corner(
 plt.subplots_adjust(top=0.88)
 axes = np.array(fig.axes).reshape(len(param_labels), len(param_labels))
 
+# Contours in the same stacking order as the corner calls above (SEOB on top)
+for model_name in ["teob", "planes", "morras", "teobHM", "seobHM", "seob"]:
+    draw_contours(axes, all_contours[model_name], model_colors[model_name],
+                  **contour_styles[model_name])
+
 # Helper to get label string
 def get_label(i):
     if i == 2:
@@ -281,29 +291,26 @@ def get_label(i):
         return param_labels[i].strip("$")
 
 # Calculate max density for each parameter across all models for Y-axis limits
-max_y_densities = np.zeros(num_params)
-for i in range(num_params):
-    current_max_density = 0.0
-    for model_name, samples in all_samples.items():
+def peak_densities(model_name):
+    """Peak KDE density of every parameter of one model; runs in a worker process."""
+    samples = all_samples[model_name]
+    peaks = np.zeros(num_params)
+    for i in range(num_params):
         data = samples[:, i]
         data = data[np.isfinite(data)]
         if len(data) == 0 or len(np.unique(data)) == 1:
             continue
-        kde = gaussian_kde(data, bw_method='scott') # Use default bandwidth method
         x_eval = np.linspace(np.min(data), np.max(data), 500)
         if len(x_eval) > 1:
-            pdf_kde = kde.evaluate(x_eval)
-            current_max_density = max(current_max_density, np.max(pdf_kde))
-    max_y_densities[i] = current_max_density
-
-# Hardcoded eccentricity error values, plotting KDE is distorting the values
-ecc_error_values = {
-    "seobHM": {"med": 0.125, "em": 0.082, "ep": 0.029},
-    "teobHM": {"med": 0.135, "em": 0.088, "ep": 0.019},
-    "teob": {"med": 0.137, "em": 0.092, "ep": 0.021},
-    "seob": {"med": 0.139, "em": 0.092, "ep": 0.020},
-    "morras": {"med": 0.145, "em": 0.097, "ep": 0.007},
-}
+            pdf_kde = kde_curve(data, x_eval, bw_method='scott') # Use default bandwidth method
+            peaks[i] = np.max(pdf_kde)
+    return peaks
+
+max_y_densities = np.max(parallel_map(peak_densities, all_samples), axis=0)
+
+# Median and 68% equal-tailed interval of every parameter of every model, from
+# the samples in one pass per model (see posterior_stats.py; cached on disk)
+model_stats = {name: cached_describe(samples, hpd=False) for name, samples in all_samples.items()}
 
 
 # Add titles with median and 1-sigma intervals and set Y-limits for diagonal plots
@@ -318,20 +325,9 @@ for i in range(len(param_labels)):
         ax.set_ylim(0, 1) # Default small limit if no density
 
     def extract_stats(samples_array, param_index, model_name=None):
-        # Handle eccentricity with hardcoded values
-        if param_index == 2 and model_name in ecc_error_values:
-            stats = ecc_error_values[model_name]
-            return stats["med"], stats["em"], stats["ep"]
-
-        # Original calculation for other parameters or models not in hardcoded list
-        data = samples_array[:, param_index]
-        if len(np.unique(data)) == 1:
-            val = data[0]
-            return val, 0.0, 0.0
-        med = np.median(data)
-        lower = np.percentile(data, 16)
-        upper = np.percentile(data, 84)
-        return med, med - lower, upper - med
+        stats = model_stats[model_name]
+        med = stats["median"][param_index]
+        return med, med - stats["eq68_low"][param_index], stats["eq68_high"][param_index] - med
 
     label = get_label(i)
 
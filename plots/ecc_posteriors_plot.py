@@ -1,10 +1,13 @@
-import h5py
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-from scipy.stats import gaussian_kde
 import os
 
+from kde_cache import kde_curve
+from parallel import parallel_map
+from posterior_stats import describe
+from posterior_store import get_samples, has_samples, open_archive
+
 sns.set_theme(style="whitegrid")
 
 waveform_files = {
@@ -46,6 +49,10 @@ waveform_files = {
     },
 }
 
+# Built with build_archive.py; when present all posteriors come from this one file
+archive_file = "/home/kkacanja/ecc_pe/plots/posteriors_archive.hdf"
+archive = open_archive(archive_file) if os.path.exists(archive_file) else None
+
 output_dir = "/home/kkacanjaecc_pe/plots/"
 os.makedirs(output_dir, exist_ok=True)
 
@@ -57,45 +64,42 @@ model_colors = {
 }
 
 def kde_with_reflection(data, bw_smoothing=0.01, grid_points=1000):
-    reflected_data = np.concatenate([-data[data < 0.02], data])
-    kde = gaussian_kde(reflected_data, bw_method=bw_smoothing)
+    # Eccentricity priors start at zero; correct the KDE at that edge
     x_vals = np.linspace(0, np.max(data) * 1.1 if len(data) > 0 else 0.1, grid_points)
-    y_vals = kde(x_vals)
-    y_vals *= 2
+    y_vals = kde_curve(data, x_vals, bw_method=bw_smoothing, low=0.0)
     return x_vals, y_vals
 
-def plot_kde_with_intervals(ax, data, model_name, color, kde_bandwidth, credible_interval_type):
-    median = np.percentile(data, 50)
-    credible_interval_text = ""
+def kde_with_intervals(data, kde_bandwidth, credible_interval_type):
+    """Density curve, legend text and interval lines of one posterior."""
+    stats = describe(data, hpd=False)
+    x_vals, y_vals = kde_with_reflection(data, bw_smoothing=kde_bandwidth)
+    result = {"x": x_vals, "y": y_vals, "text": "", "lines": []}
 
     if credible_interval_type == 'upper_bound':
-        e_90_percentile = np.percentile(data, 90)
-        credible_interval_text = f'$e < {e_90_percentile:.3f}$ (90%)'
-        x_vals, y_vals = kde_with_reflection(data, bw_smoothing=kde_bandwidth)
-        ax.plot(x_vals, y_vals, label=f"{model_name}: {credible_interval_text}", color=color, linewidth=2)
-        ax.axvline(e_90_percentile, color=color, linestyle="--", alpha=0.7, linewidth=1.2)
+        e_90_percentile = stats["ub90"][0]
+        result["text"] = f'$e < {e_90_percentile:.3f}$ (90%)'
+        result["lines"] = [(e_90_percentile, "--", 1.2)]
 
     elif credible_interval_type == 'symmetric':
-        e_5 = np.percentile(data, 5)
-        e_95 = np.percentile(data, 95)
+        median = stats["median"][0]
+        e_5, e_95 = stats["eq90_low"][0], stats["eq90_high"][0]
         lower_error = median - e_5
         upper_error = e_95 - median
-        credible_interval_text = f'$e = {median:.3f}^{{+{upper_error:.3f}}}_{{-{lower_error:.3f}}}$'
-        x_vals, y_vals = kde_with_reflection(data, bw_smoothing=kde_bandwidth)
-        ax.plot(x_vals, y_vals, label=f"{model_name}: {credible_interval_text}", color=color, linewidth=2)
-        ax.axvline(median, color=color, linestyle="-", alpha=0.7, linewidth=1.5)
-        ax.axvline(e_5, color=color, linestyle="--", alpha=0.7, linewidth=1.2)
-        ax.axvline(e_95, color=color, linestyle="--", alpha=0.7, linewidth=1.2)
+        result["text"] = f'$e = {median:.3f}^{{+{upper_error:.3f}}}_{{-{lower_error:.3f}}}$'
+        result["lines"] = [(median, "-", 1.5), (e_5, "--", 1.2), (e_95, "--", 1.2)]
     else:
         print(f"Warning: Unknown credible_interval_type '{credible_interval_type}'")
-        x_vals, y_vals = kde_with_reflection(data, bw_smoothing=kde_bandwidth)
-        ax.plot(x_vals, y_vals, label=f"{model_name}", color=color, linewidth=2)
+    return result
 
-fig, axs = plt.subplots(2, 3, figsize=(18, 10))
-axs = axs.flatten()
+def plot_kde_with_intervals(ax, result, model_name, color):
+    label = f"{model_name}: {result['text']}" if result["text"] else f"{model_name}"
+    ax.plot(result["x"], result["y"], label=label, color=color, linewidth=2)
+    for x, linestyle, linewidth in result["lines"]:
+        ax.axvline(x, color=color, linestyle=linestyle, alpha=0.7, linewidth=linewidth)
 
-for idx, (source_name, models) in enumerate(waveform_files.items()):
-    ax = axs[idx]
+def event_curves(item):
+    """Curves of every model of one event; runs in a worker process."""
+    source_name, models = item
 
     if source_name == "GW200105":
         kde_bw = 0.14
@@ -104,21 +108,38 @@ for idx, (source_name, models) in enumerate(waveform_files.items()):
         kde_bw = 0.3
         interval_type = 'upper_bound'
 
+    curves = {}
     for model_name, file_path in models.items():
+        if archive is not None and archive.has(source_name, model_name):
+            data = archive.get(source_name, model_name, "eccentricity")
+            curves[model_name] = kde_with_intervals(data, kde_bw, interval_type)
+            continue
         if not os.path.exists(file_path):
             print(f"Warning: Missing file {file_path}. Skipping.")
             continue
 
         try:
-            with h5py.File(file_path, "r") as f:
-                if "samples" in f and "eccentricity" in f["samples"]:
-                    data = f["samples/eccentricity"][:]
-                    plot_kde_with_intervals(ax, data, model_name.upper(), model_colors[model_name], kde_bw, interval_type)
-                else:
-                    print(f"Warning: Missing 'samples/eccentricity' in {file_path}. Skipping.")
+            if has_samples(file_path, "eccentricity"):
+                data = get_samples(file_path, "eccentricity")
+                curves[model_name] = kde_with_intervals(data, kde_bw, interval_type)
+            else:
+                print(f"Warning: Missing 'samples/eccentricity' in {file_path}. Skipping.")
         except Exception as e:
             print(f"Error processing {file_path}: {e}. Skipping.")
             continue
+    return curves
+
+# Compute every event in parallel, then draw on the main process
+all_curves = parallel_map(event_curves, waveform_files.items())
+
+fig, axs = plt.subplots(2, 3, figsize=(18, 10))
+axs = axs.flatten()
+
+for idx, (source_name, curves) in enumerate(zip(waveform_files, all_curves)):
+    ax = axs[idx]
+
+    for model_name, result in curves.items():
+        plot_kde_with_intervals(ax, result, model_name.upper(), model_colors[model_name])
 
     ax.set_title(f"{source_name}", fontsize=16)
     ax.set_xlabel(r"$e$", fontsize=16)
@@ -0,0 +1,74 @@
+"""Export posteriors as memory-mappable per-column .npy files.
+
+For each posteriors.hdf, writes posteriors.columns/ next to it with one
+contiguous, uncompressed <param>.npy per dataset under samples/ and a
+schema.json describing them (source file, its modification time, number
+of samples, dtype and file of every column). posterior_store then opens
+these with np.load(mmap_mode="r") instead of decoding the HDF5 file, as
+long as the source has not changed since the export.
+
+Usage:
+    python export_columns.py ../gw200105/seob/workflow/posteriors.hdf
+    python export_columns.py --all
+"""
+import argparse
+import json
+import os
+
+import h5py
+import numpy as np
+
+from build_archive import REPO_ROOT, find_posteriors
+from posterior_store import GROUP, SCHEMA_NAME, SCHEMA_VERSION, columns_dir, read_schema
+
+
+def export_columns(path, force=False):
+    """Write the column export of one posterior file; returns its directory."""
+    out_dir = columns_dir(path)
+    if not force and read_schema(path) is not None:
+        print(f"[SKIP] {out_dir} is up to date")
+        return out_dir
+    if not h5py.is_hdf5(path):
+        print(f"[SKIP] {path} is not an HDF5 file")
+        return None
+    mtime = os.stat(path).st_mtime_ns
+    os.makedirs(out_dir, exist_ok=True)
+    # drop the old schema first so a partial export is never picked up
+    if os.path.exists(os.path.join(out_dir, SCHEMA_NAME)):
+        os.remove(os.path.join(out_dir, SCHEMA_NAME))
+
+    columns = {}
+    nsamples = None
+    with h5py.File(path, "r") as f:
+        for name, ds in f[GROUP].items():
+            fname = f"{name}.npy"
+            np.save(os.path.join(out_dir, fname), np.ascontiguousarray(ds[()]))
+            columns[name] = {"file": fname, "dtype": ds.dtype.str, "shape": list(ds.shape)}
+            nsamples = len(ds) if nsamples is None else nsamples
+
+    schema = {"version": SCHEMA_VERSION, "source": os.path.abspath(path),
+              "source_mtime_ns": mtime, "nsamples": nsamples, "columns": columns}
+    with open(os.path.join(out_dir, SCHEMA_NAME), "w") as f:
+        json.dump(schema, f, indent=2)
+    print(f"[INFO] Exported {len(columns)} columns of {path}")
+    return out_dir
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", help="posteriors.hdf files to export")
+    parser.add_argument("--all", action="store_true",
+                        help="Export every posterior found under --root")
+    parser.add_argument("--root", default=REPO_ROOT)
+    parser.add_argument("--force", action="store_true",
+                        help="Re-export even if the export is up to date")
+    opts = parser.parse_args(args)
+    files = list(opts.files)
+    if opts.all:
+        files += [path for _, _, _, path in find_posteriors(opts.root)]
+    for path in files:
+        export_columns(path, force=opts.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Binned Gaussian KDE evaluated with an FFT.
+
+scipy.stats.gaussian_kde evaluates every sample at every grid point, which
+is O(N M) per curve. FFTKDE instead spreads the (optionally weighted)
+samples onto a fine regular grid with linear binning, convolves the grid
+with the Gaussian kernel in Fourier space and interpolates the result at
+the requested points: O(N + G log G) for a grid of G cells, independent of
+how many points are asked for.
+
+The interface follows the part of gaussian_kde the plot scripts use:
+
+    kde = FFTKDE(samples, bw_method="scott", weights=None)
+    density = kde(x_grid)          # or kde.evaluate(x_grid)
+
+bw_method is "scott", "silverman", a scalar factor or a callable taking the
+KDE, exactly as for gaussian_kde (the bandwidth is the factor times the
+weighted standard deviation of the samples); ``bandwidth=`` sets the
+kernel width directly instead. One-dimensional data only.
+"""
+import numpy as np
+
+# Grid cells per kernel width; keeps the binning error well below 0.1 per cent
+CELLS_PER_BANDWIDTH = 16
+MIN_GRID = 1024
+MAX_GRID = 2 ** 20
+# The kernel is negligible beyond this many bandwidths
+TAIL = 6.0
+
+
+def linear_binning(x, weights, lo, dx, ngrid):
+    """Spread weighted samples onto the grid lo + dx * arange(ngrid)."""
+    pos = (x - lo) / dx
+    left = np.floor(pos).astype(np.int64)
+    frac = pos - left
+    grid = np.bincount(left, weights * (1 - frac), minlength=ngrid + 1)
+    grid += np.bincount(left + 1, weights * frac, minlength=ngrid + 1)
+    return grid[:ngrid]
+
+
+def smooth_grid(counts, dx, bandwidth, moment=0):
+    """Convolve gridded counts with a unit-area Gaussian of width bandwidth.
+
+    With moment=1 the kernel is u * phi(u), u = (x - sample) / bandwidth,
+    the first partial moment used by boundary corrections. The grid is zero
+    padded by the kernel tail so the circular FFT convolution does not wrap
+    around.
+    """
+    ngrid = len(counts)
+    pad = int(np.ceil(TAIL * bandwidth / dx))
+    nfft = 1 << int(np.ceil(np.log2(ngrid + 2 * pad)))
+    freqs = np.fft.rfftfreq(nfft, d=dx)
+    kernel = np.exp(-0.5 * (2 * np.pi * freqs * bandwidth) ** 2)
+    if moment == 1:
+        # u phi(u) = -h d/dx phi((x - s) / h) / h, a derivative in Fourier space
+        kernel = kernel * (-2j * np.pi * freqs * bandwidth)
+    smoothed = np.fft.irfft(np.fft.rfft(counts, nfft) * kernel, nfft)[:ngrid] / dx
+    return np.clip(smoothed, 0, None) if moment == 0 else smoothed
+
+
+class FFTKDE:
+    """Drop-in replacement for the 1D use of scipy.stats.gaussian_kde."""
+
+    def __init__(self, dataset, bw_method=None, weights=None, bandwidth=None):
+        self.dataset = np.atleast_1d(np.asarray(dataset, dtype=float)).ravel()
+        if self.dataset.size < 2:
+            raise ValueError("FFTKDE needs at least two samples")
+        self.n = self.dataset.size
+        self.d = 1
+        if weights is None:
+            self.weights = np.full(self.n, 1.0 / self.n)
+        else:
+            self.weights = np.asarray(weights, dtype=float).ravel()
+            self.weights = self.weights / self.weights.sum()
+        self.neff = 1.0 / np.sum(self.weights ** 2)
+        mean = np.sum(self.weights * self.dataset)
+        self.data_covariance = np.sum(self.weights * (self.dataset - mean) ** 2) \
+            / (1 - np.sum(self.weights ** 2))
+        if not self.data_covariance > 0:
+            raise ValueError("FFTKDE needs samples with a non-zero spread")
+        self._grid = None
+        if bandwidth is not None:
+            self.set_bandwidth(float(bandwidth) / np.sqrt(self.data_covariance))
+        else:
+            self.set_bandwidth(bw_method)
+
+    def scotts_factor(self):
+        return self.neff ** (-1.0 / (self.d + 4))
+
+    def silverman_factor(self):
+        return (self.neff * (self.d + 2) / 4.0) ** (-1.0 / (self.d + 4))
+
+    def set_bandwidth(self, bw_method=None):
+        if bw_method is None or bw_method == "scott":
+            self.factor = self.scotts_factor()
+        elif bw_method == "silverman":
+            self.factor = self.silverman_factor()
+        elif np.isscalar(bw_method) and not isinstance(bw_method, str):
+            self.factor = float(bw_method)
+        elif callable(bw_method):
+            self.factor = float(bw_method(self))
+        else:
+            raise ValueError("bw_method should be 'scott', 'silverman', a scalar or a callable")
+        self.covariance = self.data_covariance * self.factor ** 2
+        self.bandwidth = float(np.sqrt(self.covariance))
+        self._grid = None
+
+    def binned(self):
+        """(grid points, binned weights, spacing) covering the samples and kernel tails."""
+        h = self.bandwidth
+        lo = self.dataset.min() - TAIL * h
+        hi = self.dataset.max() + TAIL * h
+        ngrid = int(np.clip(2 ** np.ceil(np.log2((hi - lo) / h * CELLS_PER_BANDWIDTH)),
+                            MIN_GRID, MAX_GRID))
+        dx = (hi - lo) / (ngrid - 1)
+        counts = linear_binning(self.dataset, self.weights, lo, dx, ngrid)
+        return lo + dx * np.arange(ngrid), counts, dx
+
+    def grid(self):
+        """(grid points, density) of the smoothed grid, computed once."""
+        if self._grid is None:
+            x, counts, dx = self.binned()
+            self._grid = (x, smooth_grid(counts, dx, self.bandwidth))
+        return self._grid
+
+    def evaluate(self, points):
+        x, density = self.grid()
+        points = np.asarray(points, dtype=float)
+        return np.interp(points.ravel(), x, density, left=0.0, right=0.0).reshape(points.shape)
+
+    __call__ = evaluate
+
+    def pdf(self, points):
+        return self.evaluate(points)
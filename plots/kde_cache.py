@@ -0,0 +1,125 @@
+"""Persistent cache of evaluated densities for the plot scripts.
+
+Re-running a figure script to change colours, fonts or legends recomputes
+every density although the samples have not changed. Results are stored
+here as .npz files named by a hash of everything they depend on: the
+sample (and weight) arrays, the estimator settings such as bandwidth and
+boundary treatment, and the evaluation grid. A later call with identical
+inputs loads the array instead of recomputing it.
+
+The cache lives in $ECC_PE_KDE_CACHE (default ~/.cache/ecc_pe/kde) and is
+kept under a size limit by evicting the least recently used entries.
+
+    from kde_cache import kde_curve
+    density = kde_curve(ecc, x_grid, bw_method=0.01, low=1e-4, high=0.2, space="log10")
+
+Anything else (e.g. 2D contour grids) can be cached with
+``cached(kind, arrays, params, compute)``.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from boundedkde import BoundedKDE
+from fastkde import FFTKDE
+
+CACHE_DIR = os.environ.get("ECC_PE_KDE_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".cache", "ecc_pe", "kde"))
+MAX_BYTES = 512 * 1024 ** 2
+CACHE_VERSION = 1
+
+stats = {"hits": 0, "misses": 0}
+
+
+def array_digest(array, h=None):
+    """Feed an array's dtype, shape and bytes to a blake2b hash."""
+    h = h or hashlib.blake2b(digest_size=20)
+    array = np.ascontiguousarray(array)
+    h.update(f"{array.dtype.str}{array.shape}".encode())
+    h.update(memoryview(array).cast("B"))
+    return h
+
+
+def cache_key(kind, arrays, params):
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{CACHE_VERSION}:{kind}:".encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    for array in arrays:
+        if array is None:
+            h.update(b"none")
+        else:
+            array_digest(array, h)
+    return h.hexdigest()
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    """Delete least recently used entries until the cache fits in max_bytes."""
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".npz"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def cached(kind, arrays, params, compute, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    """compute() -> dict of arrays, loaded from the cache when possible."""
+    path = os.path.join(cache_dir, cache_key(kind, arrays, params) + ".npz")
+    try:
+        with np.load(path) as data:
+            result = {name: data[name] for name in data.files}
+        os.utime(path)  # mark as recently used
+        stats["hits"] += 1
+        return result
+    except (FileNotFoundError, OSError, ValueError):
+        pass
+    stats["misses"] += 1
+    result = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, **result)
+    os.replace(tmp, path)
+    evict(cache_dir, max_bytes)
+    return result
+
+
+def kde_curve(samples, grid, weights=None, bw_method=None, bandwidth=None,
+              low=None, high=None, method="reflection", space="linear"):
+    """Density of samples on grid (FFTKDE, or BoundedKDE with bounds), cached.
+
+    A callable bw_method cannot be keyed reliably (every lambda has the same
+    name), so those densities are computed without the cache.
+    """
+    bounded = low is not None or high is not None or space != "linear"
+    params = {"bw_method": bw_method, "bandwidth": bandwidth}
+    if bounded:
+        params.update(low=low, high=high, method=method, space=space)
+
+    def compute():
+        if bounded:
+            kde = BoundedKDE(samples, bw_method=bw_method, weights=weights,
+                             bandwidth=bandwidth, low=low, high=high,
+                             method=method, space=space)
+        else:
+            kde = FFTKDE(samples, bw_method=bw_method, weights=weights, bandwidth=bandwidth)
+        return {"density": kde(grid)}
+
+    if callable(bw_method):
+        return compute()["density"]
+    kind = "bounded_kde" if bounded else "kde"
+    return cached(kind, [samples, weights, grid], params, compute)["density"]
+
+
+def clear(cache_dir=CACHE_DIR):
+    evict(cache_dir, max_bytes=0)
@@ -1,7 +1,9 @@
-import h5py
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.stats import gaussian_kde
+
+from kde_cache import kde_curve
+from posterior_stats import describe
+from posterior_store import get_samples
 
 # File paths
 paths = {
@@ -27,19 +29,16 @@ labels = {
     "seob_log": "SEOBNRv5EHM (LOG (2,2) MODE) $e_{{\\min}} = 10^{{-4}}$"
 }
 
-def get_percentile(data, percentile):
-    return np.percentile(data, percentile)
-
 # Load and process each dataset
 results = {}
 for key, path in paths.items():
-    with h5py.File(path, "r") as f:
-        ecc = f["samples/eccentricity"][:]
+    ecc = get_samples(path, "eccentricity")
+    stats = describe(ecc, hpd=False)
     results[key] = {
         "eccentricity": ecc,
-        "median": get_percentile(ecc, 50),
-        "lower": get_percentile(ecc, 5),
-        "upper": get_percentile(ecc, 95)
+        "median": stats["median"][0],
+        "lower": stats["eq90_low"][0],
+        "upper": stats["eq90_high"][0]
     }
 
 # Plot setup
@@ -55,56 +54,27 @@ hist_bins = np.logspace(np.log10(x_grid_min), np.log10(x_grid_max), num_hist_bin
 for key, res in results.items():
     ecc = res["eccentricity"]
 
-    if key == "teob_log":
-        e_min_boundary = 1e-4
-        kde_bandwidth_log_ecc = 0.01
-    elif key == "seob_log":
+    if key in ["seob_log", "teob_log"]:
+        # uniform_log10 prior on [1e-4, 0.2]: estimate in log10(e), corrected at both edges
         e_min_boundary = 1e-4
         kde_bandwidth_log_ecc = 0.01
-    else:
-        e_min_boundary = 0.0
-        kde_bandwidth_linear_ecc = 0.005
-
-    if key in ["seob_log", "teob_log"]:
-        valid_ecc_samples_linear = ecc[ecc >= e_min_boundary]
-
-        if len(valid_ecc_samples_linear) == 0:
-            print(f"Warning: No valid eccentricity samples for KDE for {key} after filtering for reflection. Skipping KDE plot.")
+        if not np.any(ecc >= e_min_boundary):
+            print(f"Warning: No valid eccentricity samples for KDE for {key}. Skipping KDE plot.")
             continue
 
-        log_ecc_samples = np.log10(valid_ecc_samples_linear)
-        log_e_min_boundary = np.log10(e_min_boundary)
-        reflected_log_ecc = (2 * log_e_min_boundary) - log_ecc_samples
-        combined_log_ecc = np.concatenate((log_ecc_samples, reflected_log_ecc))
-        kde_log = gaussian_kde(combined_log_ecc, bw_method=kde_bandwidth_log_ecc)
-        log_x_grid = np.log10(x_grid)
-        y_kde_log_raw = kde_log(log_x_grid)
-        y_kde_log_raw[log_x_grid < log_e_min_boundary] = 0.0
-        y_kde_log_scaled_by_reflection = y_kde_log_raw * 2.0
-        y_kde_linear = y_kde_log_scaled_by_reflection / (x_grid * np.log(10))
-        area_y_kde_linear = np.trapz(y_kde_linear, x_grid)
-        if area_y_kde_linear > 0:
-            y_kde_normalized = y_kde_linear / area_y_kde_linear
-        else:
-            y_kde_normalized = y_kde_linear
-            print(f"Warning: Area under KDE for {key} is zero or negative. Not normalizing.")
+        y_kde_normalized = kde_curve(ecc, x_grid, bw_method=kde_bandwidth_log_ecc,
+                                     low=e_min_boundary, high=x_grid_max, space="log10")
 
         label_to_use = labels[key]
         plt.plot(x_grid, y_kde_normalized, color=colors[key], label=label_to_use, linewidth=2, linestyle='--')
 
     else:
-        kde = gaussian_kde(ecc, bw_method=0.2)
+        # uniform prior on [0, 0.2]
         median = res["median"]
         lower = res["lower"]
         upper = res["upper"]
         label_to_use = f"{labels[key]}: $e = {median:.3f}^{{+{upper - median:.3f}}}_{{-{median - lower:.3f}}}$"
-        y_kde_raw = kde(x_grid)
-        area_kde = np.trapz(y_kde_raw, x_grid)
-        if area_kde > 0:
-            y_kde_normalized = y_kde_raw / area_kde
-        else:
-            y_kde_normalized = y_kde_raw
-            print(f"Warning: Area under KDE for {key} is zero. Not normalizing.")
+        y_kde_normalized = kde_curve(ecc, x_grid, bw_method=0.2, low=0.0, high=x_grid_max)
 
         plt.plot(x_grid, y_kde_normalized, color=colors[key], label=label_to_use, linewidth=2)
         plt.axvline(lower, color=colors[key], linestyle='dashed', linewidth=1)
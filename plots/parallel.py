@@ -0,0 +1,35 @@
+"""Process pool for the per-event / per-model work of the plot scripts.
+
+The scripts compute densities, intervals and contours for each event or
+model independently and only then draw them onto one figure. parallel_map
+runs the computing part in forked worker processes, so a figure takes
+about as long as its slowest event instead of the sum of all of them;
+drawing stays on the main process.
+
+The number of workers is taken from $ECC_PE_PLOT_PROCESSES (default: one
+per core); 1 runs everything serially in-process, as does a platform
+without fork.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def default_processes():
+    return int(os.environ.get("ECC_PE_PLOT_PROCESSES", os.cpu_count() or 1))
+
+
+def parallel_map(func, items, nprocesses=None):
+    """list(map(func, items)), computed in a pool of forked processes.
+
+    Workers are forked rather than spawned so that the flat plot scripts,
+    which have no ``if __name__ == "__main__"`` guard, are not re-executed
+    in every worker; ``func`` may be any module-level function of them.
+    """
+    items = list(items)
+    nprocesses = min(nprocesses or default_processes(), len(items))
+    if nprocesses <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [func(item) for item in items]
+    with ProcessPoolExecutor(max_workers=nprocesses,
+                             mp_context=multiprocessing.get_context("fork")) as pool:
+        return list(pool.map(func, items))
@@ -0,0 +1,188 @@
+"""Summary statistics of posteriors, for all parameters at once.
+
+describe() reads off, for every column of a sample matrix together: the
+mean, median, equal-tailed (symmetric) and one-sided credible bounds, and
+highest-posterior-density (HPD) intervals, at the 68% and 90% levels.
+Quantiles interpolate like np.percentile. They need one np.partition of
+the columns at the order statistics involved; only the HPD intervals need
+the columns fully sorted, so describe(..., hpd=False) skips the sort.
+
+Run as a script it writes a summary table (CSV, one row per posterior and
+parameter) for every posterior under the repository. Rows of posteriors
+whose file has not changed are kept from the previous table, so
+re-running it only reads new or rewritten files.
+
+Usage:
+    python posterior_stats.py --output-file posterior_summary.csv
+    python posterior_stats.py --output-file posterior_summary.csv \\
+        --extra gw200105:planes=../gw200105/comparisons/converted_posteriors_pycbc_format.hdf
+"""
+import argparse
+import csv
+import os
+
+import h5py
+import numpy as np
+
+from build_archive import REPO_ROOT, find_posteriors, parse_extra
+from kde_cache import cached
+from posterior_store import store
+
+LEVELS = (0.68, 0.9)
+
+
+def _label(level):
+    return f"{round(100 * level)}"
+
+
+def stat_names(levels=LEVELS, hpd=True):
+    names = ["mean", "median"]
+    for level in levels:
+        p = _label(level)
+        names += [f"eq{p}_low", f"eq{p}_high", f"lb{p}", f"ub{p}"]
+        if hpd:
+            names += [f"hpd{p}_low", f"hpd{p}_high"]
+    return names
+
+
+def _order_stats(n, q):
+    """Lower and upper order-statistic indices and weights of linear quantiles."""
+    pos = (n - 1) * np.asarray(q, dtype=float)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, n - 1)
+    return lo, hi, (pos - lo)[:, None]
+
+
+def _quantiles(x, q, presorted=False):
+    """np.percentile-style (linear) quantiles of the columns of x.
+
+    With presorted the columns must already be sorted; otherwise they are
+    partitioned at the order statistics the quantiles need.
+    """
+    lo, hi, frac = _order_stats(x.shape[0], q)
+    if not presorted:
+        x = np.partition(x, np.unique(np.concatenate([lo, hi])), axis=0)
+    return x[lo] * (1 - frac) + x[hi] * frac
+
+
+def _hpd(sorted_x, level):
+    """Shortest intervals holding ``level`` of the samples, per column."""
+    n = sorted_x.shape[0]
+    k = min(max(int(np.ceil(level * n)) - 1, 0), n - 1)
+    if k == 0:
+        return sorted_x[0], sorted_x[0]
+    widths = sorted_x[k:] - sorted_x[:-k]
+    start = np.argmin(widths, axis=0)
+    cols = np.arange(sorted_x.shape[1])
+    return sorted_x[start, cols], sorted_x[start + k, cols]
+
+
+def _describe_finite(x, levels, hpd=True):
+    qs = [0.5]
+    for level in levels:
+        tail = (1 - level) / 2
+        qs += [tail, 1 - tail, 1 - level, level]
+    sorted_x = np.sort(x, axis=0) if hpd else None
+    values = _quantiles(sorted_x, qs, presorted=True) if hpd else _quantiles(x, qs)
+    out = {"mean": x.mean(axis=0), "median": values[0]}
+    for i, level in enumerate(levels):
+        p = _label(level)
+        row = 1 + 4 * i
+        out[f"eq{p}_low"], out[f"eq{p}_high"] = values[row], values[row + 1]
+        out[f"lb{p}"], out[f"ub{p}"] = values[row + 2], values[row + 3]
+        if hpd:
+            out[f"hpd{p}_low"], out[f"hpd{p}_high"] = _hpd(sorted_x, level)
+    return out
+
+
+def describe(samples, levels=LEVELS, hpd=True):
+    """{statistic: array over columns} for an (n,) or (n, m) sample array.
+
+    eqXX_low/high are the equal-tailed XX% interval, lbXX/ubXX the one-sided
+    XX% lower and upper bounds, hpdXX_low/high the XX% HPD interval (left
+    out with hpd=False, which avoids sorting the columns).
+    Columns with non-finite values are summarised over their finite values.
+    """
+    x = np.asarray(samples, dtype=float)
+    if x.ndim == 1:
+        x = x[:, None]
+    finite = np.isfinite(x)
+    if finite.all():
+        return _describe_finite(x, levels, hpd)
+    out = {name: np.full(x.shape[1], np.nan) for name in stat_names(levels, hpd)}
+    for j in range(x.shape[1]):
+        column = x[finite[:, j], j]
+        if len(column):
+            for name, value in _describe_finite(column[:, None], levels, hpd).items():
+                out[name][j] = value[0]
+    return out
+
+
+def cached_describe(samples, levels=LEVELS, hpd=True):
+    """describe(), memoised on disk by a hash of the samples (see kde_cache)."""
+    return cached("describe", [np.asarray(samples)], {"levels": list(levels), "hpd": hpd},
+                  lambda: describe(samples, levels, hpd))
+
+
+def read_summary(path):
+    """{(event, approximant, prior, parameter): row} of a summary table."""
+    rows = {}
+    if not os.path.isfile(path):
+        return rows
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            rows[(row["event"], row["approximant"], row["prior"], row["parameter"])] = row
+    return rows
+
+
+def summary_rows(event, approximant, prior, path, previous, levels=LEVELS):
+    """Rows of one posterior, reused from ``previous`` if the file is unchanged."""
+    mtime = str(os.stat(path).st_mtime_ns)
+    old = [row for key, row in previous.items()
+           if key[:3] == (event, approximant, prior) and row["source_mtime_ns"] == mtime]
+    if old:
+        return old, False
+    names = store.columns(path)
+    stats = describe(store.load(path, names), levels)
+    nsamples = len(store.get(path, names[0]))
+    rows = []
+    for j, name in enumerate(names):
+        row = {"event": event, "approximant": approximant, "prior": prior,
+               "parameter": name, "nsamples": nsamples, "source": path,
+               "source_mtime_ns": mtime}
+        row.update({stat: f"{values[j]:.8g}" for stat, values in stats.items()})
+        rows.append(row)
+    return rows, True
+
+
+def write_summary(sources, output_file, levels=LEVELS):
+    previous = read_summary(output_file)
+    rows, nnew = [], 0
+    for event, approximant, prior, path in sources:
+        if not h5py.is_hdf5(path):
+            print(f"[SKIP] {path} is not an HDF5 file")
+            continue
+        new_rows, changed = summary_rows(event, approximant, prior, path, previous, levels)
+        rows += new_rows
+        nnew += changed
+    fields = ["event", "approximant", "prior", "parameter", "nsamples"] \
+        + stat_names(levels) + ["source", "source_mtime_ns"]
+    with open(output_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"[INFO] Wrote {len(rows)} rows to {output_file} ({nnew} posteriors recomputed)")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--root", default=REPO_ROOT)
+    parser.add_argument("--output-file", default="posterior_summary.csv")
+    parser.add_argument("--extra", type=parse_extra, action="append", default=[],
+                        metavar="EVENT:NAME=PATH")
+    opts = parser.parse_args(args)
+    write_summary(find_posteriors(opts.root) + opts.extra, opts.output_file)
+
+
+if __name__ == "__main__":
+    main()
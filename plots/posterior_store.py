@@ -0,0 +1,270 @@
+"""Shared, cached access to the samples of posterior files.
+
+The plot scripts read the same posteriors.hdf files over and over while a
+figure is iterated on. Here only the columns asked for are read, and the
+decoded arrays are kept in a bounded LRU cache keyed by path, modification
+time and column. Re-running a script in the same session (or another
+script on the same files) does not decode them again, and a rewritten file
+is picked up automatically.
+
+If a file has been exported with export_columns.py, its columns are
+memory-mapped from the .npy files next to it instead (no decoding, no
+copy), as long as the export is newer than the file.
+
+TEOB runs call the mean anomaly ``anomaly`` and SEOB runs ``rel_anomaly``;
+either name finds whichever one a file has.
+
+    from posterior_store import get_samples, load_samples
+    ecc = get_samples(path, "eccentricity")
+    table = load_samples(path, ["mchirp", "q", "eccentricity", "anomaly"])
+"""
+import json
+import os
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+GROUP = "samples"
+
+# Equivalent column names between waveform families
+ALIASES = {
+    "anomaly": ("rel_anomaly",),
+    "rel_anomaly": ("anomaly",),
+}
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# posteriors.hdf -> posteriors.columns/{schema.json,<param>.npy}
+COLUMNS_SUFFIX = ".columns"
+SCHEMA_NAME = "schema.json"
+SCHEMA_VERSION = 1
+
+# Row of the index table of a posterior archive (see build_archive.py)
+INDEX_DTYPE = np.dtype([
+    ("event", "S16"), ("approximant", "S16"), ("hm", "?"), ("prior", "S8"),
+    ("nsamples", "i8"), ("offset", "i8"), ("source", "S256"),
+])
+
+
+def columns_dir(path):
+    return os.path.splitext(os.path.abspath(path))[0] + COLUMNS_SUFFIX
+
+
+def read_schema(path, mtime=None):
+    """Schema of the column export of ``path``, or None if absent or stale."""
+    schema_file = os.path.join(columns_dir(path), SCHEMA_NAME)
+    if not os.path.isfile(schema_file):
+        return None
+    with open(schema_file) as f:
+        schema = json.load(f)
+    mtime = os.stat(path).st_mtime_ns if mtime is None else mtime
+    if schema.get("version") != SCHEMA_VERSION or schema.get("source_mtime_ns") != mtime:
+        return None
+    return schema
+
+
+def canonical(name):
+    """Archive column name of a parameter (aliases share one column)."""
+    return "anomaly" if name == "rel_anomaly" else name
+
+
+class PosteriorStore:
+    """An LRU cache of posterior columns, filled on demand."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.cache = OrderedDict()  # (path, mtime, column) -> array
+        self.layouts = {}  # path -> (mtime, dataset names under samples/, schema)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path):
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns
+
+    def _layout(self, path, mtime, f=None):
+        """(column names, export schema or None) of one file version."""
+        layout = self.layouts.get(path)
+        if layout is None or layout[0] != mtime:
+            schema = read_schema(path, mtime)
+            if schema is not None:
+                names = list(schema["columns"])
+            elif f is None:
+                with h5py.File(path, "r") as f:
+                    return self._layout(path, mtime, f)
+            else:
+                names = list(f[GROUP].keys()) if GROUP in f else []
+            layout = self.layouts[path] = (mtime, names, schema)
+        return layout[1:]
+
+    def columns(self, path):
+        """Dataset names under samples/ (read once per file version)."""
+        return self._layout(*self._key(path))[0]
+
+    def resolve(self, path, name, available=None):
+        """Name of the dataset holding column ``name``, or None."""
+        available = self.columns(path) if available is None else available
+        for candidate in (name,) + ALIASES.get(name, ()):
+            if candidate in available:
+                return candidate
+        return None
+
+    def has(self, path, name):
+        return os.path.exists(path) and self.resolve(path, name) is not None
+
+    def get_columns(self, path, names):
+        """{name: read-only array} for ``names``, reading only uncached ones.
+
+        The missing columns are memory-mapped from the column export when
+        it is current, otherwise read from the HDF5 file in a single open.
+        """
+        path, mtime = self._key(path)
+        out, missing = {}, []
+        for name in names:
+            data = self.cache.get((path, mtime, name))
+            if data is None:
+                missing.append(name)
+            else:
+                self.cache.move_to_end((path, mtime, name))
+                self.hits += 1
+                out[name] = data
+        if not missing:
+            return out
+        available, schema = self._layout(path, mtime)
+        datasets = {name: self.resolve(path, name, available) for name in missing}
+        for name, column in datasets.items():
+            if column is None:
+                raise KeyError(f"Parameter '{name}' not found in '{path}'")
+        if schema is not None:
+            for name, column in datasets.items():
+                data = np.load(os.path.join(columns_dir(path), schema["columns"][column]["file"]),
+                               mmap_mode="r")
+                self._insert((path, mtime, name), data)
+                self.misses += 1
+                out[name] = data
+        else:
+            with h5py.File(path, "r") as f:
+                for name, column in datasets.items():
+                    data = f[f"{GROUP}/{column}"][()]
+                    data.flags.writeable = False
+                    self._insert((path, mtime, name), data)
+                    self.misses += 1
+                    out[name] = data
+        return out
+
+    def get(self, path, name):
+        """Column ``name`` of ``path`` as a read-only array."""
+        return self.get_columns(path, [name])[name]
+
+    def load(self, path, names):
+        """Columns ``names`` stacked into an (nsamples, len(names)) array."""
+        columns = self.get_columns(path, names)
+        return np.column_stack([columns[name] for name in names])
+
+    @staticmethod
+    def _cost(data):
+        # memory maps are backed by the page cache, not by this process
+        return 0 if isinstance(data, np.memmap) else data.nbytes
+
+    def _insert(self, key, data):
+        self.cache[key] = data
+        self.nbytes += self._cost(data)
+        while self.nbytes > self.max_bytes and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.nbytes -= self._cost(old)
+
+    def clear(self):
+        self.cache.clear()
+        self.layouts.clear()
+        self.nbytes = 0
+
+
+class PosteriorArchive:
+    """Read access to an archive written by build_archive.py.
+
+    The index and the layout of every column are read in one open of the
+    file, so looking up a posterior is a dict lookup and its columns are
+    slices of memory-mapped datasets. Compressed archives are read through
+    h5py instead, only the chunks covering the slice.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.layout = {}  # column -> (offset, dtype, shape), offset None if chunked
+        with h5py.File(self.path, "r") as f:
+            self.index = f["index"][()]
+            for name, ds in f[GROUP].items():
+                offset = ds.id.get_offset() if ds.chunks is None else None
+                self.layout[name] = (offset, ds.dtype, ds.shape)
+        self.rows = {}
+        for row in self.index:
+            key = (row["event"].decode(), row["approximant"].decode(), row["prior"].decode())
+            self.rows[key] = row
+        self.maps = {}
+
+    def keys(self):
+        return list(self.rows)
+
+    def has(self, event, approximant, prior="uniform"):
+        return (event.lower(), approximant, prior) in self.rows
+
+    def columns(self):
+        return list(self.layout)
+
+    def column(self, name):
+        """A whole archive column as a read-only memory map, or None if chunked."""
+        name = canonical(name)
+        if name not in self.layout:
+            raise KeyError(f"Parameter '{name}' not found in '{self.path}'")
+        offset, dtype, shape = self.layout[name]
+        if offset is None:
+            return None
+        if name not in self.maps:
+            self.maps[name] = np.memmap(self.path, dtype=dtype, mode="r",
+                                        offset=offset, shape=shape)
+        return self.maps[name]
+
+    def get(self, event, approximant, name, prior="uniform"):
+        """Samples of one parameter of one posterior."""
+        row = self.rows[(event.lower(), approximant, prior)]
+        start, stop = int(row["offset"]), int(row["offset"] + row["nsamples"])
+        column = self.column(name)
+        if column is not None:
+            return column[start:stop]
+        with h5py.File(self.path, "r") as f:
+            return f[f"{GROUP}/{canonical(name)}"][start:stop]
+
+    def load(self, event, approximant, names, prior="uniform"):
+        return np.column_stack([self.get(event, approximant, name, prior) for name in names])
+
+
+_archives = {}
+
+
+def open_archive(path):
+    """The PosteriorArchive of path, reused until the file changes."""
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+    entry = _archives.get(path)
+    if entry is None or entry[0] != mtime:
+        entry = _archives[path] = (mtime, PosteriorArchive(path))
+    return entry[1]
+
+
+# One store per interpreter, shared by every script that imports this module
+store = PosteriorStore()
+
+
+def get_samples(path, name):
+    return store.get(path, name)
+
+
+def load_samples(path, names):
+    return store.load(path, names)
+
+
+def has_samples(path, name):
+    return store.has(path, name)